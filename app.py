@@ -1,12 +1,38 @@
 import os
+import tempfile
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   jsonify, abort)
 from functools import wraps
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message, Likes
+from models import db, connect_db, User, Message, Follows
+from assets import Assets, build_assets
+from caching import CurrentUserCache
+from fragments import FragmentCache
+from metrics import Metrics
+from migrations import migrate, check_plans
+from slow_queries import SlowQueryLog
+from replicas import ReplicaRouter
+from streaming import stream_template
+import pools
+from conditional import (conditional, user_versions, feed_version,
+                         liked_authors_version, message_version,
+                         templates_version, static_version, set_cache_policy)
+from likes import add_like, remove_like, toggle_like, liked_messages_page
+from follows import following_page, followers_page
+from passwords import password_hasher, PasswordHasherBusy
+from counters import (adjust_counters, release_message_counters,
+                      release_user_counters, reconcile_counters)
+from pagination import cursor_from_request, make_page, page_url
+from search import search_users, autocomplete_usernames, search_messages
+from timeline import (fan_out, add_followed_messages, remove_followed_messages,
+                      home_timeline, timeline_key, rebuild_timelines,
+                      trim_timelines, user_messages_page)
 
 CURR_USER_KEY = "curr_user"
 
@@ -17,14 +43,114 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
+# Optional read replicas, comma-separated; see replicas.py.
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica_{i}': url
+    for i, url in enumerate(filter(None, os.environ.get(
+        'DATABASE_REPLICA_URLS', '').split(',')))
+}
+app.config['REPLICA_PIN_SECONDS'] = float(
+    os.environ.get('REPLICA_PIN_SECONDS', 5))
+app.config['REPLICA_MAX_LAG_SECONDS'] = float(
+    os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+app.config['SQLALCHEMY_POOL_SIZE'] = int(
+    os.environ.get('DATABASE_POOL_SIZE', 5))
+app.config['SQLALCHEMY_MAX_OVERFLOW'] = int(
+    os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+app.config['SQLALCHEMY_POOL_TIMEOUT'] = float(
+    os.environ.get('DATABASE_POOL_TIMEOUT', 10))
+app.config['SQLALCHEMY_POOL_RECYCLE'] = int(
+    os.environ.get('DATABASE_POOL_RECYCLE', 1800))
+app.config['DATABASE_POOL_PRE_PING'] = (
+    os.environ.get('DATABASE_POOL_PRE_PING', '1') == '1')
+# 'queue', or 'transaction' behind a transaction-pooling proxy; see pools.py.
+app.config['DATABASE_POOL_MODE'] = os.environ.get('DATABASE_POOL_MODE', 'queue')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['FEED_PAGE_SIZE'] = int(os.environ.get('FEED_PAGE_SIZE', 100))
+app.config['USER_LIST_PAGE_SIZE'] = int(
+    os.environ.get('USER_LIST_PAGE_SIZE', 60))
+# Rows fetched per round trip when streaming the full user listing.
+app.config['STREAM_BATCH_SIZE'] = int(os.environ.get('STREAM_BATCH_SIZE', 500))
+app.config['TIMELINE_DEPTH'] = int(os.environ.get('TIMELINE_DEPTH', 800))
+app.config['TIMELINE_FANOUT_THRESHOLD'] = int(
+    os.environ.get('TIMELINE_FANOUT_THRESHOLD', 10000))
+app.config['CURRENT_USER_CACHE_ENABLED'] = (
+    os.environ.get('CURRENT_USER_CACHE_ENABLED', '1') == '1')
+app.config['CURRENT_USER_CACHE_SIZE'] = int(
+    os.environ.get('CURRENT_USER_CACHE_SIZE', 1024))
+app.config['CURRENT_USER_CACHE_TTL'] = int(
+    os.environ.get('CURRENT_USER_CACHE_TTL', 30))
+# Shared by every worker process; empty to rely on the TTL alone.
+app.config['CURRENT_USER_CACHE_SIGNAL_DIR'] = os.environ.get(
+    'CURRENT_USER_CACHE_SIGNAL_DIR',
+    os.path.join(tempfile.gettempdir(), 'warbler-current-user-cache'))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(
+    os.environ.get('PASSWORD_HASH_MAX_PENDING', 16))
+app.config['PASSWORD_HASH_TIMEOUT'] = int(
+    os.environ.get('PASSWORD_HASH_TIMEOUT', 10))
+app.config['STATIC_MAX_AGE'] = int(os.environ.get('STATIC_MAX_AGE', 3600))
+app.config['ASSETS_BUILD_DIR'] = os.environ.get(
+    'ASSETS_BUILD_DIR', os.path.join(app.root_path, 'build', 'assets'))
+app.config['FRAGMENT_CACHE_BACKEND'] = os.environ.get(
+    'FRAGMENT_CACHE_BACKEND', 'lru')
+app.config['FRAGMENT_CACHE_SIZE'] = int(
+    os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+app.config['FRAGMENT_CACHE_TTL'] = int(
+    os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+if os.environ.get('FRAGMENT_CACHE_PATH'):
+    app.config['FRAGMENT_CACHE_PATH'] = os.environ['FRAGMENT_CACHE_PATH']
+app.config['METRICS_ENABLED'] = (
+    os.environ.get('METRICS_ENABLED', '1') == '1')
+app.config['METRICS_PATH'] = os.environ.get('METRICS_PATH', '/metrics')
+# Scrapers must send it as a bearer token; unset, METRICS_PATH is a 404.
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+app.config['SLOW_QUERY_LOG'] = os.environ.get('SLOW_QUERY_LOG')
+app.config['SLOW_QUERY_THRESHOLD_MS'] = float(
+    os.environ.get('SLOW_QUERY_THRESHOLD_MS', 200))
+app.config['SLOW_QUERY_EXPLAIN_RATE'] = float(
+    os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0))
+app.config['ETAG_VERSION'] = (
+    os.environ.get('ETAG_VERSION') or templates_version(app))
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
 
+replica_router = ReplicaRouter()
+replica_router.init_app(app, db)
+
+current_user_cache = CurrentUserCache()
+current_user_cache.init_app(app)
+
+password_hasher.init_app(app)
+
+assets = Assets()
+assets.init_app(app)
+
+fragment_cache = FragmentCache()
+fragment_cache.init_app(app)
+
+metrics = Metrics()
+metrics.init_app(app)
+metrics.register('current_user_cache', current_user_cache.stats,
+                 'Logged-in user cache')
+metrics.register('fragment_cache', fragment_cache.stats,
+                 'Rendered message fragment cache')
+metrics.register('password_hasher', password_hasher.stats,
+                 'Password hashing pool')
+metrics.register('replicas', replica_router.stats, 'Read replica')
+metrics.register('db_pool', pools.stats, 'Database connection pool')
+
+slow_query_log = SlowQueryLog()
+slow_query_log.init_app(app)
+
+app.jinja_env.globals['page_url'] = page_url
+
 
 ##############################################################################
 # User signup/login/logout
@@ -44,16 +170,65 @@ def page_not_found(e):
     """ Custom 404 page """
     return render_template('404.html'), 404
 
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(e):
+    """ Too many logins/signups are waiting on bcrypt; shed the load """
+    return render_template('503.html'), 503, {'Retry-After': '5'}
+
 @app.before_request
 def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = current_user_cache.get_user(session[CURR_USER_KEY])
     else:
         g.user = None
 
 
+def viewer_following_ids(users):
+    """Ids of `users` the logged-in user follows, as a set.
+
+    Looked up with one query for the whole page; empty when logged out.
+    """
+
+    if g.user is None:
+        return set()
+    return g.user.following_ids_among(user.id for user in users)
+
+
+def viewer_all_following_ids():
+    """Ids of everyone the logged-in user follows, as a set.
+
+    For pages listing users as they stream from the database; empty when
+    logged out.
+    """
+
+    if g.user is None:
+        return set()
+    return {user_id for (user_id,) in
+            db.session.query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == g.user.id)}
+
+
+def viewer_liked_ids(messages):
+    """Ids of `messages` the logged-in user has liked, as a set.
+
+    Looked up with one query for the whole page; empty when logged out.
+    """
+
+    if g.user is None:
+        return set()
+    return g.user.liked_ids_among(msg.id for msg in messages)
+
+
+def viewer_version(*user_ids):
+    """Versions of `user_ids` and the logged-in user, for @conditional."""
+
+    if g.user is not None:
+        user_ids += (g.user.id,)
+    return user_versions(*user_ids)
+
+
 def do_login(user):
     """Log in user."""
 
@@ -106,6 +281,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # Saves the password if it was rehashed at a new cost.
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -131,32 +308,67 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations; matches are ranked and paginated. Without one, every user is
+    streamed from a server-side cursor.
     """
 
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = (User.query.order_by(User.id)
+                 .yield_per(app.config['STREAM_BATCH_SIZE']))
+        return stream_template('users/index.html', users=users, page=None,
+                               following_ids=viewer_all_following_ids())
+
+    page = search_users(search,
+                        per_page=app.config['USER_LIST_PAGE_SIZE'],
+                        cursor=cursor_from_request())
+    return stream_template('users/index.html', users=page.items, page=page,
+                           following_ids=viewer_following_ids(page.items))
+
+
+@app.route('/api/users/autocomplete')
+def autocomplete_users():
+    """JSON list of users whose username starts with the 'q' param."""
+
+    users = autocomplete_usernames(request.args.get('q', ''))
+    return jsonify(users=[
+        {'id': user.id, 'username': user.username, 'image_url': user.image_url}
+        for user in users
+    ])
+
+
+def user_page_version(user_id):
+    """Version of a user's profile page: the user and the viewer."""
+
+    return viewer_version(user_id)
+
+
+def likes_page_version(user_id):
+    """Version of a user's likes page: the user, the viewer and the
+    authors of the liked messages."""
 
-    return render_template('users/index.html', users=users)
+    versions = viewer_version(user_id)
+    if versions is None:
+        return None
+    return versions + liked_authors_version(user_id)
 
 
 @app.route('/users/<int:user_id>')
+@conditional(user_page_version)
 def users_show(user_id):
     """Show user profile."""
 
     user = User.query.get_or_404(user_id)
 
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    page = user_messages_page(user_id,
+                              per_page=app.config['FEED_PAGE_SIZE'],
+                              cursor=cursor_from_request())
+    return render_template('users/show.html', user=user, messages=page.items,
+                           page=page,
+                           following_ids=viewer_following_ids([user]),
+                           liked_ids=viewer_liked_ids(page.items))
 
 @app.route('/users/<int:user_id>/following')
 @verify_user_logged_in
@@ -164,7 +376,13 @@ def show_following(user_id):
     """Show list of people this user is following."""
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    page = following_page(user_id,
+                          per_page=app.config['USER_LIST_PAGE_SIZE'],
+                          cursor=cursor_from_request())
+    return stream_template('users/following.html', user=user,
+                           following=page.items, page=page,
+                           following_ids=viewer_following_ids(
+                               [user] + page.items))
 
 @app.route('/users/<int:user_id>/followers')
 @verify_user_logged_in
@@ -172,7 +390,13 @@ def show_followers(user_id):
     """Show list of followers of this user."""
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    page = followers_page(user_id,
+                          per_page=app.config['USER_LIST_PAGE_SIZE'],
+                          cursor=cursor_from_request())
+    return stream_template('users/followers.html', user=user,
+                           followers=page.items, page=page,
+                           following_ids=viewer_following_ids(
+                               [user] + page.items))
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
 @verify_user_logged_in
@@ -181,7 +405,15 @@ def add_follow(follow_id):
 
     followed_user = User.query.get_or_404(follow_id)
     g.user.following.append(followed_user)
+    db.session.flush()
+    adjust_counters(g.user.id, following_count=1)
+    adjust_counters(followed_user.id, followers_count=1)
+    add_followed_messages(
+        g.user.id, followed_user.id,
+        depth=app.config['TIMELINE_DEPTH'],
+        fanout_threshold=app.config['TIMELINE_FANOUT_THRESHOLD'])
     db.session.commit()
+    current_user_cache.invalidate(g.user.id, followed_user.id)
 
     return redirect(f"/users/{follow_id}")
 
@@ -192,7 +424,11 @@ def stop_following(follow_id):
 
     followed_user = User.query.get(follow_id)
     g.user.following.remove(followed_user)
+    adjust_counters(g.user.id, following_count=-1)
+    adjust_counters(followed_user.id, followers_count=-1)
+    remove_followed_messages(g.user.id, followed_user.id)
     db.session.commit()
+    current_user_cache.invalidate(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -204,17 +440,18 @@ def profile():
     form = EditProfileForm()
     user = g.user
     if form.validate_on_submit():
-        user = User.authenticate(user.username,
-                                 form.password.data)
-        if user:
+        if user.check_password(form.password.data):
             user.username = form.username.data or user.username
             user.email = form.email.data or user.email
             user.image_url = form.image_url.data or user.image_url
             user.header_image_url = form.header_image_url.data or user.header_image_url
             user.location = form.location.data or user.location
             user.bio = form.bio.data or user.bio
+            # Re-renders the cached fragments of this user's messages.
+            user.profile_version = User.profile_version + 1
             db.session.add(user)
             db.session.commit()
+            current_user_cache.invalidate(user.id)
             flash("Successfully updated profile!", "success")
             return redirect(f'/users/{user.id}')
         else:
@@ -228,33 +465,81 @@ def delete_user():
 
     do_logout()
 
+    release_user_counters(g.user.id)
     db.session.delete(g.user)
     db.session.commit()
+    # Other users' counters changed too, so drop everything.
+    current_user_cache.clear()
     flash("Successfully deleted account.", "success")
     return redirect("/signup")
 
 @app.route('/users/<int:user_id>/likes')
+@conditional(likes_page_version)
 def get_likes(user_id):
     """ List users likes """
     user = User.query.get_or_404(user_id)
-    return render_template('/users/likes.html', user=user, likes=user.likes)
+    page = liked_messages_page(user_id,
+                               per_page=app.config['FEED_PAGE_SIZE'],
+                               cursor=cursor_from_request())
+    return stream_template('users/likes.html', user=user, likes=page.items,
+                           page=page, liked_ids=viewer_liked_ids(page.items))
+
+
+def message_author_id(message_id):
+    """Return the id of a message's author, or None if there's no such message."""
+
+    return (db.session
+            .query(Message.user_id)
+            .filter(Message.id == message_id)
+            .scalar())
+
 
 @app.route('/users/add_like/<int:message_id>', methods=['POST'])
 @verify_user_logged_in
 def like_message(message_id):
-    """ Like a message """
-    
-    liked_message = Message.query.get(message_id)
-    likes = g.user.likes
-    if liked_message.user_id == g.user.id: 
+    """ Like or unlike a message """
+
+    author_id = message_author_id(message_id)
+    if author_id is None:
+        abort(404)
+    if author_id == g.user.id:
         flash("You cannot like your own message.", "danger")
         return redirect("/")
-    if liked_message in likes:
-        g.user.likes = [like for like in likes if like != liked_message]
+
+    toggle_like(g.user.id, message_id)
+    db.session.commit()
+    current_user_cache.invalidate(g.user.id)
+    return redirect(request.referrer or "/")
+
+
+@app.route('/api/messages/<int:message_id>/like', methods=['POST', 'DELETE'])
+def api_like_message(message_id):
+    """JSON API: POST likes a message, DELETE unlikes it.
+
+    Requests must have a JSON body, which browsers won't send cross-site
+    without a CORS preflight.
+    """
+
+    if g.user is None:
+        return jsonify(error="Login required."), 401
+
+    if not request.is_json:
+        return jsonify(error="Expected a JSON request."), 415
+
+    author_id = message_author_id(message_id)
+    if author_id is None:
+        return jsonify(error="No such message."), 404
+    if author_id == g.user.id:
+        return jsonify(error="You cannot like your own message."), 403
+
+    if request.method == 'POST':
+        add_like(g.user.id, message_id)
     else:
-        g.user.likes.append(liked_message)
+        remove_like(g.user.id, message_id)
     db.session.commit()
-    return redirect('/')
+    current_user_cache.invalidate(g.user.id)
+
+    return jsonify(message_id=message_id, liked=request.method == 'POST')
 
 
 ##############################################################################
@@ -273,19 +558,71 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        db.session.flush()
+        adjust_counters(g.user.id, messages_count=1)
+        fan_out(msg, app.config['TIMELINE_FANOUT_THRESHOLD'])
         db.session.commit()
+        current_user_cache.invalidate(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search messages.
+
+    Takes a 'q' param with words, "quoted phrases" and word* prefixes, an
+    optional 'author' username, and 'scope=following' to only search the
+    messages of people the logged-in user follows. With an author, 'q' may
+    be left out to list all of their messages.
+    """
+
+    search = request.args.get('q', '')
+    author = request.args.get('author')
+    following_only = request.args.get('scope') == 'following'
+
+    author_id = None
+    if author:
+        author_user = User.query.filter_by(username=author).first_or_404()
+        author_id = author_user.id
+
+    if following_only and g.user is None:
+        flash("Log in to search the people you follow.", "danger")
+        return redirect('/login')
+
+    page = search_messages(search,
+                           per_page=app.config['FEED_PAGE_SIZE'],
+                           cursor=cursor_from_request(),
+                           author_id=author_id,
+                           followed_by_id=g.user.id if following_only else None)
+
+    return render_template('messages/search.html', messages=page.items,
+                           page=page, search=search, author=author,
+                           following_only=following_only,
+                           liked_ids=viewer_liked_ids(page.items))
+
+
+def message_page_version(message_id):
+    """Version of a message page: its author and the viewer."""
+
+    return message_version(message_id, g.user.id if g.user else None)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@conditional(message_page_version)
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = (Message
+           .query
+           .options(joinedload(Message.user))
+           .filter(Message.id == message_id)
+           .first_or_404())
+    return render_template('messages/show.html', message=msg,
+                           following_ids=viewer_following_ids([msg.user]),
+                           liked_ids=viewer_liked_ids([msg]))
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -298,8 +635,13 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    release_message_counters(msg.id)
+    adjust_counters(msg.user_id, messages_count=-1)
     db.session.delete(msg)
     db.session.commit()
+    # Everyone who liked the message lost a like, so drop everything.
+    current_user_cache.clear()
+    fragment_cache.invalidate(message_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -307,42 +649,126 @@ def messages_destroy(message_id):
 # Homepage and error pages
 
 
+def homepage_version():
+    """Version of the home feed: the viewer and everyone they follow."""
+
+    if g.user is None:
+        return ()
+    return feed_version(g.user.id)
+
+
 @app.route('/')
+@conditional(homepage_version)
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: a page of the most recent messages of the user's timeline
+      (their own messages and those of followed_users)
     """
 
     if g.user:
-        following_ids = [u.id for u in g.user.following] + [g.user.id]
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-        likes = [like.id for like in g.user.likes]
-        return render_template('home.html', messages=messages, likes=likes)
+        per_page = app.config['FEED_PAGE_SIZE']
+        cursor = cursor_from_request()
+        rows = home_timeline(
+            g.user.id, limit=per_page + 1,
+            fanout_threshold=app.config['TIMELINE_FANOUT_THRESHOLD'],
+            cursor=cursor)
+        page = make_page(rows, cursor, per_page, timeline_key)
+        return render_template('home.html', messages=page.items, page=page,
+                               liked_ids=viewer_liked_ids(page.items))
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Maintenance commands
+
+
+@app.cli.command('rebuild-timelines')
+@click.option('--depth', type=int, default=None,
+              help='Entries to keep per timeline (defaults to TIMELINE_DEPTH).')
+def rebuild_timelines_command(depth):
+    """Backfill every home timeline from follows and messages."""
+
+    count = rebuild_timelines(depth or app.config['TIMELINE_DEPTH'],
+                              app.config['TIMELINE_FANOUT_THRESHOLD'])
+    click.echo(f"Wrote {count} timeline entries.")
+
+
+@app.cli.command('trim-timelines')
+@click.option('--depth', type=int, default=None,
+              help='Entries to keep per timeline (defaults to TIMELINE_DEPTH).')
+def trim_timelines_command(depth):
+    """Trim every home timeline to a fixed depth."""
+
+    count = trim_timelines(depth or app.config['TIMELINE_DEPTH'])
+    click.echo(f"Removed {count} timeline entries.")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress static files into ASSETS_BUILD_DIR."""
+
+    manifest = build_assets(app.static_folder, app.config['ASSETS_BUILD_DIR'])
+    assets.load()
+    click.echo(f"Built {len(manifest)} assets into "
+               f"{app.config['ASSETS_BUILD_DIR']}.")
+
+
+@app.cli.command('reconcile-counters')
+@click.option('--dry-run', is_flag=True,
+              help='Only report drift, without correcting it.')
+def reconcile_counters_command(dry_run):
+    """Recompute every user's denormalized counters and report drift."""
+
+    drift = reconcile_counters(fix=not dry_run)
+    for user_id, counter, stored, actual in drift:
+        click.echo(f"user {user_id}: {counter} was {stored}, actual {actual}")
+    click.echo(f"{len(drift)} drifted counters"
+               f"{'' if dry_run else ' corrected'}.")
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+
+    applied = migrate(db.engine, echo=click.echo)
+    click.echo(f"Applied {len(applied)} migrations.")
+
+
+@app.cli.command('check-plans')
+def check_plans_command():
+    """Fail if a hot query can't be served from an index."""
+
+    problems = check_plans(db.engine)
+    for name, table, how in problems:
+        click.echo(f"{name}: {how} on {table}")
+    if problems:
+        raise click.ClickException(
+            f"{len(problems)} hot queries can't use an index.")
+    click.echo("All hot queries use indexes.")
+
+
+##############################################################################
+# Cache policies
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Pages decorated with @conditional answer repeat visits with 304 Not
+# Modified; everything else dynamic is uncached. See conditional.py.
+
+@app.url_defaults
+def add_static_version(endpoint, values):
+    """Version static URLs so they can be cached for good."""
+
+    if endpoint == 'static' and 'v' not in values:
+        version = static_version(app, values['filename'])
+        if version:
+            values['v'] = version
+
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Apply the cache policy for this response."""
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
\ No newline at end of file
+    return set_cache_policy(req)
@@ -0,0 +1,180 @@
+"""Fingerprinted, precompressed static assets for Warbler.
+
+`build_assets` (run with ``flask build-assets``) copies every file under
+``static/`` into ASSETS_BUILD_DIR under a name containing a hash of its
+contents, writes gzip (and, if the ``brotli`` package is installed, brotli)
+versions of the text files next to it, and records the names in
+``manifest.json``. Stylesheet ``url("/static/...")`` references are pointed
+at the hashed files too.
+
+Once a manifest exists, ``url_for('static', filename=...)`` in templates
+returns ``/assets/<hashed name>``. Those URLs never change content, so they
+are served with one-year immutable caching, picking the smallest encoding
+the browser accepts.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.txt', '.json', '.ico', '.map'}
+
+# Content-Encoding -> file suffix, best first.
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+STATIC_URL = re.compile(r'''url\((['"]?)/static/([^'")]+)\1\)''')
+
+
+def fingerprint(filename, content):
+    """Return `filename` with a hash of `content` before its extension."""
+
+    root, ext = os.path.splitext(filename)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f"{root}.{digest}{ext}"
+
+
+def compress(path, content):
+    """Write .gz/.br versions of `content` beside `path` if they're smaller."""
+
+    variants = [('.gz', gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(content)))
+
+    for suffix, compressed in variants:
+        if len(compressed) < len(content):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def build_assets(static_dir, build_dir):
+    """Fingerprint and precompress everything in `static_dir`.
+
+    Returns the manifest, mapping source names to built names. Files from
+    earlier builds are left in place, so pages rendered before a deploy can
+    still load the assets they link to.
+    """
+
+    sources = []
+    for root, dirs, files in os.walk(static_dir):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            sources.append(os.path.relpath(path, static_dir).replace(os.sep, '/'))
+
+    # Stylesheets go last so their url()s can point at already hashed files.
+    sources.sort(key=lambda name: (name.endswith('.css'), name))
+
+    manifest = {}
+
+    for name in sources:
+        with open(os.path.join(static_dir, name), 'rb') as f:
+            content = f.read()
+
+        if name.endswith('.css'):
+            content = STATIC_URL.sub(
+                lambda m: (f'url({m.group(1)}/assets/'
+                           f'{manifest.get(m.group(2), m.group(2))}{m.group(1)})'),
+                content.decode('utf-8')).encode('utf-8')
+
+        built = fingerprint(name, content)
+        path = os.path.join(build_dir, built)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        if os.path.splitext(name)[1] in COMPRESSIBLE:
+            compress(path, content)
+
+        manifest[name] = built
+
+    with open(os.path.join(build_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class Assets:
+    """Serves built assets and points static URLs at them.
+
+    Configured with ASSETS_BUILD_DIR. Without a manifest (e.g. in
+    development before running ``flask build-assets``) static files are
+    served by Flask as usual.
+    """
+
+    def __init__(self):
+        self.build_dir = None
+        self.manifest = {}
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_BUILD_DIR',
+                              os.path.join(app.root_path, 'build', 'assets'))
+        self.build_dir = app.config['ASSETS_BUILD_DIR']
+        self.load()
+
+        app.add_url_rule('/assets/<path:filename>', 'assets', self.send_asset)
+        app.jinja_env.globals['url_for'] = self.url_for
+        app.jinja_env.filters['asset_url'] = self.asset_url
+
+    def load(self):
+        """(Re)load the manifest written by `build_assets`."""
+
+        try:
+            with open(os.path.join(self.build_dir, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except (OSError, ValueError):
+            self.manifest = {}
+
+    def url_for(self, endpoint, **values):
+        """`flask.url_for`, returning fingerprinted URLs for static files."""
+
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = self.manifest[values['filename']]
+            endpoint = 'assets'
+        return url_for(endpoint, **values)
+
+    def asset_url(self, url):
+        """Fingerprinted URL for a stored ``/static/...`` URL, if there is one."""
+
+        if url and url.startswith('/static/'):
+            built = self.manifest.get(url[len('/static/'):])
+            if built:
+                return url_for('assets', filename=built)
+        return url
+
+    def send_asset(self, filename):
+        """Serve a built asset in the best encoding the client accepts."""
+
+        if filename == MANIFEST:
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        for encoding, suffix in ENCODINGS:
+            if (request.accept_encodings.quality(encoding) > 0
+                    and os.path.exists(os.path.join(self.build_dir,
+                                                    filename + suffix))):
+                response = send_from_directory(self.build_dir,
+                                               filename + suffix,
+                                               mimetype=mimetype,
+                                               conditional=True)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.build_dir, filename,
+                                           mimetype=mimetype,
+                                           conditional=True)
+
+        response.vary.add('Accept-Encoding')
+        return response
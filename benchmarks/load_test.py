@@ -0,0 +1,378 @@
+"""Load test Warbler with a realistic mix of logged-in traffic.
+
+Seeds a dedicated database with `generator/create_csvs.py` and `seed.py`,
+then runs --concurrency threads against the Flask app, each logged in as a
+different user and picking requests from MIX: home feeds, profiles, message
+pages, searches, follows/unfollows, likes/unlikes and new posts. Requests go
+through the app's test client, so this measures Warbler and Postgres rather
+than a web server or the network.
+
+For each route it reports request count, p50/p95/p99 latency and SQL
+statements per request, plus overall requests per second. With --output
+the results are also written as JSON, along with the commit and settings,
+and --compare prints the change from an earlier results file.
+
+The database is dropped and recreated, so point it at a scratch database.
+Run from the repository root:
+
+    createdb warbler-bench
+    python -m benchmarks.load_test --users 10000 --messages 200000 \\
+        --output before.json
+    python -m benchmarks.load_test --skip-seed --compare before.json
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+# Relative weights of each kind of request.
+MIX = {
+    'home': 30,
+    'profile': 20,
+    'message': 10,
+    'likes_page': 5,
+    'search_messages': 5,
+    'search_users': 5,
+    'like': 8,
+    'unlike': 4,
+    'follow': 4,
+    'unfollow': 3,
+    'post': 6,
+}
+
+WORDS = "coffee morning python flask city music weekend dinner rain".split()
+
+# Same as app.CURR_USER_KEY; app isn't imported until DATABASE_URL is set.
+CURR_USER_KEY = 'curr_user'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(samples, pct):
+    """Return the `pct` percentile of a sorted list of samples."""
+
+    index = min(len(samples) - 1, int(math.ceil(pct / 100 * len(samples))) - 1)
+    return samples[max(index, 0)]
+
+
+def seed(args):
+    """Generate CSVs and load them into the database."""
+
+    env = dict(os.environ, DATABASE_URL=args.database_url)
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        subprocess.run(
+            [sys.executable, os.path.join('generator', 'create_csvs.py'),
+             '--users', str(args.users),
+             '--messages', str(args.messages),
+             '--follows-per-user', str(args.follows_per_user),
+             '--likes-per-user', str(args.likes_per_user),
+             '--seed', str(args.seed),
+             '--out', data_dir],
+            cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(
+            [sys.executable, 'seed.py', '--data-dir', data_dir],
+            cwd=ROOT, env=env, check=True)
+
+
+class SQLCounter:
+    """Count SQL statements per thread, for whichever request is running."""
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def record(self, conn, cursor, statement, parameters, context,
+               executemany):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def reset(self):
+        self.local.count = 0
+
+    @property
+    def count(self):
+        return getattr(self.local, 'count', 0)
+
+
+class Session:
+    """One logged-in user's client, issuing requests from MIX."""
+
+    def __init__(self, app, db, user_id, max_user_id, max_message_id, rng):
+        self.user_id = user_id
+        self.max_user_id = max_user_id
+        self.max_message_id = max_message_id
+        self.rng = rng
+        self.liked = []
+
+        with app.app_context():
+            self.following = {
+                row[0] for row in db.session.execute(
+                    "SELECT user_being_followed_id FROM follows "
+                    "WHERE user_following_id = :user_id",
+                    {'user_id': user_id})}
+            db.session.remove()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def random_user(self):
+        return self.rng.randint(1, self.max_user_id)
+
+    def random_message(self):
+        return self.rng.randint(1, max(self.max_message_id, 1))
+
+    def send(self, method, path, **kwargs):
+        """Issue a request and read the whole body; return the status code.
+
+        Streamed pages only render, and run their queries, as the body is
+        read, and only record their metrics once the response is closed.
+        """
+
+        response = self.client.open(path, method=method, **kwargs)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def request(self, route):
+        """Issue one request for `route`; return its status code."""
+
+        send = self.send
+
+        if route == 'home':
+            return send('GET', '/')
+        if route == 'profile':
+            return send('GET', f'/users/{self.random_user()}')
+        if route == 'message':
+            return send('GET', f'/messages/{self.random_message()}')
+        if route == 'likes_page':
+            return send('GET', f'/users/{self.random_user()}/likes')
+        if route == 'search_messages':
+            return send('GET', '/messages/search',
+                        query_string={'q': self.rng.choice(WORDS)})
+        if route == 'search_users':
+            prefix = self.rng.choice('abcdefghijklmnopqrstuvwxyz')
+            return send('GET', '/users', query_string={'q': prefix})
+
+        if route == 'like' or (route == 'unlike' and not self.liked):
+            message_id = self.random_message()
+            status = send('POST', f'/api/messages/{message_id}/like', json={})
+            if status == 200:
+                self.liked.append(message_id)
+            return status
+        if route == 'unlike':
+            message_id = self.liked.pop(self.rng.randrange(len(self.liked)))
+            return send('DELETE', f'/api/messages/{message_id}/like', json={})
+
+        if route == 'follow' or (route == 'unfollow' and not self.following):
+            followed_id = self.random_user()
+            if followed_id == self.user_id or followed_id in self.following:
+                return None
+            status = send('POST', f'/users/follow/{followed_id}')
+            if status < 400:
+                self.following.add(followed_id)
+            return status
+        if route == 'unfollow':
+            followed_id = self.rng.choice(sorted(self.following))
+            self.following.discard(followed_id)
+            return send('POST', f'/users/stop-following/{followed_id}')
+
+        if route == 'post':
+            text = ' '.join(self.rng.choices(WORDS, k=8))
+            return send('POST', '/messages/new', data={'text': text})
+
+        raise ValueError(f"Unknown route {route!r}")
+
+
+def run_session(session, counter, deadline, warmup, results, lock):
+    """Issue requests until `deadline`; add samples to `results`."""
+
+    routes = list(MIX)
+    weights = [MIX[route] for route in routes]
+    samples = []
+    issued = 0
+
+    while time.perf_counter() < deadline:
+        route = session.rng.choices(routes, weights)[0]
+        counter.reset()
+        start = time.perf_counter()
+        try:
+            status = session.request(route)
+        except Exception as exc:
+            print(f"{route}: {exc!r}", file=sys.stderr)
+            status = 'exception'
+        elapsed = (time.perf_counter() - start) * 1000
+
+        if status is None:
+            continue
+        issued += 1
+        if issued > warmup:
+            samples.append((route, elapsed, counter.count, status, start))
+
+    with lock:
+        results.extend(samples)
+
+
+def summarize(samples):
+    """Per-route and overall statistics for a list of samples."""
+
+    def stats(rows):
+        latencies = sorted(row[1] for row in rows)
+        queries = [row[2] for row in rows]
+        return {
+            'requests': len(rows),
+            'errors': sum(1 for row in rows
+                          if row[3] == 'exception' or row[3] >= 500),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'sql_mean': sum(queries) / len(queries),
+            'sql_max': max(queries),
+        }
+
+    routes = {}
+    for route in MIX:
+        rows = [row for row in samples if row[0] == route]
+        if rows:
+            routes[route] = stats(rows)
+
+    first = min(row[4] for row in samples)
+    last = max(row[4] + row[1] / 1000 for row in samples)
+
+    overall = stats(samples)
+    overall['rps'] = len(samples) / (last - first)
+
+    return {'overall': overall, 'routes': routes}
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results, baseline=None):
+    print(f"{'route':>16} {'reqs':>6} {'errors':>6} {'p50 ms':>8} "
+          f"{'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8} {'sql max':>8}")
+
+    rows = list(results['routes'].items()) + [('overall', results['overall'])]
+    for route, stats in rows:
+        line = (f"{route:>16} {stats['requests']:>6} {stats['errors']:>6} "
+                f"{stats['p50_ms']:>8.2f} {stats['p95_ms']:>8.2f} "
+                f"{stats['p99_ms']:>8.2f} {stats['sql_mean']:>8.1f} "
+                f"{stats['sql_max']:>8}")
+
+        before = (baseline['overall'] if route == 'overall'
+                  else baseline['routes'].get(route)) if baseline else None
+        if before:
+            change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms']
+            line += f"  p95 {change:+.0%}"
+        print(line)
+
+    print(f"{results['overall']['rps']:.1f} requests/s")
+    if baseline:
+        change = (results['overall']['rps'] - baseline['overall']['rps']) \
+            / baseline['overall']['rps']
+        print(f"{change:+.0%} requests/s vs {baseline.get('commit')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url',
+                        default='postgresql:///warbler-bench')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows-per-user', type=int, default=17)
+    parser.add_argument('--likes-per-user', type=int, default=5)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='Reuse the data from a previous run.')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Logged-in users issuing requests at once.')
+    parser.add_argument('--duration', type=float, default=30,
+                        help='Seconds to run for.')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='Requests per user to leave out of the results.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write results to this JSON file.')
+    parser.add_argument('--compare', help='Earlier JSON results to compare.')
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed(args)
+
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from sqlalchemy import event
+
+    from app import app
+    from models import db
+
+    app.config['WTF_CSRF_ENABLED'] = False
+
+    with app.app_context():
+        max_user_id = db.session.execute("SELECT max(id) FROM users").scalar()
+        max_message_id = db.session.execute(
+            "SELECT max(id) FROM messages").scalar() or 0
+        user_ids = [row[0] for row in db.session.execute(
+            "SELECT id FROM users ORDER BY random() LIMIT :n",
+            {'n': args.concurrency})]
+        engine = db.engine
+        db.session.remove()
+
+    if not user_ids:
+        parser.error("The database has no users; run without --skip-seed.")
+
+    counter = SQLCounter()
+    event.listen(engine, 'before_cursor_execute', counter.record)
+
+    sessions = [Session(app, db, user_id, max_user_id, max_message_id,
+                        random.Random(f"{args.seed}:{i}"))
+                for i, user_id in enumerate(user_ids)]
+
+    samples = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    threads = [threading.Thread(target=run_session,
+                                args=(session, counter, deadline, args.warmup,
+                                      samples, lock))
+               for session in sessions]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    event.remove(engine, 'before_cursor_execute', counter.record)
+
+    if not samples:
+        parser.error("No requests completed after warmup; "
+                     "increase --duration.")
+
+    results = summarize(samples)
+    results.update(commit=current_commit(),
+                   started_at=datetime.utcnow().isoformat(),
+                   settings=vars(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print_results(results, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
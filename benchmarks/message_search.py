@@ -0,0 +1,165 @@
+"""Benchmark message search latency over a large seeded corpus.
+
+Seeds a dedicated database with synthetic users, follows and messages
+(generated inside Postgres with generate_series, so millions of rows load
+in seconds), then times `search.search_messages` for word, phrase, prefix,
+author-filtered and "people I follow" queries, plus a deep page.
+
+The database is dropped and recreated, so point it at a scratch database.
+Run from the repository root:
+
+    createdb warbler-bench
+    python -m benchmarks.message_search --messages 1000000
+"""
+
+import argparse
+import math
+import os
+import random
+import time
+
+WORDS = (
+    "warble tweet song bird morning evening coffee code python flask "
+    "postgres index query cache timeline follow like message quick brown "
+    "fox jumps lazy dog river mountain city rain sun cloud music coffee "
+    "travel dinner weekend deploy release bug feature review merge test"
+).split()
+
+SEED_USERS_SQL = """
+    INSERT INTO users (id, email, username, password, bio, location)
+    SELECT g, 'user' || g || '@bench.test', 'user' || g, 'x',
+           'Bench user ' || g, 'City ' || (g % 100)
+    FROM generate_series(1, :users) AS g
+"""
+
+SEED_FOLLOWS_SQL = """
+    INSERT INTO follows (user_being_followed_id, user_following_id)
+    SELECT DISTINCT followed, follower
+    FROM (SELECT 1 + floor(random() * :users)::int AS followed,
+                 g AS follower
+          FROM generate_series(1, :users) AS g,
+               generate_series(1, :follows_per_user) AS f) AS pairs
+    WHERE followed <> follower
+"""
+
+SEED_MESSAGES_SQL = """
+    INSERT INTO messages (text, timestamp, user_id)
+    SELECT array_to_string(ARRAY(
+               SELECT (:words)[1 + floor(random() * array_length(:words, 1))::int]
+               FROM generate_series(1, 12)
+               WHERE g > 0), ' '),
+           now() - random() * interval '730 days',
+           1 + floor(random() * :users)::int
+    FROM generate_series(1, :messages) AS g
+"""
+
+QUERIES = [
+    ('word', 'coffee', {}),
+    ('two words', 'quick fox', {}),
+    ('phrase', '"lazy dog"', {}),
+    ('prefix', 'deplo*', {}),
+    ('author', 'coffee', {'author_id': 1}),
+    ('following', 'coffee', {'followed_by_id': 1}),
+]
+
+
+def percentile(samples, pct):
+    """Return the `pct` percentile of a sorted list of samples."""
+
+    index = min(len(samples) - 1, int(math.ceil(pct / 100 * len(samples))) - 1)
+    return samples[max(index, 0)]
+
+
+def seed(db, users, messages, follows_per_user):
+    """Recreate the schema and fill it with synthetic data."""
+
+    db.drop_all()
+    db.create_all()
+
+    params = {'users': users, 'messages': messages,
+              'follows_per_user': follows_per_user, 'words': WORDS}
+
+    for name, sql in (('users', SEED_USERS_SQL),
+                      ('follows', SEED_FOLLOWS_SQL),
+                      ('messages', SEED_MESSAGES_SQL)):
+        start = time.perf_counter()
+        db.session.execute(sql, params)
+        db.session.commit()
+        print(f"seeded {name} in {time.perf_counter() - start:.1f}s")
+
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+
+def time_query(search_messages, search, kwargs, repeat, per_page):
+    """Time a search; return sorted latencies in ms and the last page."""
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        page = search_messages(search, per_page, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return sorted(latencies), page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database-url',
+                        default='postgresql:///warbler-bench')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--follows-per-user', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--per-page', type=int, default=100)
+    parser.add_argument('--skip-seed', action='store_true',
+                        help='Reuse the data from a previous run.')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    os.environ['DATABASE_URL'] = args.database_url
+
+    from app import app
+    from models import db
+    from pagination import decode_cursor
+    from search import search_messages
+
+    with app.test_request_context():
+        if not args.skip_seed:
+            db.session.execute("SELECT setseed(:s)", {'s': args.seed / 2 ** 31})
+            seed(db, args.users, args.messages, args.follows_per_user)
+
+        total = db.session.execute("SELECT count(*) FROM messages").scalar()
+        print(f"messages={total}")
+        print(f"{'query':>12} {'results':>8} {'p50 ms':>8} "
+              f"{'p95 ms':>8} {'max ms':>8}")
+
+        for name, search, kwargs in QUERIES:
+            latencies, page = time_query(search_messages, search, kwargs,
+                                         args.repeat, args.per_page)
+            print(f"{name:>12} {len(page):>8} "
+                  f"{percentile(latencies, 50):>8.2f} "
+                  f"{percentile(latencies, 95):>8.2f} "
+                  f"{latencies[-1]:>8.2f}")
+
+            if name == 'word':
+                deep_page = page
+                for _ in range(10):
+                    if deep_page.older is None:
+                        break
+                    cursor = decode_cursor(deep_page.older)
+                    deep_page = search_messages(search, args.per_page,
+                                                cursor=cursor)
+                if deep_page.older is not None:
+                    cursor = decode_cursor(deep_page.older)
+                    latencies, page = time_query(
+                        search_messages, search, {'cursor': cursor},
+                        args.repeat, args.per_page)
+                    print(f"{'page 12':>12} {len(page):>8} "
+                          f"{percentile(latencies, 50):>8.2f} "
+                          f"{percentile(latencies, 95):>8.2f} "
+                          f"{latencies[-1]:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
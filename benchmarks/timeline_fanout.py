@@ -0,0 +1,260 @@
+"""Benchmark the hybrid push/pull home timeline.
+
+Simulates a follower graph with a Zipf-skewed follower distribution and a
+stream of posts, then reports, for a range of fan-out thresholds:
+
+- write amplification: timeline rows written per posted message
+- merge latency: time `timeline.merge_timelines` takes to assemble a
+  100-message home feed in memory, from the reader's materialized timeline
+  plus one pulled stream per followed celebrity
+- read latency (with --database-url): time `timeline.home_timeline` takes
+  to read that feed from Postgres, including the timeline_entries query and
+  the celebrity pulls, after `rebuild_timelines` for the threshold
+
+A threshold of 0 is pure pull (every followed account is merged at read
+time) and "inf" is pure push (everything is materialized on write).
+
+With --database-url the simulated users, follows and posts are loaded into
+that database, which is dropped and recreated, so point it at a scratch
+database. Run from the repository root:
+
+    python -m benchmarks.timeline_fanout --users 20000 --posts 100000
+    createdb warbler-bench
+    python -m benchmarks.timeline_fanout --database-url \\
+        postgresql:///warbler-bench
+"""
+
+import argparse
+import csv
+import io
+import math
+import os
+import random
+import time
+from bisect import bisect
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+from timeline import is_celebrity, merge_timelines
+
+FEED_SIZE = 100
+
+Post = namedtuple('Post', ['id', 'timestamp', 'user_id'])
+
+
+def zipf_weights(n, exponent):
+    """Popularity weight of the accounts ranked 1..n."""
+
+    return [1 / (rank ** exponent) for rank in range(1, n + 1)]
+
+
+def build_graph(num_users, avg_following, exponent, rng):
+    """Return (following, followers) adjacency lists.
+
+    Every user follows roughly `avg_following` accounts picked in proportion
+    to a Zipf popularity weight, so a handful of accounts collect most of
+    the follows.
+    """
+
+    cumulative = list(accumulate(zipf_weights(num_users, exponent)))
+    total = cumulative[-1]
+
+    following = [set() for _ in range(num_users)]
+    followers = [[] for _ in range(num_users)]
+
+    for user in range(num_users):
+        wanted = min(num_users - 1, max(1, int(rng.expovariate(1 / avg_following))))
+        while len(following[user]) < wanted:
+            followed = bisect(cumulative, rng.random() * total)
+            if followed != user:
+                following[user].add(followed)
+
+        for followed in following[user]:
+            followers[followed].append(user)
+
+    return following, followers
+
+
+def generate_posts(num_users, num_posts, rng):
+    """Return posts spread uniformly over the last week, newest first."""
+
+    now = datetime.utcnow()
+    posts = [
+        Post(id=i,
+             timestamp=now - timedelta(seconds=rng.uniform(0, 7 * 24 * 3600)),
+             user_id=rng.randrange(num_users))
+        for i in range(num_posts)
+    ]
+    posts.sort(key=lambda post: (post.timestamp, post.id), reverse=True)
+    return posts
+
+
+def percentile(samples, pct):
+    """Return the `pct` percentile of a sorted list of samples."""
+
+    index = min(len(samples) - 1, int(math.ceil(pct / 100 * len(samples))) - 1)
+    return samples[max(index, 0)]
+
+
+def run(threshold, following, followers, posts, readers):
+    """Simulate one fan-out threshold; return a dict of results."""
+
+    celebrities = {user for user, fans in enumerate(followers)
+                   if is_celebrity(len(fans), threshold)}
+
+    writes = sum(1 if post.user_id in celebrities
+                 else 1 + len(followers[post.user_id])
+                 for post in posts)
+
+    by_author = {}
+    for post in posts:
+        by_author.setdefault(post.user_id, []).append(post)
+
+    latencies = []
+    for reader in readers:
+        pushed_authors = ({reader} | following[reader]) - (celebrities - {reader})
+        pushed = [post for post in posts
+                  if post.user_id in pushed_authors][:FEED_SIZE]
+        pulled = [by_author.get(author, [])[:FEED_SIZE]
+                  for author in following[reader] & celebrities
+                  if author != reader]
+
+        start = time.perf_counter()
+        merge_timelines([pushed] + pulled, FEED_SIZE)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    latencies.sort()
+
+    return {
+        'threshold': threshold,
+        'celebrities': len(celebrities),
+        'write_amplification': writes / len(posts),
+        'merge_p50_ms': percentile(latencies, 50),
+        'merge_p99_ms': percentile(latencies, 99),
+    }
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY an iterable of row tuples into `table`."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        buffer)
+
+
+def seed(db, following, posts):
+    """Recreate the schema and load the simulated graph and posts.
+
+    Simulated user n is stored with id n + 1, as is post n.
+    """
+
+    from counters import reconcile_counters
+
+    db.drop_all()
+    db.create_all()
+
+    cursor = db.session.connection().connection.cursor()
+    copy_rows(cursor, 'users', ('id', 'email', 'username', 'password'),
+              ((user + 1, f'user{user}@bench.test', f'user{user}', 'x')
+               for user in range(len(following))))
+    copy_rows(cursor, 'follows',
+              ('user_being_followed_id', 'user_following_id'),
+              ((followed + 1, user + 1)
+               for user, followed_ids in enumerate(following)
+               for followed in followed_ids))
+    copy_rows(cursor, 'messages', ('id', 'text', 'timestamp', 'user_id'),
+              ((post.id + 1, f'Post {post.id}', post.timestamp,
+                post.user_id + 1)
+               for post in posts))
+    db.session.commit()
+
+    reconcile_counters()
+    db.session.execute("ANALYZE")
+    db.session.commit()
+
+
+def time_reads(db, threshold, readers):
+    """Rebuild timelines for `threshold`; return sorted read latencies."""
+
+    from timeline import home_timeline, rebuild_timelines
+
+    rebuild_timelines(fanout_threshold=threshold)
+    db.session.execute("ANALYZE timeline_entries")
+    db.session.commit()
+
+    latencies = []
+    for reader in readers:
+        start = time.perf_counter()
+        home_timeline(reader + 1, FEED_SIZE, fanout_threshold=threshold)
+        latencies.append((time.perf_counter() - start) * 1000)
+        # Don't let one reader's loaded messages serve the next.
+        db.session.remove()
+
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--posts', type=int, default=50000)
+    parser.add_argument('--avg-following', type=int, default=100)
+    parser.add_argument('--zipf-exponent', type=float, default=1.1)
+    parser.add_argument('--readers', type=int, default=200)
+    parser.add_argument('--thresholds', default='0,100,1000,10000,inf',
+                        help='Comma-separated follower thresholds to compare.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database-url',
+                        help='Also time home_timeline against this '
+                             'database, which is dropped and recreated.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    following, followers = build_graph(
+        args.users, args.avg_following, args.zipf_exponent, rng)
+    posts = generate_posts(args.users, args.posts, rng)
+
+    # Sample readers weighted towards heavy followers, who pay most on read.
+    readers = sorted(range(args.users),
+                     key=lambda user: len(following[user]),
+                     reverse=True)[:args.readers // 2]
+    readers += rng.sample(range(args.users), args.readers - len(readers))
+
+    print(f"users={args.users} posts={args.posts} "
+          f"max_followers={max(len(fans) for fans in followers)}")
+    header = (f"{'threshold':>10} {'celebs':>7} {'writes/post':>12} "
+              f"{'merge p50 ms':>13} {'merge p99 ms':>13}")
+    if args.database_url:
+        header += f" {'read p50 ms':>12} {'read p99 ms':>12}"
+
+        os.environ['DATABASE_URL'] = args.database_url
+
+        from app import app
+        from models import db
+
+        context = app.app_context()
+        context.push()
+        start = time.perf_counter()
+        seed(db, following, posts)
+        print(f"seeded in {time.perf_counter() - start:.1f}s")
+
+    print(header)
+
+    for threshold in args.thresholds.split(','):
+        result = run(float(threshold), following, followers, posts, readers)
+        line = (f"{threshold:>10} {result['celebrities']:>7} "
+                f"{result['write_amplification']:>12.1f} "
+                f"{result['merge_p50_ms']:>13.3f} "
+                f"{result['merge_p99_ms']:>13.3f}")
+        if args.database_url:
+            latencies = time_reads(db, float(threshold), readers)
+            line += (f" {percentile(latencies, 50):>12.3f} "
+                     f"{percentile(latencies, 99):>12.3f}")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""In-process caches for Warbler.
+
+`LRUCache` is a small thread-safe LRU map with an optional time-to-live and
+hit/miss counters. `CurrentUserCache` uses it to skip loading the whole
+users row that `add_user_to_g` would otherwise fetch before every request.
+"""
+
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from threading import Lock
+
+from flask import current_app
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+MISSING = object()
+
+# Users share this many signal files, so there are never more than this.
+SIGNAL_BUCKETS = 256
+
+# A signal file is emptied once it is this big.
+SIGNAL_MAX_BYTES = 4096
+
+
+class LRUCache:
+    """Bounded least-recently-used cache with an optional TTL in seconds."""
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, or `default`."""
+
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+
+            if entry is not MISSING:
+                value, expires = entry
+                if expires is None or expires > self.clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the least recently used entry."""
+
+        expires = self.clock() + self.ttl if self.ttl else None
+
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Drop `key` from the cache, if present."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return the cache's counters as a dict."""
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+        }
+
+
+class CurrentUserCache:
+    """Per-process cache of the users that requests are logged in as.
+
+    Only column values are cached. They are rebuilt into a User and merged
+    into the request's session, so relationships still lazy-load as usual.
+
+    Views invalidate entries when they change a user. So that other worker
+    processes notice too, invalidating appends to one of SIGNAL_BUCKETS
+    small files in CURRENT_USER_CACHE_SIGNAL_DIR, picked by user id. Each
+    entry remembers its file's size and mtime when it was loaded, and a hit
+    only counts if they haven't changed: a ``stat``, not a query. The
+    directory must be shared by every worker (the default is under the
+    system temp directory, which suits one host). Changes made outside the
+    app, or with no signal directory, show up after CURRENT_USER_CACHE_TTL
+    seconds.
+
+    Configured with CURRENT_USER_CACHE_ENABLED, CURRENT_USER_CACHE_SIZE,
+    CURRENT_USER_CACHE_TTL and CURRENT_USER_CACHE_SIGNAL_DIR.
+    """
+
+    def __init__(self):
+        self.cache = LRUCache()
+        self.signal_dir = None
+
+    def init_app(self, app):
+        app.config.setdefault('CURRENT_USER_CACHE_ENABLED', True)
+        app.config.setdefault('CURRENT_USER_CACHE_SIZE', 1024)
+        app.config.setdefault('CURRENT_USER_CACHE_TTL', 30)
+        app.config.setdefault(
+            'CURRENT_USER_CACHE_SIGNAL_DIR',
+            os.path.join(tempfile.gettempdir(), 'warbler-current-user-cache'))
+
+        self.cache = LRUCache(maxsize=app.config['CURRENT_USER_CACHE_SIZE'],
+                              ttl=app.config['CURRENT_USER_CACHE_TTL'])
+
+        self.signal_dir = app.config['CURRENT_USER_CACHE_SIGNAL_DIR']
+        if self.signal_dir:
+            os.makedirs(self.signal_dir, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return current_app.config.get('CURRENT_USER_CACHE_ENABLED', False)
+
+    def _signal_path(self, user_id):
+        return os.path.join(self.signal_dir,
+                            f"{user_id % SIGNAL_BUCKETS:03d}")
+
+    def _generation(self, user_id):
+        """Size and mtime of the user's signal file; None if there's none."""
+
+        if not self.signal_dir:
+            return None
+        try:
+            stat = os.stat(self._signal_path(user_id))
+        except FileNotFoundError:
+            return None
+        return (stat.st_size, stat.st_mtime_ns)
+
+    def _signal(self, user_id):
+        """Tell every process's cache that this user has changed."""
+
+        if not self.signal_dir:
+            return
+        with open(self._signal_path(user_id), 'ab') as f:
+            # Appending changes the size even within one mtime tick.
+            if f.tell() >= SIGNAL_MAX_BYTES:
+                f.truncate(0)
+            f.write(b'.')
+
+    def get_user(self, user_id):
+        """Return the User with `user_id`, or None if there isn't one."""
+
+        if not self.enabled:
+            return User.query.get(user_id)
+
+        # Read before loading, so a change made meanwhile is seen next time.
+        generation = self._generation(user_id)
+        entry = self.cache.get(user_id)
+
+        if entry is not None and entry[0] != generation:
+            self.cache.delete(user_id)
+            entry = None
+
+        if entry is None:
+            user = User.query.get(user_id)
+            if user is not None:
+                self.cache.set(user_id, (generation, {
+                    attr.key: getattr(user, attr.key)
+                    for attr in inspect(User).column_attrs
+                }))
+            return user
+
+        user = User(**entry[1])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def invalidate(self, *user_ids):
+        """Forget the cached copies of these users, in every process."""
+
+        for user_id in user_ids:
+            self.cache.delete(user_id)
+            self._signal(user_id)
+
+    def clear(self):
+        """Forget every cached user, in every process."""
+
+        self.cache.clear()
+        for bucket in range(SIGNAL_BUCKETS if self.signal_dir else 0):
+            self._signal(bucket)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,192 @@
+"""Conditional GET (ETag) support and cache policies for Warbler.
+
+Views decorated with `conditional` name a cheap version function; its result
+is hashed with the viewer's identity and the request URL into a weak ETag.
+When the browser already has that ETag the view isn't run at all and a
+``304 Not Modified`` is sent instead.
+
+Versions are built from the ``xmin`` system column of ``users`` rows. Postgres
+gives a row a new xmin whenever it is updated, and every change a page can
+show touches a users row: posting or deleting a message, liking, following
+and editing a profile all go through the counter columns or the profile
+itself. So a page's version is just the xmins of the users it depends on.
+"""
+
+import hashlib
+import os
+from functools import wraps
+
+from flask import current_app, g, request, session
+from sqlalchemy import text
+
+from models import db
+
+USER_VERSIONS_SQL = text("""
+    SELECT id, xmin::text::bigint AS version
+    FROM users
+    WHERE id = ANY(:user_ids)
+""")
+
+# Followed users' rows change when they post, delete a message or edit their
+# profile, which covers everything a home feed shows apart from the viewer.
+FEED_VERSION_SQL = text("""
+    SELECT (SELECT xmin::text::bigint FROM users WHERE id = :user_id),
+           count(*),
+           coalesce(sum(users.xmin::text::bigint), 0)
+    FROM follows
+    JOIN users ON users.id = follows.user_being_followed_id
+    WHERE follows.user_following_id = :user_id
+""")
+
+# The authors of liked messages show up on the likes page by name and
+# picture, which only change with their profile_version. Liking, unliking
+# and deleted messages already change the liker's own row.
+LIKED_AUTHORS_VERSION_SQL = text("""
+    SELECT count(*), coalesce(sum(users.profile_version), 0)
+    FROM likes
+    JOIN messages ON messages.id = likes.message_id
+    JOIN users ON users.id = messages.user_id
+    WHERE likes.user_id = :user_id
+""")
+
+MESSAGE_VERSION_SQL = text("""
+    SELECT users.id,
+           users.xmin::text::bigint,
+           (SELECT xmin::text::bigint FROM users WHERE id = :viewer_id)
+    FROM messages
+    JOIN users ON users.id = messages.user_id
+    WHERE messages.id = :message_id
+""")
+
+PRIVATE_REVALIDATE = 'private, no-cache'
+NO_STORE = 'no-cache, no-store, must-revalidate'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def user_versions(*user_ids):
+    """Return the row versions of these users, or None if any is missing."""
+
+    rows = dict(db.session.execute(USER_VERSIONS_SQL,
+                                   {'user_ids': list(user_ids)}).fetchall())
+    if len(rows) < len(set(user_ids)):
+        return None
+    return tuple(rows[user_id] for user_id in user_ids)
+
+
+def feed_version(user_id):
+    """Return the version of a user's home feed, as a tuple."""
+
+    return tuple(db.session.execute(FEED_VERSION_SQL,
+                                    {'user_id': user_id}).fetchone())
+
+
+def liked_authors_version(user_id):
+    """Return the version of the authors on a user's likes page, as a tuple."""
+
+    return tuple(db.session.execute(LIKED_AUTHORS_VERSION_SQL,
+                                    {'user_id': user_id}).fetchone())
+
+
+def message_version(message_id, viewer_id=None):
+    """Return the version of a message page, or None if there's no message."""
+
+    row = db.session.execute(MESSAGE_VERSION_SQL,
+                             {'message_id': message_id,
+                              'viewer_id': viewer_id}).fetchone()
+    return tuple(row) if row else None
+
+
+def templates_version(app):
+    """Fingerprint the templates, so deploys that change pages change ETags."""
+
+    digest = hashlib.sha1()
+    for root, dirs, files in sorted(os.walk(app.template_folder)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def make_etag(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional(version):
+    """Answer GETs with 304 Not Modified when the page hasn't changed.
+
+    `version(**view_args)` returns a tuple describing everything the page
+    shows, or None to always run the view (e.g. so it can 404). Pages with
+    pending flashes are always rendered, since rendering consumes them.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(**kwargs)
+
+            parts = version(**kwargs)
+            if parts is None:
+                return view(**kwargs)
+
+            etag = make_etag(current_app.config['ETAG_VERSION'],
+                             request.full_path,
+                             g.user.id if g.user else None,
+                             parts)
+
+            if ('_flashes' not in session
+                    and request.if_none_match.contains_weak(etag)):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(**kwargs))
+
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                response.headers['Cache-Control'] = PRIVATE_REVALIDATE
+                response.vary.add('Cookie')
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def static_version(app, filename):
+    """Short version of a static file, from its modification time."""
+
+    try:
+        mtime = os.stat(os.path.join(app.static_folder, filename)).st_mtime_ns
+    except OSError:
+        return None
+    return format(mtime, 'x')
+
+
+def set_cache_policy(response):
+    """Apply the default cache policy to a response.
+
+    Fingerprinted assets and static files requested with their current
+    version (see `static_version`) are cached for good; other static files,
+    including ones asked for with a stale or made-up version, for
+    STATIC_MAX_AGE seconds. Errors, such as a file missing part way
+    through a deploy, and responses that don't set a Cache-Control of their
+    own aren't cached at all.
+    """
+
+    cacheable = response.status_code in (200, 304)
+
+    if request.endpoint == 'assets' and cacheable:
+        response.headers['Cache-Control'] = IMMUTABLE
+    elif request.endpoint == 'static' and cacheable:
+        version = request.args.get('v')
+        if version and version == static_version(
+                current_app, request.view_args['filename']):
+            response.headers['Cache-Control'] = IMMUTABLE
+        else:
+            response.headers['Cache-Control'] = (
+                f"public, max-age={current_app.config['STATIC_MAX_AGE']}")
+    elif 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = NO_STORE
+        response.headers['Pragma'] = 'no-cache'
+        response.headers['Expires'] = '0'
+
+    return response
@@ -0,0 +1,155 @@
+"""Denormalized per-user counters for Warbler.
+
+``users`` keeps messages_count, following_count, followers_count and
+likes_count so profile pages and the home sidebar never load whole
+relationships just to count them. Views adjust the counters in the same
+transaction as the change they count; `reconcile_counters` recomputes them
+all from the source tables and reports any drift.
+"""
+
+from sqlalchemy import text
+
+from models import db, User, Follows, Likes
+
+COUNTERS = ['messages_count', 'following_count', 'followers_count',
+            'likes_count']
+
+
+def adjust_counters(user_id, **deltas):
+    """Add `deltas` to a user's counters with a single UPDATE.
+
+        adjust_counters(user.id, followers_count=1)
+
+    The change is made in SQL, so concurrent updates can't be lost; loaded
+    User objects see the new values after the next commit.
+    """
+
+    (User
+     .query
+     .filter(User.id == user_id)
+     .update({getattr(User, name): getattr(User, name) + delta
+              for name, delta in deltas.items()},
+             synchronize_session=False))
+
+
+def release_message_counters(message_id):
+    """Adjust counters for the cascade-deleted likes of a message.
+
+    Call before deleting the message; the author's messages_count is
+    adjusted separately.
+    """
+
+    likers = (db.session
+              .query(Likes.user_id)
+              .filter(Likes.message_id == message_id))
+
+    (User
+     .query
+     .filter(User.id.in_(likers.subquery()))
+     .update({User.likes_count: User.likes_count - 1},
+             synchronize_session=False))
+
+
+def release_user_counters(user_id):
+    """Adjust other users' counters for the rows deleted with a user.
+
+    Call before deleting the user: the accounts they followed lose a
+    follower, their followers follow one account fewer, and anyone who
+    liked their messages loses those likes.
+    """
+
+    followed = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == user_id))
+    (User
+     .query
+     .filter(User.id.in_(followed.subquery()))
+     .update({User.followers_count: User.followers_count - 1},
+             synchronize_session=False))
+
+    followers = (db.session
+                 .query(Follows.user_following_id)
+                 .filter(Follows.user_being_followed_id == user_id))
+    (User
+     .query
+     .filter(User.id.in_(followers.subquery()))
+     .update({User.following_count: User.following_count - 1},
+             synchronize_session=False))
+
+    db.session.execute(RELEASE_LIKES_SQL, {'user_id': user_id})
+
+
+RELEASE_LIKES_SQL = text("""
+    UPDATE users
+    SET likes_count = likes_count - liked.n
+    FROM (
+        SELECT likes.user_id, count(*) AS n
+        FROM likes
+        JOIN messages ON messages.id = likes.message_id
+        WHERE messages.user_id = :user_id
+        GROUP BY likes.user_id
+    ) AS liked
+    WHERE users.id = liked.user_id
+""")
+
+ACTUAL_COUNTS_SQL = """
+    SELECT u.id,
+           u.messages_count AS stored_messages_count,
+           u.following_count AS stored_following_count,
+           u.followers_count AS stored_followers_count,
+           u.likes_count AS stored_likes_count,
+           coalesce(m.n, 0) AS messages_count,
+           coalesce(fg.n, 0) AS following_count,
+           coalesce(fr.n, 0) AS followers_count,
+           coalesce(l.n, 0) AS likes_count
+    FROM users AS u
+    LEFT JOIN (SELECT user_id AS id, count(*) AS n
+               FROM messages GROUP BY user_id) AS m ON m.id = u.id
+    LEFT JOIN (SELECT user_following_id AS id, count(*) AS n
+               FROM follows GROUP BY user_following_id) AS fg ON fg.id = u.id
+    LEFT JOIN (SELECT user_being_followed_id AS id, count(*) AS n
+               FROM follows GROUP BY user_being_followed_id) AS fr ON fr.id = u.id
+    LEFT JOIN (SELECT user_id AS id, count(*) AS n
+               FROM likes GROUP BY user_id) AS l ON l.id = u.id
+    WHERE (u.messages_count, u.following_count,
+           u.followers_count, u.likes_count)
+          IS DISTINCT FROM
+          (coalesce(m.n, 0), coalesce(fg.n, 0),
+           coalesce(fr.n, 0), coalesce(l.n, 0))
+"""
+
+FIND_DRIFT_SQL = text(ACTUAL_COUNTS_SQL)
+
+FIX_DRIFT_SQL = text(f"""
+    UPDATE users
+    SET messages_count = drift.messages_count,
+        following_count = drift.following_count,
+        followers_count = drift.followers_count,
+        likes_count = drift.likes_count
+    FROM ({ACTUAL_COUNTS_SQL}) AS drift
+    WHERE users.id = drift.id
+    RETURNING drift.*
+""")
+
+
+def reconcile_counters(fix=True):
+    """Recompute every user's counters with aggregate SQL.
+
+    Returns a list of (user_id, counter, stored, actual) tuples for each
+    counter that had drifted. When `fix` is set the stored values are
+    corrected and committed.
+    """
+
+    rows = db.session.execute(FIX_DRIFT_SQL if fix else FIND_DRIFT_SQL)
+
+    drift = [
+        (row['id'], name, row['stored_' + name], row[name])
+        for row in rows
+        for name in COUNTERS
+        if row['stored_' + name] != row[name]
+    ]
+
+    if fix:
+        db.session.commit()
+
+    return sorted(drift)
@@ -0,0 +1,42 @@
+"""Followers and following lists for Warbler.
+
+Both lists are paginated newest follow first on ``(followed_at, user id)``,
+a range scan of the ``(user, followed_at, other user)`` indexes on
+``follows``, and select only the columns a user card shows rather than
+whole users. Whether the viewer follows the users on a page is looked up
+for the whole page at once with `User.following_ids_among`.
+"""
+
+from models import db, Follows, User
+from pagination import paginate
+
+CARD_COLUMNS = [User.id, User.username, User.image_url,
+                User.header_image_url, User.bio]
+
+
+def follow_key(row):
+    return (row.followed_at, row.id)
+
+
+def following_page(user_id, per_page, cursor=None):
+    """Return a Page of the users `user_id` follows, newest follow first."""
+
+    query = (db.session
+             .query(*CARD_COLUMNS, Follows.followed_at)
+             .join(Follows, Follows.user_being_followed_id == User.id)
+             .filter(Follows.user_following_id == user_id))
+    return paginate(query,
+                    [Follows.followed_at, Follows.user_being_followed_id],
+                    follow_key, per_page=per_page, cursor=cursor)
+
+
+def followers_page(user_id, per_page, cursor=None):
+    """Return a Page of the users following `user_id`, newest follow first."""
+
+    query = (db.session
+             .query(*CARD_COLUMNS, Follows.followed_at)
+             .join(Follows, Follows.user_following_id == User.id)
+             .filter(Follows.user_being_followed_id == user_id))
+    return paginate(query,
+                    [Follows.followed_at, Follows.user_following_id],
+                    follow_key, per_page=per_page, cursor=cursor)
@@ -0,0 +1,201 @@
+"""Rendered fragment cache for Warbler's message lists.
+
+Feeds render the same message markup over and over: a message's text never
+changes, and the author details next to it only change when they edit their
+profile. `FragmentCache` keeps the rendered ``messages/item.html`` for each
+message, stamped with the author's profile_version and the message
+timestamp, so a stale copy is never served after a profile edit and reused
+ids (e.g. after a database reset) aren't confused.
+
+Fragments must not depend on the viewer; per-viewer parts such as the like
+button are rendered around them.
+
+Backends are pluggable: an in-process LRU (the default) or a SQLite file
+shared by every worker on a host. Configured with FRAGMENT_CACHE_BACKEND
+('lru', 'sqlite' or 'none'), FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL and
+FRAGMENT_CACHE_PATH.
+"""
+
+import os
+import sqlite3
+import tempfile
+import time
+from threading import Lock, local
+
+from flask import current_app
+from markupsafe import Markup
+
+from caching import LRUCache
+
+FRAGMENT_TEMPLATE = 'messages/item.html'
+
+
+class LRUBackend:
+    """Per-process fragment store."""
+
+    def __init__(self, maxsize, ttl):
+        self.cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class SQLiteBackend:
+    """Fragment store in a SQLite file shared by processes on one host."""
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self.sets = 0
+        self._local = local()
+        self._lock = Lock()
+
+        with self.connection as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS fragments ("
+                         "key TEXT PRIMARY KEY, value TEXT, expires REAL)")
+
+    @property
+    def connection(self):
+        # sqlite3 connections can't be shared between threads.
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self.connection.execute(
+            "SELECT value FROM fragments WHERE key = ? AND expires > ?",
+            (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value):
+        with self.connection as conn:
+            conn.execute("INSERT OR REPLACE INTO fragments VALUES (?, ?, ?)",
+                         (key, value, time.time() + self.ttl))
+
+        with self._lock:
+            self.sets += 1
+            prune = self.sets % self.PRUNE_EVERY == 0
+        if prune:
+            with self.connection as conn:
+                conn.execute("DELETE FROM fragments WHERE expires <= ?",
+                             (time.time(),))
+
+    def delete(self, key):
+        with self.connection as conn:
+            conn.execute("DELETE FROM fragments WHERE key = ?", (key,))
+
+    def clear(self):
+        with self.connection as conn:
+            conn.execute("DELETE FROM fragments")
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT count(*) FROM fragments").fetchone()[0]
+
+
+class FragmentCache:
+    """Caches the rendered markup of individual messages."""
+
+    def __init__(self):
+        self.backend = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_BACKEND', 'lru')
+        app.config.setdefault('FRAGMENT_CACHE_SIZE', 10000)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 3600)
+        app.config.setdefault('FRAGMENT_CACHE_PATH', os.path.join(
+            tempfile.gettempdir(), 'warbler-fragments.sqlite3'))
+
+        backend = app.config['FRAGMENT_CACHE_BACKEND']
+        if backend == 'lru':
+            self.backend = LRUBackend(app.config['FRAGMENT_CACHE_SIZE'],
+                                      app.config['FRAGMENT_CACHE_TTL'])
+        elif backend == 'sqlite':
+            self.backend = SQLiteBackend(app.config['FRAGMENT_CACHE_PATH'],
+                                         app.config['FRAGMENT_CACHE_TTL'])
+        elif backend == 'none':
+            self.backend = None
+        else:
+            raise ValueError(f"Unknown FRAGMENT_CACHE_BACKEND {backend!r}")
+
+        app.jinja_env.globals['message_fragment'] = self.render
+
+    @staticmethod
+    def key(message_id):
+        return f"message:{message_id}"
+
+    @staticmethod
+    def stamp(msg):
+        return (f"{msg.user.id}:{msg.user.profile_version}:"
+                f"{msg.timestamp.isoformat()}:"
+                f"{current_app.config['ETAG_VERSION']}")
+
+    def render(self, msg):
+        """Return the markup for `msg`, from the cache when it's current."""
+
+        if self.backend is None:
+            return self._render(msg)
+
+        stamp = self.stamp(msg)
+        cached = self.backend.get(self.key(msg.id))
+
+        if cached is not None:
+            cached_stamp, _, html = cached.partition('\n')
+            if cached_stamp == stamp:
+                with self._lock:
+                    self.hits += 1
+                return Markup(html)
+
+        with self._lock:
+            self.misses += 1
+
+        html = self._render(msg)
+        self.backend.set(self.key(msg.id), f"{stamp}\n{html}")
+        return html
+
+    def _render(self, msg):
+        template = current_app.jinja_env.get_template(FRAGMENT_TEMPLATE)
+        return Markup(template.render(msg=msg))
+
+    def invalidate(self, message_id):
+        """Forget the fragment of a deleted message."""
+
+        if self.backend is not None:
+            self.backend.delete(self.key(message_id))
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def stats(self):
+        """Return hit/miss counters and the hit rate as a dict."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'size': len(self.backend) if self.backend is not None else 0,
+            }
@@ -1,77 +1,278 @@
-"""Generate CSVs of random data for Warbler.
+"""Generate CSVs of synthetic data for Warbler.
 
 Students won't need to run this for the exercise; they will just use the CSV
-files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+files in this directory. Run this to generate bigger datasets, e.g. for load
+testing:
+
+    python generator/create_csvs.py --users 1000000 --messages 100000000
+    python seed.py --data-dir generator/data
+
+Everything is generated offline and is reproducible for a given --seed and
+--shard-size. Output is streamed to ``<table>-NNNN.csv`` shards, written in
+parallel by --workers processes, so memory use doesn't grow with the scale.
+
+The data is shaped like a real social network:
+
+- follows: how many accounts a user follows is heavy-tailed, and who they
+  follow is drawn from a power law, so a few accounts have huge followings;
+- messages: a power law of how active users are, posted in bursts rather
+  than evenly over time;
+- likes: heavy-tailed per user, concentrated on popular messages.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import glob
+import os
+import time
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from random import Random
 
-MAX_WARBLER_LENGTH = 140
+from faker import Faker
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
-FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+from helpers import Permutation, exponential, pareto, power_law_rank, unit
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+MAX_WARBLER_LENGTH = 140
 
-fake = Faker()
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['id', 'text', 'timestamp', 'user_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id', 'followed_at']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-# Generate random profile image URLs to use for users
+# bcrypt hash of "password"
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+HEADER_IMAGE_URL = '/static/images/warbler-hero.jpg'
+
+# Distinct names for the hashes behind each random choice.
+(AUTHOR, BURST, BURST_TIME, GAP, FOLLOWS, FOLLOWED, LIKES, LIKED,
+ FOLLOWED_AT) = range(9)
+
+BURSTS_PER_USER = 24
+BURST_GAP = timedelta(minutes=20).total_seconds()
+
+POOL_SIZE = 2000
+
+vocab = None
+
+
+class Shape:
+    """The scale and shape of the generated dataset."""
+
+    def __init__(self, args):
+        self.users = args.users
+        self.messages = args.messages
+        self.follows_per_user = args.follows_per_user
+        self.likes_per_user = args.likes_per_user
+        self.max_following = min(args.max_following, max(self.users - 1, 0))
+        self.seed = args.seed
+        self.end = datetime(2020, 1, 1)
+        self.span = timedelta(days=365 * args.years).total_seconds()
+        self.start = self.end - timedelta(seconds=self.span)
+
+        # Popularity and activity ranks map to unrelated ids.
+        self.popular_user = Permutation(self.users, self.seed + 1)
+        self.active_user = Permutation(self.users, self.seed + 2)
+        self.popular_message = Permutation(max(self.messages, 1), self.seed + 3)
+
+    def author(self, message_id):
+        rank = power_law_rank(unit(self.seed, AUTHOR, message_id),
+                              self.users, 1.0)
+        return self.active_user(rank)
+
+    def timestamp(self, message_id, author):
+        """Messages cluster in a few bursts of activity per author."""
+
+        burst = int(unit(self.seed, BURST, message_id) * BURSTS_PER_USER)
+        center = unit(self.seed, BURST_TIME, author, burst) * self.span
+        gap = exponential(unit(self.seed, GAP, message_id), BURST_GAP)
+        return self.start + timedelta(seconds=min(center + gap, self.span))
+
+    def followed(self, user_id):
+        """Ids of the users `user_id` follows."""
+
+        count = min(pareto(unit(self.seed, FOLLOWS, user_id),
+                           self.follows_per_user), self.max_following)
+        followed = set()
+        for attempt in range(count * 3):
+            if len(followed) >= count:
+                break
+            rank = power_law_rank(unit(self.seed, FOLLOWED, user_id, attempt),
+                                  self.users, 0.9)
+            other = self.popular_user(rank)
+            if other != user_id:
+                followed.add(other)
+        return followed
+
+    def followed_at(self, user_id, followed):
+        """When `user_id` followed `followed`, uniformly over the span."""
+
+        offset = unit(self.seed, FOLLOWED_AT, user_id, followed) * self.span
+        return self.start + timedelta(seconds=offset)
+
+    def liked(self, user_id):
+        """Ids of the messages `user_id` likes."""
+
+        if not self.messages:
+            return set()
+
+        count = min(pareto(unit(self.seed, LIKES, user_id),
+                           self.likes_per_user), self.messages)
+        liked = set()
+        for attempt in range(count * 3):
+            if len(liked) >= count:
+                break
+            rank = power_law_rank(unit(self.seed, LIKED, user_id, attempt),
+                                  self.messages, 0.9)
+            message_id = self.popular_message(rank)
+            if self.author(message_id) != user_id:
+                liked.add(message_id)
+        return liked
+
+
+def load_vocab(seed):
+    """Build pools of fake names and text once per worker process."""
+
+    global vocab
+
+    fake = Faker()
+    fake.seed_instance(seed)
+    vocab = {
+        # The user id is appended to these, so strip digits to keep them unique.
+        'usernames': [fake.user_name().rstrip('0123456789')
+                      for i in range(POOL_SIZE)],
+        'bios': [fake.sentence() for i in range(POOL_SIZE)],
+        'cities': [fake.city() for i in range(POOL_SIZE // 5)],
+        'texts': [fake.paragraph()[:MAX_WARBLER_LENGTH]
+                  for i in range(POOL_SIZE)],
+    }
+
+
+def write_users(shape, rng, writer, first, last):
+    for user_id in range(first, last):
+        username = f"{rng.choice(vocab['usernames'])}{user_id}"
+        writer.writerow([user_id, f"{username}@example.com", username,
+                         rng.choice(IMAGE_URLS), PASSWORD,
+                         rng.choice(vocab['bios']), HEADER_IMAGE_URL,
+                         rng.choice(vocab['cities'])])
+    return last - first
+
+
+def write_messages(shape, rng, writer, first, last):
+    for message_id in range(first, last):
+        author = shape.author(message_id)
+        writer.writerow([message_id, rng.choice(vocab['texts']),
+                         shape.timestamp(message_id, author), author])
+    return last - first
+
+
+def write_follows(shape, rng, writer, first, last):
+    rows = 0
+    for user_id in range(first, last):
+        for followed in shape.followed(user_id):
+            writer.writerow([followed, user_id,
+                             shape.followed_at(user_id, followed)])
+            rows += 1
+    return rows
+
+
+def write_likes(shape, rng, writer, first, last):
+    rows = 0
+    for user_id in range(first, last):
+        for message_id in shape.liked(user_id):
+            writer.writerow([user_id, message_id])
+            rows += 1
+    return rows
+
+
+TABLES = {
+    'users': (USERS_CSV_HEADERS, write_users),
+    'messages': (MESSAGES_CSV_HEADERS, write_messages),
+    'follows': (FOLLOWS_CSV_HEADERS, write_follows),
+    'likes': (LIKES_CSV_HEADERS, write_likes),
+}
+
+
+def write_shard(task):
+    """Write one shard file; return (table, rows, path)."""
+
+    args, table, shard, first, last = task
+    headers, write_rows = TABLES[table]
+    path = os.path.join(args.out, f"{table}-{shard:04d}.csv")
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        rows = write_rows(Shape(args), Random(f"{args.seed}:{table}:{shard}"),
+                          writer, first, last)
+
+    return table, rows, path
+
+
+def tasks(args):
+    """Split the work into shards: id ranges of users or messages."""
+
+    # Follows and likes shards cover fewer users, so they are about as big.
+    per_shard = {
+        'users': args.shard_size,
+        'messages': args.shard_size,
+        'follows': max(1, args.shard_size // max(args.follows_per_user, 1)),
+        'likes': max(1, args.shard_size // max(args.likes_per_user, 1)),
+    }
+    totals = {'users': args.users, 'messages': args.messages,
+              'follows': args.users, 'likes': args.users}
+
+    for table in TABLES:
+        size = per_shard[table]
+        for shard, first in enumerate(range(1, totals[table] + 1, size)):
+            yield args, table, shard, first, min(first + size,
+                                                 totals[table] + 1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows-per-user', type=int, default=17,
+                        help='Average accounts followed per user.')
+    parser.add_argument('--max-following', type=int, default=5000)
+    parser.add_argument('--likes-per-user', type=int, default=5,
+                        help='Average messages liked per user.')
+    parser.add_argument('--years', type=int, default=2,
+                        help='Messages are spread over this many years.')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--shard-size', type=int, default=1000000,
+                        help='Rows per output file.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=os.path.join('generator', 'data'))
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    for table in TABLES:
+        for path in glob.glob(os.path.join(args.out, f"{table}-*.csv")):
+            os.remove(path)
+
+    start = time.perf_counter()
+    total = 0
+
+    with Pool(args.workers, initializer=load_vocab,
+              initargs=(args.seed,)) as pool:
+        for table, rows, path in pool.imap_unordered(write_shard, tasks(args)):
+            total += rows
+            elapsed = time.perf_counter() - start
+            print(f"{path}: {rows} {table} "
+                  f"({total / elapsed:,.0f} rows/s overall)")
+
+    print(f"Wrote {total} rows to {args.out} in "
+          f"{time.perf_counter() - start:.1f}s")
 
-header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
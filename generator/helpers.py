@@ -1,8 +1,17 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
+
+The generator shards its output across processes, so anything one shard
+needs to know about rows written by another (who wrote message 123? when?)
+is derived from a hash of the seed and the row's id instead of being stored
+or sent between processes.
+"""
 
 from datetime import datetime
+from math import gcd, log
 from random import uniform
 
+MASK64 = (1 << 64) - 1
+
 
 def get_random_datetime(year_gap=2):
     """Get a random datetime within the last few years."""
@@ -12,3 +21,64 @@ def get_random_datetime(year_gap=2):
     random_timestamp = uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def mix64(*values):
+    """Hash integers to a well-mixed 64-bit integer (splitmix64)."""
+
+    x = 0x9E3779B97F4A7C15
+    for value in values:
+        x = (x ^ value) & MASK64
+        x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+        x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+        x ^= x >> 31
+    return x
+
+
+def unit(*values):
+    """Hash integers to a float in [0, 1)."""
+
+    return (mix64(*values) >> 11) / (1 << 53)
+
+
+def power_law_rank(u, n, exponent):
+    """Map `u` in [0, 1) to a rank in 1..n with P(rank) ~ rank ** -exponent.
+
+    Uses the inverse CDF of the continuous distribution, so it's O(1) and
+    needs no table, whatever the size of `n`.
+    """
+
+    if exponent == 1:
+        rank = (n + 1) ** u
+    else:
+        a = 1 - exponent
+        rank = (1 + u * ((n + 1) ** a - 1)) ** (1 / a)
+    return min(int(rank), n)
+
+
+def pareto(u, mean, alpha=2.0):
+    """Map `u` in [0, 1) to a heavy-tailed count with roughly this mean."""
+
+    scale = mean * (alpha - 1) / alpha
+    return int(scale * (1 - u) ** (-1 / alpha))
+
+
+class Permutation:
+    """Cheap bijection of 1..n, so popularity ranks map to scattered ids."""
+
+    def __init__(self, n, seed):
+        self.n = n
+        self.offset = mix64(seed, 1) % n
+        multiplier = mix64(seed, 2) % n or 1
+        while gcd(multiplier, n) != 1:
+            multiplier += 1
+        self.multiplier = multiplier
+
+    def __call__(self, rank):
+        return ((rank - 1) * self.multiplier + self.offset) % self.n + 1
+
+
+def exponential(u, mean):
+    """Map `u` in [0, 1) to an exponentially distributed value."""
+
+    return -mean * log(1 - u)
@@ -0,0 +1,63 @@
+"""Liking and unliking messages for Warbler.
+
+Each change is a single statement against ``likes`` keyed on
+``(user_id, message_id)``, so it costs the same however many messages the
+user has liked, and the user's likes_count only moves when a row was
+actually added or removed.
+"""
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import joinedload
+
+from models import db, Likes, Message
+from counters import adjust_counters
+from pagination import paginate
+from timeline import timeline_key
+
+
+def add_like(user_id, message_id):
+    """Like a message; return True if it wasn't liked already."""
+
+    result = db.session.execute(
+        insert(Likes.__table__)
+        .values(user_id=user_id, message_id=message_id)
+        .on_conflict_do_nothing(index_elements=['user_id', 'message_id']))
+
+    if result.rowcount:
+        adjust_counters(user_id, likes_count=1)
+    return bool(result.rowcount)
+
+
+def remove_like(user_id, message_id):
+    """Unlike a message; return True if it was liked."""
+
+    result = db.session.execute(
+        Likes.__table__
+        .delete()
+        .where(Likes.user_id == user_id)
+        .where(Likes.message_id == message_id))
+
+    if result.rowcount:
+        adjust_counters(user_id, likes_count=-1)
+    return bool(result.rowcount)
+
+
+def toggle_like(user_id, message_id):
+    """Unlike a liked message or like it otherwise; return whether it's liked."""
+
+    if remove_like(user_id, message_id):
+        return False
+
+    add_like(user_id, message_id)
+    return True
+
+
+def liked_messages_page(user_id, per_page, cursor=None):
+    """Return a Page of the messages a user has liked, newest first."""
+
+    return paginate(Message.query
+                    .options(joinedload(Message.user))
+                    .join(Likes, Likes.message_id == Message.id)
+                    .filter(Likes.user_id == user_id),
+                    [Message.timestamp, Message.id], timeline_key,
+                    per_page=per_page, cursor=cursor)
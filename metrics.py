@@ -0,0 +1,278 @@
+"""Request, SQL and template metrics for Warbler, in Prometheus text format.
+
+`Metrics` times every request and, per endpoint, how many SQL statements it
+issued and how long they took (from SQLAlchemy engine events), plus how long
+each template took to render (from Flask's template signals). Other parts
+of the app register their own ``stats()`` dicts, which are exported as
+gauges. Everything is served at METRICS_PATH (``/metrics`` by default) for
+Prometheus to scrape.
+
+Metrics are kept per process, like Prometheus client libraries do; each
+worker is scraped (or its results summed) separately. Configured with
+METRICS_ENABLED, METRICS_PATH and METRICS_TOKEN.
+
+The numbers describe the site's traffic and internals, so they are only
+served to scrapers sending ``Authorization: Bearer <METRICS_TOKEN>``
+(Prometheus's ``authorization`` scrape option). Without a token the path
+answers 404, though metrics are still collected.
+"""
+
+import hmac
+import re
+import time
+from bisect import bisect_left
+from threading import Lock
+
+from flask import (abort, before_render_template, current_app, g,
+                   has_request_context, request, template_rendered)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (.005, .01, .025, .05, .075, .1, .25, .5, .75, 1, 2.5, 5,
+                    7.5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+def escape(value):
+    """Escape a label value for the text exposition format."""
+
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Cumulative histogram with one series per set of label values."""
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self.series = {}
+
+    def observe(self, values, amount):
+        series = self.series.get(values)
+        if series is None:
+            series = self.series[values] = [[0] * len(self.buckets), 0.0, 0]
+        series[0][bisect_left(self.buckets, amount)] += 1
+        series[1] += amount
+        series[2] += 1
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for values, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labels, values,
+                                       [('le', format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labels, values)
+            yield f"{self.name}_sum{labels} {format_value(total)}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+class Counter:
+    """Monotonic counter with one series per set of label values."""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, values, amount=1):
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def expose(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for values, total in sorted(self.series.items()):
+            yield (f"{self.name}{format_labels(self.labels, values)} "
+                   f"{format_value(total)}")
+
+
+class Metrics:
+    """Collects per-endpoint metrics and serves them at METRICS_PATH."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.collectors = []
+
+        self.request_duration = Histogram(
+            'warbler_request_duration_seconds',
+            'Time spent handling requests.',
+            ('endpoint', 'method', 'status'), DURATION_BUCKETS)
+        self.request_statements = Histogram(
+            'warbler_request_sql_statements',
+            'SQL statements issued per request.',
+            ('endpoint',), COUNT_BUCKETS)
+        self.request_db_time = Histogram(
+            'warbler_request_db_seconds',
+            'Time spent waiting on SQL statements per request.',
+            ('endpoint',), DURATION_BUCKETS)
+        self.template_duration = Histogram(
+            'warbler_template_render_seconds',
+            'Time spent rendering templates.',
+            ('template',), DURATION_BUCKETS)
+        self.statements = Counter(
+            'warbler_sql_statements_total',
+            'SQL statements issued, inside requests or not.',
+            ('endpoint',))
+
+        self.metrics = [self.request_duration, self.request_statements,
+                        self.request_db_time, self.template_duration,
+                        self.statements]
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_PATH', '/metrics')
+        app.config.setdefault('METRICS_TOKEN', None)
+
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+        before_render_template.connect(self.start_template, app)
+        template_rendered.connect(self.finish_template, app)
+        # Every engine, so statements sent to other binds are counted too.
+        event.listen(Engine, 'before_cursor_execute', self.start_statement)
+        event.listen(Engine, 'after_cursor_execute', self.finish_statement)
+        event.listen(Engine, 'handle_error', self.fail_statement)
+
+        app.add_url_rule(app.config['METRICS_PATH'], 'metrics', self.export)
+
+    def register(self, prefix, stats, help=''):
+        """Export the numbers in the dict returned by `stats()` as gauges.
+
+        Each key becomes a ``warbler_<prefix>_<key>`` gauge.
+        """
+
+        self.collectors.append((prefix, stats, help))
+
+    ##########################################################################
+    # Hooks
+
+    def start_request(self):
+        g.metrics_start = time.perf_counter()
+        g.metrics_statements = 0
+        g.metrics_db_time = 0.0
+        g.metrics_templates = []
+
+    def finish_request(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+
+        request_g = g._get_current_object()
+        labels = (request.endpoint or 'none', request.method,
+                  str(response.status_code))
+
+        def record():
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.request_duration.observe(labels, elapsed)
+                self.request_statements.observe(labels[:1],
+                                                request_g.metrics_statements)
+                self.request_db_time.observe(labels[:1],
+                                             request_g.metrics_db_time)
+
+        # A streamed body (see streaming.py) is rendered, and runs its
+        # queries, after this hook; count it once the server has sent it.
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+
+        return response
+
+    def start_template(self, app, template, context, **extra):
+        if has_request_context() and 'metrics_templates' in g:
+            g.metrics_templates.append(time.perf_counter())
+
+    def finish_template(self, app, template, context, **extra):
+        if has_request_context() and g.get('metrics_templates'):
+            elapsed = time.perf_counter() - g.metrics_templates.pop()
+            with self.lock:
+                self.template_duration.observe(
+                    (template.name or 'none',), elapsed)
+
+    def start_statement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('metrics_start', []).append(time.perf_counter())
+
+    def finish_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        starts = conn.info.get('metrics_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+
+        endpoint = None
+        if has_request_context() and 'metrics_start' in g:
+            g.metrics_statements += 1
+            g.metrics_db_time += elapsed
+            endpoint = request.endpoint
+
+        with self.lock:
+            self.statements.inc((endpoint or 'none',))
+
+    def fail_statement(self, exception_context):
+        # A failed statement never reaches after_cursor_execute; drop its
+        # start time so the next statement isn't timed from it.
+        conn = exception_context.connection
+        starts = conn.info.get('metrics_start') if conn is not None else None
+        if starts:
+            starts.pop()
+
+    ##########################################################################
+    # Export
+
+    def collect(self):
+        """Yield the lines of the text exposition format."""
+
+        with self.lock:
+            for metric in self.metrics:
+                yield from metric.expose()
+
+        for prefix, stats, help in self.collectors:
+            for key, value in sorted(stats().items()):
+                if not isinstance(value, (int, float)):
+                    continue
+                name = re.sub(r'[^a-zA-Z0-9_]', '_',
+                              f"warbler_{prefix}_{key}")
+                yield f"# HELP {name} {help or prefix} {key}."
+                yield f"# TYPE {name} gauge"
+                yield f"{name} {format_value(value)}"
+
+    def export(self):
+        token = current_app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+
+        sent = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(sent.encode(),
+                                   f'Bearer {token}'.encode()):
+            return 'Unauthorized\n', 401, {
+                'WWW-Authenticate': 'Bearer realm="metrics"'}
+
+        return '\n'.join(self.collect()) + '\n', 200, {
+            'Content-Type': CONTENT_TYPE}
@@ -0,0 +1,403 @@
+"""Schema migrations for Warbler.
+
+`db.create_all()` builds a fresh database from models.py but can't change
+an existing one. `migrate` applies the MIGRATIONS that an existing database
+hasn't had yet, recording each in a ``schema_migrations`` table. Run it with
+``flask migrate`` after deploying new code.
+
+Every step is idempotent (``IF NOT EXISTS`` and friends), so a database
+built by `db.create_all()` can be migrated safely, and a migration
+interrupted part way is simply run again. Steps run in autocommit mode, one
+statement at a time, so indexes can be built with ``CREATE INDEX
+CONCURRENTLY`` without blocking writes to the table.
+
+A concurrent index build waits for every transaction open when it starts,
+so long-running transactions hold up a migration.
+
+`check_plans` (``flask check-plans``) runs the app's own query builders for
+the hot pages, explains the statements they issue with sequential scans
+disabled, and reports any that still read a whole table or index, i.e.
+that no index can serve.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from counters import FIX_DRIFT_SQL
+from follows import followers_page, following_page
+from likes import liked_messages_page
+from models import db, FOLLOWED_AT_DEFAULT, USER_SEARCH_DOCUMENT, User
+from pagination import OLDER, Cursor
+from search import search_messages, search_users
+from timeline import (REBUILD_SQL, home_timeline, recent_messages_by_author,
+                      user_messages_page)
+
+MIGRATIONS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version text PRIMARY KEY,
+        applied_at timestamp with time zone NOT NULL DEFAULT now()
+    )
+"""
+
+# Held while migrating, so two deploys can't migrate at once.
+LOCK_ID = 0x7761726272  # "warbr"
+
+Migration = namedtuple('Migration', ['version', 'description', 'steps'])
+
+
+class ConcurrentIndex:
+    """Step building an index with CREATE INDEX CONCURRENTLY.
+
+    A failed concurrent build leaves an invalid index behind, which is
+    dropped and built again.
+    """
+
+    def __init__(self, name, table, definition, unique=False):
+        self.name = name
+        self.table = table
+        self.definition = definition
+        self.unique = unique
+
+    def __call__(self, conn):
+        valid = conn.execute(text("""
+            SELECT x.indisvalid
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE i.relname = :name
+              AND i.relnamespace = 'public'::regnamespace
+        """), name=self.name).scalar()
+
+        if valid:
+            return
+        if valid is not None:
+            conn.execute(f'DROP INDEX CONCURRENTLY "{self.name}"')
+
+        unique = 'UNIQUE ' if self.unique else ''
+        conn.execute(f'CREATE {unique}INDEX CONCURRENTLY "{self.name}" '
+                     f'ON {self.table} {self.definition}')
+
+
+def add_constraint_using_index(table, name):
+    """Step turning the unique index `name` into a constraint of that name."""
+
+    return f"""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint
+                           WHERE conname = '{name}') THEN
+                ALTER TABLE {table}
+                    ADD CONSTRAINT {name} UNIQUE USING INDEX {name};
+            END IF;
+        END $$
+    """
+
+
+def column_exists(conn, table, column):
+    return conn.execute(text("""
+        SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                       WHERE table_schema = 'public'
+                         AND table_name = :table
+                         AND column_name = :column)
+    """), table=table, column=column).scalar()
+
+
+def add_counter_columns(conn):
+    """Add the users counter columns, and fill them if they were missing."""
+
+    columns = ['messages_count', 'following_count', 'followers_count',
+               'likes_count']
+    missing = [name for name in columns
+               if not column_exists(conn, 'users', name)]
+
+    for name in missing:
+        conn.execute(f"ALTER TABLE users ADD COLUMN {name} integer "
+                     f"NOT NULL DEFAULT 0")
+    if missing:
+        conn.execute(FIX_DRIFT_SQL)
+
+
+def backfill_timelines(conn):
+    """Fill timeline_entries if it is still empty."""
+
+    if conn.execute("SELECT EXISTS (SELECT 1 FROM timeline_entries)").scalar():
+        return
+
+    conn.execute(REBUILD_SQL, {
+        'depth': current_app.config['TIMELINE_DEPTH'],
+        'fanout_threshold': current_app.config['TIMELINE_FANOUT_THRESHOLD'],
+    })
+
+
+# The original schema allowed one like per message, whoever liked it.
+DROP_LIKES_MESSAGE_ID_KEY = """
+    ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key
+"""
+
+
+MIGRATIONS = [
+    Migration('0001', 'Denormalized counters on users', [
+        add_counter_columns,
+    ]),
+    Migration('0002', 'Profile version for fragment cache stamps', [
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS profile_version integer "
+        "NOT NULL DEFAULT 0",
+    ]),
+    Migration('0003', 'One like per user and message', [
+        "DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL",
+        """
+            DELETE FROM likes AS a
+            USING likes AS b
+            WHERE a.user_id = b.user_id
+              AND a.message_id = b.message_id
+              AND a.id > b.id
+        """,
+        "ALTER TABLE likes ALTER COLUMN user_id SET NOT NULL",
+        "ALTER TABLE likes ALTER COLUMN message_id SET NOT NULL",
+        DROP_LIKES_MESSAGE_ID_KEY,
+        ConcurrentIndex('uq_likes_user_message', 'likes',
+                        '(user_id, message_id)', unique=True),
+        add_constraint_using_index('likes', 'uq_likes_user_message'),
+        ConcurrentIndex('ix_likes_message_id', 'likes', '(message_id)'),
+    ]),
+    Migration('0004', 'Materialized home timelines', [
+        """
+            CREATE TABLE IF NOT EXISTS timeline_entries (
+                user_id integer NOT NULL
+                    REFERENCES users (id) ON DELETE CASCADE,
+                message_id integer NOT NULL
+                    REFERENCES messages (id) ON DELETE CASCADE,
+                timestamp timestamp without time zone NOT NULL,
+                PRIMARY KEY (user_id, message_id)
+            )
+        """,
+        ConcurrentIndex('ix_timeline_entries_user_timestamp',
+                        'timeline_entries', '(user_id, timestamp, message_id)'),
+        backfill_timelines,
+    ]),
+    Migration('0005', 'Search indexes', [
+        ConcurrentIndex('ix_users_search', 'users',
+                        f"USING gin (({USER_SEARCH_DOCUMENT}))"),
+        ConcurrentIndex('ix_users_username_prefix', 'users',
+                        '(lower(username) text_pattern_ops)'),
+        ConcurrentIndex('ix_messages_search', 'messages',
+                        "USING gin (to_tsvector('english', text))"),
+    ]),
+    Migration('0006', 'Hot-path indexes', [
+        ConcurrentIndex('ix_messages_user_timestamp', 'messages',
+                        '(user_id, timestamp, id)'),
+        ConcurrentIndex('ix_follows_following', 'follows',
+                        '(user_following_id, user_being_followed_id)'),
+        ConcurrentIndex('ix_timeline_entries_message_id', 'timeline_entries',
+                        '(message_id)'),
+    ]),
+    # Follows made before this migration all get the time it ran.
+    Migration('0007', 'Follow times for the followers and following pages', [
+        "ALTER TABLE follows ADD COLUMN IF NOT EXISTS followed_at "
+        "timestamp without time zone NOT NULL "
+        f"DEFAULT {FOLLOWED_AT_DEFAULT.text}",
+        ConcurrentIndex('ix_follows_followed_followed_at', 'follows',
+                        '(user_being_followed_id, followed_at, '
+                        'user_following_id)'),
+        ConcurrentIndex('ix_follows_following_followed_at', 'follows',
+                        '(user_following_id, followed_at, '
+                        'user_being_followed_id)'),
+    ]),
+    # For databases that had 0003 before it dropped the constraint.
+    Migration('0008', 'Let more than one user like a message', [
+        DROP_LIKES_MESSAGE_ID_KEY,
+    ]),
+]
+
+
+def applied_versions(conn):
+    conn.execute(MIGRATIONS_TABLE_SQL)
+    return {version for (version,) in
+            conn.execute("SELECT version FROM schema_migrations")}
+
+
+def pending_migrations(engine, migrations=MIGRATIONS):
+    """Return the migrations this database hasn't had yet."""
+
+    with engine.connect() as conn:
+        applied = applied_versions(conn)
+    return [migration for migration in migrations
+            if migration.version not in applied]
+
+
+def migrate(engine, migrations=MIGRATIONS, echo=print):
+    """Apply pending migrations in order; return the versions applied."""
+
+    applied_now = []
+
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        conn.execute(text("SELECT pg_advisory_lock(:id)"), id=LOCK_ID)
+
+        try:
+            applied = applied_versions(conn)
+
+            for migration in migrations:
+                if migration.version in applied:
+                    continue
+
+                echo(f"Applying {migration.version}: {migration.description}")
+                for step in migration.steps:
+                    if callable(step):
+                        step(conn)
+                    else:
+                        conn.execute(step)
+
+                conn.execute(text("INSERT INTO schema_migrations (version) "
+                                  "VALUES (:version)"),
+                             version=migration.version)
+                applied_now.append(migration.version)
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:id)"), id=LOCK_ID)
+
+    return applied_now
+
+
+##############################################################################
+# Plan checks
+
+# Keys to page past, so the checked statements include the seek predicates.
+TIMESTAMP_CURSOR = Cursor(OLDER, (datetime(2020, 1, 1), 1))
+RANK_CURSOR = Cursor(OLDER, (0.5, 1))
+
+# The hot pages and cascading deletes. Each entry either calls the function
+# the app builds its queries with, whose statements are captured as issued,
+# or, for what Postgres runs itself, is plain SQL. Every statement must be
+# answerable from indexes alone.
+HOT_QUERIES = [
+    ('profile messages',
+     lambda: user_messages_page(1, 100, TIMESTAMP_CURSOR)),
+    ('home timeline',
+     lambda: home_timeline(1, 101, cursor=TIMESTAMP_CURSOR)),
+    ('celebrity messages',
+     lambda: recent_messages_by_author([1, 2, 3], 101, TIMESTAMP_CURSOR)),
+    ('following',
+     lambda: following_page(1, 60, TIMESTAMP_CURSOR)),
+    ('followers',
+     lambda: followers_page(1, 60, TIMESTAMP_CURSOR)),
+    ('liked messages',
+     lambda: liked_messages_page(1, 100, TIMESTAMP_CURSOR)),
+    ('liked among',
+     lambda: User(id=1).liked_ids_among([1, 2, 3])),
+    ('user search',
+     lambda: search_users('bird', 60, RANK_CURSOR)),
+    ('message search',
+     lambda: search_messages('coffee', 100, TIMESTAMP_CURSOR)),
+    ('message search by author',
+     lambda: search_messages('coffee', 100, TIMESTAMP_CURSOR, author_id=1)),
+    ('message search of followed',
+     lambda: search_messages('coffee', 100, TIMESTAMP_CURSOR,
+                             followed_by_id=1)),
+    ('message likes on delete', """
+        SELECT 1 FROM likes WHERE message_id = %(message_id)s
+    """),
+    ('timeline entries on delete', """
+        SELECT 1 FROM timeline_entries WHERE message_id = %(message_id)s
+    """),
+]
+
+
+def issued_statements(query):
+    """Return the (statement, parameters) pairs a hot query entry sends."""
+
+    if isinstance(query, str):
+        return [(query, {'message_id': 1})]
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        query()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+        db.session.rollback()
+
+    return statements
+
+
+INDEX_LEADING_COLUMN_SQL = text("""
+    SELECT t.relname, a.attname
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_class t ON t.oid = x.indrelid
+    JOIN pg_attribute a ON a.attrelid = x.indrelid AND a.attnum = x.indkey[0]
+    WHERE i.relname = :name
+      AND i.relnamespace = 'public'::regnamespace
+""")
+
+INDEX_SCANS = {'Index Scan', 'Index Only Scan', 'Bitmap Index Scan'}
+
+
+def scans(plan, parent=None):
+    """Yield (node, parent node) for the scan nodes of a JSON plan."""
+
+    if 'Relation Name' in plan or plan.get('Node Type') in INDEX_SCANS:
+        yield plan, parent
+    for child in plan.get('Plans', []):
+        yield from scans(child, plan)
+
+
+def full_scans(conn, plan):
+    """Yield (table, how) for each scan that reads a whole table or index.
+
+    An index searched on a condition that doesn't constrain its leading
+    column is read from end to end. (Index scans without a condition, or
+    feeding a merge join, which stops with its other side, are left to the
+    planner's judgment.)
+    """
+
+    for node, parent in scans(plan):
+        if node['Node Type'] == 'Seq Scan':
+            yield node['Relation Name'], 'sequential scan'
+        elif (node['Node Type'] in INDEX_SCANS
+              and (parent or {}).get('Node Type') != 'Merge Join'):
+            row = conn.execute(INDEX_LEADING_COLUMN_SQL,
+                               name=node['Index Name']).fetchone()
+            condition = node.get('Index Cond')
+            if (row and condition
+                    and not re.search(rf'\b{row.attname}\b', condition)):
+                yield row.relname, f"full scan of {node['Index Name']}"
+
+
+def check_plans(engine, queries=HOT_QUERIES):
+    """Explain each hot query; return (name, table, how) for each full scan.
+
+    Statements from the app's query builders are captured by running them
+    against the app's database (in a transaction that is rolled back), and
+    explained with the parameters they were sent with.
+
+    Sequential scans are disabled for the check, so the planner only falls
+    back to one when no index can serve the query at all, however much data
+    there is.
+    """
+
+    problems = []
+    statements = [(name, statement, parameters)
+                  for name, query in queries
+                  for statement, parameters in issued_statements(query)]
+
+    with engine.connect() as conn:
+        with conn.begin() as transaction:
+            conn.execute("SET LOCAL enable_seqscan = off")
+            cursor = conn.connection.cursor()
+            for name, statement, parameters in statements:
+                cursor.execute("EXPLAIN (FORMAT JSON) " + statement,
+                               parameters)
+                [plan] = cursor.fetchone()[0]
+                problems.extend((name, table, how) for table, how
+                                in full_scans(conn, plan['Plan']))
+            transaction.rollback()
+
+    return problems
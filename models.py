@@ -2,17 +2,31 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from passwords import password_hasher
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+# UTC, like the message timestamps set from datetime.utcnow.
+FOLLOWED_AT_DEFAULT = db.text("(now() AT TIME ZONE 'utc')")
 
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
 
     __tablename__ = 'follows'
+    # The primary key serves "who follows X"; this serves "who does X follow".
+    # The followed_at indexes serve the followers and following pages.
+    __table_args__ = (
+        db.Index('ix_follows_following',
+                 'user_following_id', 'user_being_followed_id'),
+        db.Index('ix_follows_followed_followed_at', 'user_being_followed_id',
+                 'followed_at', 'user_following_id'),
+        db.Index('ix_follows_following_followed_at', 'user_following_id',
+                 'followed_at', 'user_being_followed_id'),
+    )
 
     user_being_followed_id = db.Column(
         db.Integer,
@@ -26,11 +40,23 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    followed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=FOLLOWED_AT_DEFAULT,
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
+    # A user likes a message at most once; the index also serves
+    # "has this user liked these messages?" lookups.
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'message_id',
+                            name='uq_likes_user_message'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -39,13 +65,15 @@ class Likes(db.Model):
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        nullable=False,
+        index=True,
     )
 
 
@@ -94,7 +122,46 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized counts, maintained by the views (see counters.py).
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever anything shown next to the user's messages (name,
+    # picture) changes; keys the rendered message fragments (fragments.py).
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    messages = db.relationship('Message', back_populates='user')
 
     followers = db.relationship(
         "User",
@@ -121,14 +188,48 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.following_ids_among([other_user.id])
+
+    def following_ids_among(self, user_ids):
+        """Which of `user_ids` is this user following?
+
+        Resolves a whole page of users with one indexed query and returns
+        the followed ids as a set.
+        """
+
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == self.id,
+                            Follows.user_being_followed_id.in_(user_ids)))
+
+        return {user_id for (user_id,) in followed}
+
+    def liked_ids_among(self, message_ids):
+        """Which of `message_ids` has this user liked?
+
+        Resolves a whole page of messages with one query on the
+        (user_id, message_id) index and returns the liked ids as a set.
+        """
+
+        message_ids = list(message_ids)
+        if not message_ids:
+            return set()
+
+        liked = (db.session
+                 .query(Likes.message_id)
+                 .filter(Likes.user_id == self.id,
+                         Likes.message_id.in_(message_ids)))
+
+        return {message_id for (message_id,) in liked}
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +238,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = password_hasher.hash(password)
 
         user = User(
             username=username,
@@ -162,18 +263,52 @@ class User(db.Model):
 
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user and user.check_password(password):
+            return user
 
         return None
 
+    def check_password(self, password):
+        """Does `password` match this user's password?
+
+        A matching password stored with an outdated bcrypt cost is rehashed
+        at the current one; the caller commits the change.
+        """
+
+        if not password_hasher.check(self.password, password):
+            return False
+
+        if password_hasher.needs_rehash(self.password):
+            self.password = password_hasher.hash(password)
+
+        return True
+
+
+# Full-text document for user search (see search.py). Queries must use this
+# exact expression for Postgres to match it to the GIN index below.
+USER_SEARCH_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(username, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(bio, '')), 'B') || "
+    "setweight(to_tsvector('simple', coalesce(location, '')), 'C')"
+)
+
+event.listen(User.__table__, 'after_create', DDL(
+    f"CREATE INDEX ix_users_search ON users USING gin (({USER_SEARCH_DOCUMENT}))"))
+
+# Lets `lower(username) LIKE 'prefix%'` use an index range scan.
+event.listen(User.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_users_username_prefix "
+    "ON users (lower(username) text_pattern_ops)"))
+
 
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
+    # A user's messages, newest first (profiles and pulled timelines).
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp', 'user_id', 'timestamp', 'id'),
+    )
 
     id = db.Column(
         db.Integer,
@@ -188,7 +323,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -197,7 +332,48 @@ class Message(db.Model):
         nullable=False,
     )
 
-    user = db.relationship('User')
+    # Every message has an author, so eager loads of it (see the feed queries
+    # in app.py) can use an inner join.
+    user = db.relationship('User', back_populates='messages', innerjoin=True)
+
+
+# Full-text index for message search (see search.py). Postgres keeps it up to
+# date on every insert and delete.
+event.listen(Message.__table__, 'after_create', DDL(
+    "CREATE INDEX ix_messages_search "
+    "ON messages USING gin (to_tsvector('english', text))"))
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # Copied from the message so a timeline can be read with one range scan
+    # over (user_id, timestamp) without touching the messages table.
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        # For deleting a message's entries.
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
 
 
 def connect_db(app):
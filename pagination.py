@@ -0,0 +1,195 @@
+"""Keyset (cursor) pagination for Warbler's feeds and user lists.
+
+Pages are sorted newest first on a tuple of key columns that ends in a
+unique column, so rows with equal timestamps are neither repeated nor
+skipped. Instead of an OFFSET, each page links to its neighbours with an
+opaque, signed cursor holding the endpoint, the direction and the key of
+the edge row, and the next page is fetched with a ``(keys) < (cursor key)``
+range scan. A cursor is only accepted by the endpoint that made it, and
+only if its key has the shape of that endpoint's keys.
+"""
+
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, has_request_context, request, url_for
+from itsdangerous import BadData, URLSafeSerializer
+from sqlalchemy import literal, tuple_
+
+OLDER = 'older'
+NEWER = 'newer'
+
+CURSOR_SALT = 'warbler-keyset-cursor'
+
+Cursor = namedtuple('Cursor', ['direction', 'key'])
+
+
+class Page:
+    """One page of results, newest first, with cursors to its neighbours."""
+
+    def __init__(self, items, older=None, newer=None):
+        self.items = items
+        self.older = older
+        self.newer = newer
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def _serializer():
+    return URLSafeSerializer(current_app.secret_key, salt=CURSOR_SALT)
+
+
+def _endpoint():
+    return request.endpoint if has_request_context() else None
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value):
+    if isinstance(value, dict):
+        return datetime.strptime(
+            value['dt'],
+            '%Y-%m-%dT%H:%M:%S.%f' if '.' in value['dt'] else '%Y-%m-%dT%H:%M:%S')
+    return value
+
+
+def encode_cursor(direction, key):
+    """Return an opaque, signed token for paging the current view past `key`."""
+
+    return _serializer().dumps(
+        [_endpoint(), direction, [_dump_value(v) for v in key]])
+
+
+def decode_cursor(token):
+    """Return the Cursor in a token, or abort with 400 if it was tampered
+    with or made by another view."""
+
+    try:
+        endpoint, direction, key = _serializer().loads(token)
+    except (BadData, TypeError, ValueError):
+        abort(400)
+
+    if endpoint != _endpoint() or direction not in (OLDER, NEWER):
+        abort(400)
+
+    try:
+        return Cursor(direction, tuple(_load_value(v) for v in key))
+    except (KeyError, TypeError, ValueError):
+        abort(400)
+
+
+def cursor_from_request():
+    """Return the Cursor in the `cursor` query param, if there is one."""
+
+    token = request.args.get('cursor')
+    return decode_cursor(token) if token else None
+
+
+def page_url(cursor):
+    """URL of the current page's view at `cursor`, keeping other query args."""
+
+    args = request.args.to_dict()
+    args['cursor'] = cursor
+    args.update(request.view_args)
+    return url_for(request.endpoint, **args)
+
+
+def is_ascending(cursor):
+    """Are rows for this cursor scanned oldest first?
+
+    Paging towards newer rows walks the index upwards from the cursor; the
+    rows are put back into newest-first order by `make_page`.
+    """
+
+    return cursor is not None and cursor.direction == NEWER
+
+
+def _matches(key, value):
+    """Could `value` be a value of the `key` column?"""
+
+    try:
+        expected = key.type.python_type
+    except NotImplementedError:
+        return True
+    if isinstance(value, bool):
+        return expected is bool
+    if expected is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, expected)
+
+
+def seek_condition(keys, cursor):
+    """Return the WHERE clause selecting rows past `cursor`, or None.
+
+    Aborts with 400 if the cursor's key doesn't fit `keys`.
+    """
+
+    if cursor is None:
+        return None
+
+    if (len(cursor.key) != len(keys) or
+            not all(map(_matches, keys, cursor.key))):
+        abort(400)
+
+    row = tuple_(*keys)
+    bound = tuple_(*[literal(value, key.type)
+                     for key, value in zip(keys, cursor.key)])
+    return row > bound if is_ascending(cursor) else row < bound
+
+
+def seek_order(keys, cursor):
+    """Return the ORDER BY clauses for scanning away from `cursor`."""
+
+    if is_ascending(cursor):
+        return [key.asc() for key in keys]
+    return [key.desc() for key in keys]
+
+
+def seek(query, keys, cursor):
+    """Filter and order `query` to scan the rows past `cursor`."""
+
+    condition = seek_condition(keys, cursor)
+    if condition is not None:
+        query = query.filter(condition)
+    return query.order_by(*seek_order(keys, cursor))
+
+
+def make_page(rows, cursor, per_page, key_of):
+    """Build a Page from up to `per_page + 1` rows in scan order.
+
+    The extra row only tells us whether there is more to page through in
+    the scan direction; `key_of(row)` returns the key tuple of a row.
+    """
+
+    has_more = len(rows) > per_page
+    items = list(rows[:per_page])
+
+    if is_ascending(cursor):
+        items.reverse()
+
+    if not items:
+        return Page(items)
+
+    more_older = has_more if not is_ascending(cursor) else True
+    more_newer = has_more if is_ascending(cursor) else cursor is not None
+
+    return Page(
+        items,
+        older=encode_cursor(OLDER, key_of(items[-1])) if more_older else None,
+        newer=encode_cursor(NEWER, key_of(items[0])) if more_newer else None,
+    )
+
+
+def paginate(query, keys, key_of, per_page, cursor=None):
+    """Return the Page of `query` past `cursor`, sorted newest first on `keys`."""
+
+    rows = seek(query, keys, cursor).limit(per_page + 1).all()
+    return make_page(rows, cursor, per_page, key_of)
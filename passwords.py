@@ -0,0 +1,200 @@
+"""Password hashing for Warbler, off the request threads.
+
+bcrypt is deliberately slow, so hashing and checking passwords inline lets a
+burst of logins tie up every request thread. `PasswordHasher` runs that work
+on a small process pool instead. At most PASSWORD_HASH_MAX_PENDING jobs may
+be queued or running at once; past that, callers get `PasswordHasherBusy`
+straight away rather than waiting behind the queue.
+
+The bcrypt cost is BCRYPT_LOG_ROUNDS. Hashes made with a different cost are
+reported by `needs_rehash`, so they can be upgraded on the next login.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from os import getpid
+from threading import BoundedSemaphore, Lock
+
+import bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT = 10
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password jobs are already pending."""
+
+
+def hash_password(password, rounds):
+    """Return the bcrypt hash of `password` as a str."""
+
+    return bcrypt.hashpw(password.encode('utf-8'),
+                         bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def check_password(pw_hash, password):
+    """Does `password` match the bcrypt hash `pw_hash`?"""
+
+    return bcrypt.checkpw(password.encode('utf-8'), pw_hash.encode('utf-8'))
+
+
+def hash_rounds(pw_hash):
+    """Return the cost factor stored in a bcrypt hash, or None."""
+
+    try:
+        return int(pw_hash.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded process pool.
+
+    Configured with BCRYPT_LOG_ROUNDS, PASSWORD_HASH_WORKERS (0 runs the
+    work inline), PASSWORD_HASH_MAX_PENDING and PASSWORD_HASH_TIMEOUT.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.workers = 0
+        self.max_pending = None
+        self.timeout = DEFAULT_TIMEOUT
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self._pending = None
+        self._pool = None
+        self._pool_pid = None
+        self._lock = Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', DEFAULT_WORKERS)
+        app.config.setdefault('PASSWORD_HASH_MAX_PENDING',
+                              max(app.config['PASSWORD_HASH_WORKERS'], 1) * 8)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', DEFAULT_TIMEOUT)
+
+        # Models hash passwords outside of requests too (seeding, tests), so
+        # keep the app rather than relying on current_app.
+        self.app = app
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.max_pending = app.config['PASSWORD_HASH_MAX_PENDING']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._pending = BoundedSemaphore(self.max_pending)
+        self.shutdown()
+
+    @property
+    def rounds(self):
+        if self.app is None:
+            return DEFAULT_LOG_ROUNDS
+        return self.app.config['BCRYPT_LOG_ROUNDS']
+
+    def hash(self, password):
+        """Return a bcrypt hash of `password` at the configured cost."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        return self._run(hash_password, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        if not password or not pw_hash:
+            return False
+
+        return self._run(check_password, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different cost than the configured one?"""
+
+        return hash_rounds(pw_hash) != self.rounds
+
+    def _get_pool(self):
+        # A pool can't be shared with a forked child, so each process
+        # starts its own on first use. Workers are spawned rather than
+        # forked so they don't inherit the parent's locks or connections.
+        with self._lock:
+            if self._pool is None or self._pool_pid != getpid():
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'))
+                self._pool_pid = getpid()
+            return self._pool
+
+    def _run(self, function, *args):
+        if self._pending is not None and not self._pending.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise PasswordHasherBusy()
+
+        with self._lock:
+            self.submitted += 1
+        start = time.perf_counter()
+
+        if not self.workers:
+            try:
+                return function(*args)
+            finally:
+                self._finished(start)
+
+        future = None
+        try:
+            future = self._get_pool().submit(function, *args)
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+        finally:
+            # Nothing else will free the job's slot if it never got queued.
+            if future is None:
+                self._finished(start)
+
+        # The job only leaves the queue when a worker is done with it, even
+        # if this request has stopped waiting.
+        future.add_done_callback(lambda future: self._finished(start))
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy()
+        except BrokenProcessPool:
+            self.shutdown()
+            raise
+
+    def _finished(self, start):
+        with self._lock:
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - start
+        if self._pending is not None:
+            self._pending.release()
+
+    def shutdown(self):
+        """Stop this process's worker pool, if it has one."""
+
+        with self._lock:
+            if self._pool is not None and self._pool_pid == getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pool_pid = None
+
+    def stats(self):
+        """Return the pool's counters as a dict."""
+
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self.submitted - self.completed,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'busy_seconds': self.busy_seconds,
+            }
+
+
+password_hasher = PasswordHasher()
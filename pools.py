@@ -0,0 +1,184 @@
+"""Database connection pool configuration and instrumentation for Warbler.
+
+Pool size, overflow, checkout timeout and recycle age come from
+SQLALCHEMY_POOL_SIZE, SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_TIMEOUT and
+SQLALCHEMY_POOL_RECYCLE as usual. On top of that, `configure_pool`:
+
+- pings connections before handing them out (DATABASE_POOL_PRE_PING), so
+  ones dropped by Postgres or a firewall are replaced instead of failing a
+  request;
+- with DATABASE_POOL_MODE = 'transaction', for running behind a
+  transaction-pooling proxy such as PgBouncer, opens a connection per
+  checkout and keeps no pool of its own. The proxy may hand each transaction
+  a different server connection, so nothing may rely on session state (SET,
+  session advisory locks, LISTEN, WITH HOLD cursors); run ``flask migrate``
+  against Postgres directly;
+- instruments every pool: checkout wait time and timeouts, connections in
+  use, overflow connections opened, and how long connections live. `stats`
+  reports them per bind, for /metrics.
+"""
+
+import time
+from threading import Lock
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import NullPool, QueuePool
+
+TRANSACTION_MODE = 'transaction'
+
+QUEUE_POOL_OPTIONS = ['pool_size', 'max_overflow', 'pool_timeout',
+                      'pool_recycle']
+
+
+class PoolStats:
+    """Counters for the pools of one bind."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.size = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_wait_seconds = 0.0
+        self.checkout_wait_max_seconds = 0.0
+        self.checkout_timeouts = 0
+        self.overflow_opened = 0
+        self.connections_opened = 0
+        self.connections_closed = 0
+        self.connection_lifetime_seconds = 0.0
+
+    def waited(self, seconds, timed_out=False):
+        with self.lock:
+            self.checkouts += 1
+            self.checkout_wait_seconds += seconds
+            self.checkout_wait_max_seconds = max(
+                self.checkout_wait_max_seconds, seconds)
+            self.checkout_timeouts += timed_out
+
+    def overflowed(self):
+        with self.lock:
+            self.overflow_opened += 1
+
+    # Pool event listeners.
+
+    def on_connect(self, dbapi_connection, connection_record):
+        connection_record.info['connected_at'] = time.monotonic()
+        with self.lock:
+            self.connections_opened += 1
+
+    def on_close(self, dbapi_connection, connection_record):
+        connected_at = connection_record.info.get('connected_at')
+        with self.lock:
+            self.connections_closed += 1
+            if connected_at is not None:
+                self.connection_lifetime_seconds += (time.monotonic()
+                                                     - connected_at)
+
+    def on_close_detached(self, dbapi_connection):
+        with self.lock:
+            self.connections_closed += 1
+
+    def on_checkout(self, dbapi_connection, connection_record,
+                    connection_proxy):
+        with self.lock:
+            self.checked_out += 1
+
+    def on_checkin(self, dbapi_connection, connection_record):
+        with self.lock:
+            self.checked_out -= 1
+
+    def as_dict(self):
+        with self.lock:
+            return {name: value for name, value in vars(self).items()
+                    if name != 'lock'}
+
+
+# Bind name -> PoolStats; shared by a bind's pools across recreation.
+STATS = {}
+
+
+class PoolInstrumentation:
+    """Pool mixin recording into the PoolStats of its bind."""
+
+    bind = 'primary'
+
+    def __init__(self, *args, _dispatch=None, **kwargs):
+        super().__init__(*args, _dispatch=_dispatch, **kwargs)
+
+        self.stats = STATS.setdefault(self.bind, PoolStats())
+        self.stats.size = self.size() if hasattr(self, 'size') else 0
+
+        # A recreated pool (after dispose()) copies its predecessor's
+        # listeners, which record into the same stats.
+        if _dispatch is None:
+            event.listen(self, 'connect', self.stats.on_connect)
+            event.listen(self, 'close', self.stats.on_close)
+            event.listen(self, 'close_detached', self.stats.on_close_detached)
+            event.listen(self, 'checkout', self.stats.on_checkout)
+            event.listen(self, 'checkin', self.stats.on_checkin)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.waited(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.waited(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedQueuePool(PoolInstrumentation, QueuePool):
+    """QueuePool that records checkout waits, occupancy and overflow."""
+
+    def _inc_overflow(self):
+        opened = super()._inc_overflow()
+        if opened and self._overflow > 0:
+            self.stats.overflowed()
+        return opened
+
+
+class InstrumentedNullPool(PoolInstrumentation, NullPool):
+    """NullPool (a connection per checkout) with the same instrumentation."""
+
+
+def for_bind(pool_class, bind):
+    """Subclass of `pool_class` recording into the stats for `bind`."""
+
+    return type(pool_class.__name__, (pool_class,), {'bind': bind})
+
+
+def bind_name(app, url):
+    """Name of the bind (see SQLALCHEMY_BINDS) connecting to `url`."""
+
+    if url == make_url(app.config['SQLALCHEMY_DATABASE_URI']):
+        return 'primary'
+    for bind, bind_url in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        if url == make_url(bind_url):
+            return bind
+    return url.database
+
+
+def configure_pool(app, url, options):
+    """Add pool settings to the `create_engine` options for `url`."""
+
+    app.config.setdefault('DATABASE_POOL_MODE', 'queue')
+    app.config.setdefault('DATABASE_POOL_PRE_PING', True)
+
+    bind = bind_name(app, url)
+
+    if app.config['DATABASE_POOL_MODE'] == TRANSACTION_MODE:
+        for option in QUEUE_POOL_OPTIONS:
+            options.pop(option, None)
+        options['poolclass'] = for_bind(InstrumentedNullPool, bind)
+    else:
+        options['poolclass'] = for_bind(InstrumentedQueuePool, bind)
+        options['pool_pre_ping'] = app.config['DATABASE_POOL_PRE_PING']
+
+
+def stats():
+    """Return every bind's pool counters as one flat dict."""
+
+    return {f"{bind}_{name}": value
+            for bind, pool_stats in sorted(STATS.items())
+            for name, value in pool_stats.as_dict().items()}
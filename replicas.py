@@ -0,0 +1,171 @@
+"""Read-replica routing for Warbler.
+
+GET and HEAD requests read from a replica database; everything else, and
+every write, goes to the primary. Replicas are configured as
+SQLALCHEMY_BINDS named ``replica_<n>``; one is picked at random for each
+request, skipping any whose replication lag is over REPLICA_MAX_LAG_SECONDS.
+
+Replicas trail the primary, so after a request that may have written
+(anything but GET, HEAD or OPTIONS) the client is pinned to the primary for
+REPLICA_PIN_SECONDS. That way the redirect after posting a message or
+following someone shows the change.
+
+`RoutingSQLAlchemy` is a drop-in `SQLAlchemy` whose sessions consult the
+request's choice of replica; `ReplicaRouter` makes that choice.
+"""
+
+import random
+import re
+import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.elements import TextClause
+
+from pools import configure_pool
+
+REPLICA_PREFIX = 'replica_'
+PIN_KEY = '_primary_until'
+
+READ_METHODS = {'GET', 'HEAD'}
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+READ_SQL = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+# Seconds the replica's replay is behind; 0 on a primary. A replica that has
+# replayed all it received is caught up, however long ago the primary last
+# committed: the time since the last replayed transaction only counts while
+# there is WAL left to replay.
+LAG_SQL = """
+    SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+                THEN 0
+                ELSE coalesce(extract(epoch FROM
+                                      now() - pg_last_xact_replay_timestamp()),
+                              0)
+                END
+"""
+
+
+def is_read(clause):
+    """Can `clause` be run on a replica?"""
+
+    if isinstance(clause, UpdateBase):
+        return False
+    if isinstance(clause, TextClause):
+        return bool(READ_SQL.match(clause.text))
+    return True
+
+
+class RoutingSession(SignallingSession):
+    """Session sending reads to the replica chosen for the request."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('read_replica') if has_request_context() else None
+
+        if replica and not self._flushing and is_read(clause):
+            return self.db.get_engine(self.app, bind=replica)
+
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """`SQLAlchemy` whose sessions can read from replicas.
+
+    Its engines also get Warbler's pool settings (see pools.py).
+    """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super().apply_driver_hacks(app, info, options)
+        configure_pool(app, info, options)
+
+
+class ReplicaRouter:
+    """Chooses a replica, or the primary, for each request.
+
+    Configured with SQLALCHEMY_BINDS, REPLICA_PIN_SECONDS,
+    REPLICA_MAX_LAG_SECONDS and REPLICA_LAG_CHECK_SECONDS.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.db = None
+        self.lags = {}
+        self.checked_at = {}
+        self.reads = {}
+
+    def init_app(self, app, db):
+        app.config.setdefault('REPLICA_PIN_SECONDS', 5)
+        app.config.setdefault('REPLICA_MAX_LAG_SECONDS', 30)
+        app.config.setdefault('REPLICA_LAG_CHECK_SECONDS', 5)
+
+        self.app = app
+        self.db = db
+
+        app.before_request(self.choose_bind)
+        app.after_request(self.pin_after_write)
+
+    def replicas(self):
+        binds = self.app.config.get('SQLALCHEMY_BINDS') or {}
+        return sorted(bind for bind in binds
+                      if bind.startswith(REPLICA_PREFIX))
+
+    def lag(self, bind):
+        """The replica's replication lag in seconds, checked periodically.
+
+        An unreachable replica has infinite lag.
+        """
+
+        now = time.monotonic()
+        if (now - self.checked_at.get(bind, float('-inf'))
+                >= self.app.config['REPLICA_LAG_CHECK_SECONDS']):
+            try:
+                engine = self.db.get_engine(self.app, bind=bind)
+                self.lags[bind] = float(engine.execute(LAG_SQL).scalar())
+            except Exception:
+                self.app.logger.exception("Can't check lag of %s", bind)
+                self.lags[bind] = float('inf')
+            self.checked_at[bind] = now
+        return self.lags[bind]
+
+    def choose_bind(self):
+        """Pick a healthy replica for this request, if it only reads."""
+
+        g.read_replica = None
+
+        if (request.method not in READ_METHODS
+                or session.get(PIN_KEY, 0) > time.time()):
+            return
+
+        max_lag = self.app.config['REPLICA_MAX_LAG_SECONDS']
+        healthy = [bind for bind in self.replicas()
+                   if self.lag(bind) <= max_lag]
+        if healthy:
+            g.read_replica = random.choice(healthy)
+            self.reads[g.read_replica] = self.reads.get(g.read_replica, 0) + 1
+
+    def pin_after_write(self, response):
+        """Send this client's reads to the primary for a while after a write."""
+
+        if request.method not in SAFE_METHODS and self.replicas():
+            session[PIN_KEY] = (time.time()
+                                + self.app.config['REPLICA_PIN_SECONDS'])
+        return response
+
+    def stats(self):
+        """Return each replica's lag and reads served, as a dict."""
+
+        stats = {}
+        for bind in self.replicas():
+            stats[f'{bind}_lag_seconds'] = self.lag(bind)
+            stats[f'{bind}_reads'] = self.reads.get(bind, 0)
+        return stats
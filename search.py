@@ -0,0 +1,151 @@
+"""User and message search for Warbler.
+
+User searches match word prefixes in a user's username, bio and location
+using the ``ix_users_search`` full-text index, ranked with username matches
+first. Autocomplete does a prefix range scan over
+``ix_users_username_prefix``, so it stays fast however many users there
+are.
+
+Message searches use the ``ix_messages_search`` index over English-stemmed
+message text. They support "quoted phrases" and word* prefixes, can be
+limited to one author or to the people a user follows, and are paged
+newest first.
+"""
+
+import re
+
+from sqlalchemy import cast, func, literal_column, text
+from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+from sqlalchemy.orm import joinedload
+
+from models import db, User, Message, Follows, USER_SEARCH_DOCUMENT
+from pagination import Page, paginate
+from timeline import timeline_key
+
+AUTOCOMPLETE_LIMIT = 10
+
+search_document = literal_column(USER_SEARCH_DOCUMENT)
+
+
+def prefix_tsquery(search):
+    """Turn free text into a tsquery matching every word as a prefix.
+
+    Returns None when `search` has no searchable words. Only word
+    characters are kept, so user input can't inject tsquery operators.
+    """
+
+    words = re.findall(r'\w+', search.lower())
+    if not words:
+        return None
+    return ' & '.join(f"{word}:*" for word in words)
+
+
+def search_users(search, per_page, cursor=None):
+    """Return a Page of users matching `search`, best matches first."""
+
+    query = prefix_tsquery(search)
+    if query is None:
+        return Page([])
+
+    tsquery = func.to_tsquery('simple', query)
+    # ts_rank is a real; as a double it round-trips through the cursor
+    # exactly, so rows tied on rank aren't skipped or repeated.
+    rank = cast(func.ts_rank(search_document, tsquery), DOUBLE_PRECISION)
+
+    matches = (db.session
+               .query(User, rank.label('rank'))
+               .filter(search_document.op('@@')(tsquery)))
+
+    page = paginate(matches, [rank, User.id],
+                    lambda row: (row.rank, row.User.id),
+                    per_page, cursor)
+    page.items = [row.User for row in page.items]
+    return page
+
+
+def escape_like(value):
+    """Escape LIKE wildcards in `value`."""
+
+    return (value
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
+
+
+def autocomplete_usernames(prefix, limit=AUTOCOMPLETE_LIMIT):
+    """Return up to `limit` users whose username starts with `prefix`."""
+
+    prefix = prefix.strip().lower()
+    if not prefix:
+        return []
+
+    # Sorting with the text_pattern_ops operator lets Postgres read the
+    # matches in index order and stop after `limit` rows.
+    return (db.session
+            .query(User.id, User.username, User.image_url)
+            .filter(func.lower(User.username).like(escape_like(prefix) + '%'))
+            .order_by(text('lower(users.username) USING ~<~'))
+            .limit(limit)
+            .all())
+
+
+MESSAGE_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+message_document = func.to_tsvector(literal_column("'english'"), Message.text)
+
+
+def message_tsquery(search):
+    """Turn a message search into a tsquery, or None if it has no words.
+
+    "Quoted phrases" must appear in order and words ending in * match as
+    prefixes; every term must match. Only word characters are kept, so
+    user input can't inject tsquery operators.
+    """
+
+    terms = []
+
+    for phrase, word in MESSAGE_TERM.findall(search.lower()):
+        if phrase:
+            words = re.findall(r'\w+', phrase)
+            if words:
+                terms.append('(' + ' <-> '.join(words) + ')')
+        else:
+            words = re.findall(r'\w+', word)
+            if words and word.endswith('*'):
+                words[-1] += ':*'
+            terms.extend(words)
+
+    return ' & '.join(terms) or None
+
+
+def search_messages(search, per_page, cursor=None, author_id=None,
+                    followed_by_id=None):
+    """Return a Page of messages matching `search`, newest first.
+
+    Results can be limited to messages by `author_id`, or to messages by
+    the users that `followed_by_id` follows. A search without words lists
+    all of `author_id`'s messages, and finds nothing otherwise.
+    """
+
+    query = message_tsquery(search)
+    if query is None and author_id is None:
+        return Page([])
+
+    matches = Message.query.options(joinedload(Message.user))
+
+    if query is not None:
+        tsquery = func.to_tsquery(literal_column("'english'"), query)
+        matches = matches.filter(message_document.op('@@')(tsquery))
+
+    if author_id is not None:
+        matches = matches.filter(Message.user_id == author_id)
+
+    if followed_by_id is not None:
+        followed = (db.session
+                    .query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == followed_by_id))
+        matches = matches.filter(Message.user_id.in_(followed.subquery()))
+
+    return paginate(matches, [Message.timestamp, Message.id], timeline_key,
+                    per_page, cursor)
+
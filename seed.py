@@ -1,20 +1,198 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+Each table is loaded from ``<table>.csv`` or ``<table>-*.csv`` shards in the
+data directory (``generator/`` by default), whose header row names the
+columns. Files are streamed into Postgres with ``COPY ... FROM STDIN`` and
+committed one at a time. Secondary indexes, unique and foreign key
+constraints are dropped for the load and rebuilt afterwards, which is much
+faster than maintaining them row by row. Then sequences are moved past the
+loaded ids, counters and timelines are rebuilt, and the tables are analyzed.
+
+    python seed.py
+    python seed.py --data-dir generator/data
+"""
+
+import argparse
+import glob
+import os
+import time
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+from counters import reconcile_counters
+from timeline import rebuild_timelines
+
+# In load order; tables without a CSV are skipped.
+TABLES = ['users', 'messages', 'follows', 'likes']
+
+PROGRESS_BYTES = 64 * 1024 * 1024
+
+DEFERRED_INDEXES_SQL = """
+    SELECT i.relname, pg_get_indexdef(i.oid)
+    FROM pg_index x
+    JOIN pg_class i ON i.oid = x.indexrelid
+    JOIN pg_class t ON t.oid = x.indrelid
+    WHERE t.relname = ANY(%(tables)s)
+      AND t.relnamespace = 'public'::regnamespace
+      AND NOT x.indisprimary
+      AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = i.oid)
+    ORDER BY i.relname
+"""
+
+# Foreign keys first, so unique constraints they rely on can be dropped.
+DEFERRED_CONSTRAINTS_SQL = """
+    SELECT t.relname, c.conname, pg_get_constraintdef(c.oid)
+    FROM pg_constraint c
+    JOIN pg_class t ON t.oid = c.conrelid
+    WHERE t.relname = ANY(%(tables)s)
+      AND t.relnamespace = 'public'::regnamespace
+      AND c.contype IN ('f', 'u')
+    ORDER BY c.contype = 'u', t.relname, c.conname
+"""
+
+SERIAL_SEQUENCES_SQL = """
+    SELECT table_name, pg_get_serial_sequence(table_name, column_name)
+    FROM information_schema.columns
+    WHERE table_schema = 'public'
+      AND table_name = ANY(%(tables)s)
+      AND column_name = 'id'
+      AND pg_get_serial_sequence(table_name, column_name) IS NOT NULL
+"""
+
+
+class Progress:
+    """File wrapper that reports how much of a file COPY has read."""
+
+    def __init__(self, f, label):
+        self.f = f
+        self.label = label
+        self.size = os.fstat(f.fileno()).st_size
+        self.read_bytes = 0
+        self.reported = 0
+        self.start = time.perf_counter()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.read_bytes += len(data)
+
+        if self.read_bytes - self.reported >= PROGRESS_BYTES:
+            self.reported = self.read_bytes
+            elapsed = time.perf_counter() - self.start
+            print(f"  {self.label}: {self.read_bytes / self.size:6.1%} "
+                  f"({self.read_bytes / elapsed / 1e6:.1f} MB/s)")
+        return data
+
+
+def shards(data_dir, table):
+    """Return the CSV files holding rows for `table`."""
+
+    single = os.path.join(data_dir, f"{table}.csv")
+    files = [single] if os.path.exists(single) else []
+    return files + sorted(glob.glob(os.path.join(data_dir, f"{table}-*.csv")))
+
+
+def drop_deferred(cursor, tables):
+    """Drop secondary indexes and constraints; return SQL to rebuild them."""
+
+    cursor.execute(DEFERRED_CONSTRAINTS_SQL, {'tables': tables})
+    constraints = cursor.fetchall()
+    cursor.execute(DEFERRED_INDEXES_SQL, {'tables': tables})
+    indexes = cursor.fetchall()
+
+    for table, name, definition in constraints:
+        cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+    for name, definition in indexes:
+        cursor.execute(f'DROP INDEX "{name}"')
+
+    # Rebuild in reverse: unique constraints before the foreign keys.
+    return ([definition for name, definition in indexes] +
+            [f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'
+             for table, name, definition in reversed(constraints)])
+
+
+def copy_file(cursor, table, path):
+    """COPY one CSV file into `table`; return the number of rows loaded.
+
+    The file is sent as UTF-8 bytes, whatever the connection's encoding.
+    """
+
+    with open(path, 'rb') as f:
+        columns = f.readline().decode('utf-8').strip()
+        cursor.copy_expert(
+            f"COPY {table} ({columns}) FROM STDIN "
+            f"WITH (FORMAT csv, ENCODING 'UTF8')",
+            Progress(f, os.path.basename(path)))
+    return cursor.rowcount
+
+
+def reset_sequences(cursor, tables):
+    """Move each table's id sequence past the ids that were loaded."""
+
+    cursor.execute(SERIAL_SEQUENCES_SQL, {'tables': tables})
+    for table, sequence in cursor.fetchall():
+        cursor.execute(
+            f"SELECT setval(%s, coalesce(max(id), 1), max(id) IS NOT NULL) "
+            f"FROM {table}", (sequence,))
+
+
+def timed(label, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    print(f"{label} in {time.perf_counter() - start:.1f}s")
+    return result
+
+
+def seed(data_dir):
+    db.drop_all()
+    db.create_all()
+
+    tables = [table for table in TABLES if shards(data_dir, table)]
+    conn = db.engine.raw_connection()
+
+    try:
+        cursor = conn.cursor()
+        rebuild = drop_deferred(cursor, tables)
+        conn.commit()
+
+        for table in tables:
+            for path in shards(data_dir, table):
+                start = time.perf_counter()
+                rows = copy_file(cursor, table, path)
+                conn.commit()
+                elapsed = time.perf_counter() - start
+                print(f"{table}: {rows} rows from {path} in {elapsed:.1f}s "
+                      f"({rows / max(elapsed, 1e-9):,.0f} rows/s)")
+
+        reset_sequences(cursor, tables)
+
+        def rebuild_deferred():
+            for statement in rebuild:
+                cursor.execute(statement)
+            conn.commit()
+
+        timed(f"Rebuilt {len(rebuild)} indexes and constraints",
+              rebuild_deferred)
+    finally:
+        conn.close()
+
+    timed("Reconciled counters", reconcile_counters)
+    timed("Rebuilt timelines", rebuild_timelines)
+
+    def analyze():
+        db.session.execute("ANALYZE")
+        db.session.commit()
 
+    timed("Analyzed", analyze)
 
-db.drop_all()
-db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--data-dir', default='generator')
+    args = parser.parse_args()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    start = time.perf_counter()
+    seed(args.data_dir)
+    print(f"Seeded in {time.perf_counter() - start:.1f}s")
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
-db.session.commit()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Slow query log for Warbler.
+
+Every SQL statement taking longer than SLOW_QUERY_THRESHOLD_MS is written as
+one JSON object per line to SLOW_QUERY_LOG, rotated at
+SLOW_QUERY_LOG_MAX_BYTES with SLOW_QUERY_LOG_BACKUPS old files kept. Each
+entry has the statement, the shape (but not the values) of its parameters,
+how long it took, the endpoint being served and the innermost frames of
+Warbler's own code that issued it.
+
+A fraction (SLOW_QUERY_EXPLAIN_RATE) of slow SELECTs are run again under
+``EXPLAIN (ANALYZE, BUFFERS)`` and the plan is attached to the entry. That
+doubles the cost of those statements, so keep the rate low in production.
+
+The log is off unless SLOW_QUERY_LOG is set.
+"""
+
+import json
+import logging
+import os
+import random
+import re
+import time
+import traceback
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+EXPLAIN = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+
+SELECT = re.compile(r'^\s*SELECT\b', re.IGNORECASE)
+
+
+def parameter_shape(value):
+    """Describe a parameter without revealing its value."""
+
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    return type(value).__name__
+
+
+def parameters_shape(parameters, executemany):
+    """Describe the parameters of a statement, e.g. {'user_id': 'int'}."""
+
+    if executemany:
+        first = parameters[0] if parameters else {}
+        return {'rows': len(parameters),
+                'row': parameters_shape(first, False)}
+    if isinstance(parameters, dict):
+        return {name: parameter_shape(value)
+                for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [parameter_shape(value) for value in parameters]
+    return None
+
+
+class SlowQueryLog:
+    """Logs slow statements from every engine, with route and stack."""
+
+    def __init__(self):
+        self.logger = None
+        self.handler = None
+        self.threshold = None
+        self.explain_rate = 0.0
+        self.stack_depth = 8
+        self.root_path = None
+
+    def init_app(self, app):
+        app.config.setdefault('SLOW_QUERY_LOG', None)
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 200)
+        app.config.setdefault('SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024)
+        app.config.setdefault('SLOW_QUERY_LOG_BACKUPS', 5)
+        app.config.setdefault('SLOW_QUERY_EXPLAIN_RATE', 0.0)
+        app.config.setdefault('SLOW_QUERY_STACK_DEPTH', 8)
+
+        if not app.config['SLOW_QUERY_LOG']:
+            return
+
+        self.threshold = app.config['SLOW_QUERY_THRESHOLD_MS'] / 1000
+        self.explain_rate = app.config['SLOW_QUERY_EXPLAIN_RATE']
+        self.stack_depth = app.config['SLOW_QUERY_STACK_DEPTH']
+        self.root_path = app.root_path
+
+        self.handler = RotatingFileHandler(
+            app.config['SLOW_QUERY_LOG'],
+            maxBytes=app.config['SLOW_QUERY_LOG_MAX_BYTES'],
+            backupCount=app.config['SLOW_QUERY_LOG_BACKUPS'],
+            encoding='utf-8')
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+        self.logger = logging.getLogger('warbler.slow_queries')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        self.logger.addHandler(self.handler)
+
+        event.listen(Engine, 'before_cursor_execute', self.start_statement)
+        event.listen(Engine, 'after_cursor_execute', self.finish_statement)
+        event.listen(Engine, 'handle_error', self.fail_statement)
+
+    def close(self):
+        """Stop logging and close the log file."""
+
+        if self.handler is None:
+            return
+
+        event.remove(Engine, 'before_cursor_execute', self.start_statement)
+        event.remove(Engine, 'after_cursor_execute', self.finish_statement)
+        event.remove(Engine, 'handle_error', self.fail_statement)
+        self.logger.removeHandler(self.handler)
+        self.handler.close()
+        self.handler = None
+
+    def start_statement(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('slow_query_start', []).append(
+            time.perf_counter())
+
+    def fail_statement(self, exception_context):
+        # Failed statements never reach after_cursor_execute.
+        conn = exception_context.connection
+        starts = (conn.info.get('slow_query_start') if conn is not None
+                  else None)
+        if starts:
+            starts.pop()
+
+    def finish_statement(self, conn, cursor, statement, parameters, context,
+                         executemany):
+        starts = conn.info.get('slow_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if elapsed < self.threshold:
+            return
+
+        entry = {
+            'time': datetime.utcnow().isoformat() + 'Z',
+            'duration_ms': round(elapsed * 1000, 3),
+            'statement': statement,
+            'parameters': parameters_shape(parameters, executemany),
+            'endpoint': None,
+            'stack': self.app_stack(),
+        }
+
+        if has_request_context():
+            entry.update(endpoint=request.endpoint, method=request.method,
+                         path=request.path)
+
+        if (not executemany and SELECT.match(statement)
+                and random.random() < self.explain_rate):
+            entry['plan'] = self.explain(conn, statement, parameters)
+
+        self.logger.info(json.dumps(entry, default=str))
+
+    def app_stack(self):
+        """The innermost frames of Warbler's own code, as 'file:line in f'."""
+
+        frames = []
+        for frame in traceback.extract_stack()[:-2]:
+            path = os.path.abspath(frame.filename)
+            if (frame.filename.startswith('<')
+                    or not path.startswith(self.root_path + os.sep)
+                    or 'site-packages' in path
+                    or path == os.path.abspath(__file__)):
+                continue
+            frames.append(f"{os.path.relpath(path, self.root_path)}:"
+                          f"{frame.lineno} in {frame.name}")
+        return frames[-self.stack_depth:]
+
+    def explain(self, conn, statement, parameters):
+        """Run EXPLAIN ANALYZE for a statement; return the plan or an error.
+
+        Uses a savepoint on the statement's own connection, so it sees the
+        same data and a failure can't abort the surrounding transaction.
+        """
+
+        dbapi_connection = conn.connection
+        if getattr(dbapi_connection, 'autocommit', False):
+            return None
+
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(EXPLAIN + statement, parameters)
+                plan = cursor.fetchone()[0]
+            except Exception as exc:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                plan = {'error': str(exc).strip()}
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        finally:
+            cursor.close()
+        return plan
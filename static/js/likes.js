@@ -0,0 +1,34 @@
+// Like buttons: toggle likes through the JSON API instead of posting the
+// form and reloading the page. Without JavaScript the form still works.
+
+$(function () {
+  $(document).on('submit', '.like-form', function (evt) {
+    var $form = $(this);
+    var $button = $form.find('button');
+    var liked = $form.data('liked') === true || $form.data('liked') === 'true';
+
+    evt.preventDefault();
+    $button.prop('disabled', true);
+
+    $.ajax({
+      url: $form.data('api'),
+      method: liked ? 'DELETE' : 'POST',
+      contentType: 'application/json',
+      data: '{}',
+      dataType: 'json'
+    })
+      .done(function (resp) {
+        $form.data('liked', resp.liked);
+        $button
+          .toggleClass('btn-primary', resp.liked)
+          .toggleClass('btn-secondary', !resp.liked);
+      })
+      .fail(function () {
+        // Fall back to the regular form post.
+        $form.off('submit').get(0).submit();
+      })
+      .always(function () {
+        $button.prop('disabled', false);
+      });
+  });
+});
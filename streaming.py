@@ -0,0 +1,39 @@
+"""Streamed page rendering for Warbler's listing pages.
+
+`stream_template` sends a page as Jinja renders it, so the header reaches
+the browser at once and a long list is never held in memory as one string.
+Paired with a server-side cursor (``Query.yield_per``), rows are fetched
+while the page is being sent.
+
+The status and headers, including the session cookie, go out before the
+body is rendered. So a streamed template must not change the session (the
+flashes it shows are popped beforehand), and an error part way through can
+only cut the page short rather than show the error page.
+"""
+
+from flask import (before_render_template, current_app, get_flashed_messages,
+                   stream_with_context, template_rendered)
+
+# Template output pieces sent per chunk; Jinja yields many tiny ones.
+BUFFER_SIZE = 50
+
+
+def stream_template(template_name, **context):
+    """Like `render_template`, but returns a streamed response."""
+
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+
+    # Pops the flashes from the session while it can still be saved; the
+    # template gets them back from the request.
+    get_flashed_messages(with_categories=True)
+
+    def generate():
+        before_render_template.send(app, template=template, context=context)
+        stream = template.stream(context)
+        stream.enable_buffering(BUFFER_SIZE)
+        yield from stream
+        template_rendered.send(app, template=template, context=context)
+
+    return app.response_class(stream_with_context(generate()))
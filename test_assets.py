@@ -0,0 +1,75 @@
+"""Static asset pipeline tests.
+    to run these tests, copy and paste into your terminal:
+    python -m unittest test_assets.py
+"""
+
+import gzip
+import os
+import re
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, assets
+from assets import build_assets
+
+
+class AssetsTestCase(TestCase):
+    """Test building and serving fingerprinted assets."""
+
+    def setUp(self):
+        self.build_dir = tempfile.TemporaryDirectory()
+        self.manifest = build_assets(app.static_folder, self.build_dir.name)
+        self.old_build_dir = assets.build_dir
+        assets.build_dir = self.build_dir.name
+        assets.load()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        assets.build_dir = self.old_build_dir
+        assets.load()
+        self.build_dir.cleanup()
+
+    def test_build_assets(self):
+        css = self.manifest['stylesheets/style.css']
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{12}\.css$')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.build_dir.name, css + '.gz')))
+
+        # Images are already compressed.
+        png = self.manifest['images/nav-bg.png']
+        self.assertFalse(os.path.exists(
+            os.path.join(self.build_dir.name, png + '.gz')))
+
+        with open(os.path.join(self.build_dir.name, css)) as f:
+            self.assertIn(f'url("/assets/{png}")', f.read())
+
+    def test_serve_fingerprinted_asset(self):
+        resp = self.client.get('/login')
+        match = re.search(r'href="(/assets/stylesheets/style\.\w+\.css)"',
+                          str(resp.data))
+        self.assertIsNotNone(match)
+
+        resp = self.client.get(match.group(1),
+                               headers={'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'public, max-age=31536000, immutable')
+        self.assertIn('Accept-Encoding', resp.headers['Vary'])
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn(b'background-image', gzip.decompress(resp.data))
+        resp.close()
+
+        resp = self.client.get(match.group(1))
+        self.assertNotIn('Content-Encoding', resp.headers)
+        self.assertIn(b'background-image', resp.data)
+        resp.close()
+
+    def test_missing_asset(self):
+        resp = self.client.get('/assets/nope.css')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'no-cache, no-store, must-revalidate')
+        self.assertEqual(self.client.get('/assets/manifest.json').status_code,
+                         404)
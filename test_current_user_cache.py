@@ -0,0 +1,145 @@
+"""Current-user cache tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_current_user_cache.py
+"""
+
+import os
+from unittest import TestCase
+
+from flask import g
+
+from models import db, User
+from caching import CurrentUserCache, LRUCache
+from testing import QueryCountAssertions
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, current_user_cache
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the LRU cache on its own."""
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.stats(),
+                         {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2})
+
+    def test_expires_entries(self):
+        now = [0]
+        cache = LRUCache(ttl=30, clock=lambda: now[0])
+        cache.set('a', 1)
+
+        now[0] = 29
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 30
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+
+class CurrentUserCacheTestCase(QueryCountAssertions, TestCase):
+    """Test caching the logged-in user between requests."""
+
+    def setUp(self):
+        User.query.delete()
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser",
+                                    email="test@test.com",
+                                    password="testuser",
+                                    image_url=None)
+        self.testuser_id = 8989
+        self.testuser.id = self.testuser_id
+        db.session.commit()
+
+        app.config['CURRENT_USER_CACHE_ENABLED'] = True
+        current_user_cache.clear()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.testuser_id
+
+    def tearDown(self):
+        app.config['CURRENT_USER_CACHE_ENABLED'] = False
+        current_user_cache.clear()
+        db.session.rollback()
+
+    def test_cached_user_skips_query(self):
+        """Once cached, the logged-in user isn't queried at all."""
+
+        self.client.get("/messages/new")
+        hits = current_user_cache.stats()['hits']
+
+        with self.assertMaxQueries(0):
+            resp = self.client.get("/messages/new")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(current_user_cache.stats()['hits'], hits + 1)
+
+    def test_profile_edit_invalidates(self):
+        """Editing the profile shows the new values on the next request."""
+
+        self.client.get(f"/users/{self.testuser_id}")
+        self.client.post("/users/profile",
+                         data={"username": "testuser",
+                               "email": "test@test.com",
+                               "bio": "Cache buster",
+                               "password": "testuser"})
+
+        resp = self.client.get(f"/users/{self.testuser_id}")
+        self.assertIn("Cache buster", str(resp.data))
+
+    def test_deleted_user_is_not_cached(self):
+        """A deleted account isn't resurrected from the cache."""
+
+        self.client.get("/messages/new")
+        self.client.post("/users/delete")
+
+        self.assertIsNone(current_user_cache.cache.get(self.testuser_id))
+
+    def test_change_by_other_process_is_seen(self):
+        """Users changed and invalidated by another worker (another cache
+        sharing the signal directory) aren't served stale."""
+
+        other_process = CurrentUserCache()
+        other_process.init_app(app)
+
+        self.client.get("/messages/new")
+        db.session.execute("UPDATE users SET bio = 'Changed elsewhere' "
+                           "WHERE id = :id", {'id': self.testuser_id})
+        db.session.commit()
+        other_process.invalidate(self.testuser_id)
+
+        with self.client as c:
+            c.get("/messages/new")
+            self.assertEqual(g.user.bio, "Changed elsewhere")
+
+        db.session.execute("DELETE FROM users WHERE id = :id",
+                           {'id': self.testuser_id})
+        db.session.commit()
+        other_process.clear()
+
+        resp = self.client.get("/messages/new", follow_redirects=True)
+        self.assertIn("Access unauthorized", str(resp.data))
+        self.assertIsNone(current_user_cache.cache.get(self.testuser_id))
+
+    def test_unrelated_invalidation_keeps_entry(self):
+        """Another user's signal doesn't drop this user's entry."""
+
+        self.client.get("/messages/new")
+        # Shares no signal file with the test user.
+        current_user_cache.invalidate(self.testuser_id + 1)
+
+        with self.assertMaxQueries(0):
+            self.client.get("/messages/new")
@@ -0,0 +1,95 @@
+"""Message fragment cache tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_fragments.py
+"""
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, fragment_cache
+from fragments import SQLiteBackend
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test caching rendered messages."""
+
+    def setUp(self):
+        User.query.delete()
+        self.client = app.test_client()
+        fragment_cache.clear()
+
+        self.author = User.signup(username="author", email="author@test.com",
+                                  password="author", image_url=None)
+        self.author.id = 5150
+        db.session.add(Message(id=5151, text="Cache me", user_id=5150))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        fragment_cache.clear()
+
+    def get_profile(self):
+        resp = self.client.get('/users/5150')
+        self.assertEqual(resp.status_code, 200)
+        return str(resp.data)
+
+    def test_fragment_reused(self):
+        before = fragment_cache.stats()
+        self.assertIn("Cache me", self.get_profile())
+        self.assertIn("Cache me", self.get_profile())
+
+        stats = fragment_cache.stats()
+        self.assertEqual(stats['misses'], before['misses'] + 1)
+        self.assertEqual(stats['hits'], before['hits'] + 1)
+        self.assertGreater(stats['hit_rate'], 0)
+
+    def test_profile_edit_rerenders(self):
+        self.assertIn("@author", self.get_profile())
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 5150
+        self.client.post('/users/profile',
+                         data={"username": "renamed", "password": "author"})
+
+        html = self.get_profile()
+        self.assertIn("@renamed", html)
+        self.assertNotIn("@author", html)
+
+    def test_message_delete_invalidates(self):
+        self.get_profile()
+        self.assertIsNotNone(fragment_cache.backend.get('message:5151'))
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 5150
+        self.client.post('/messages/5151/delete')
+
+        self.assertIsNone(fragment_cache.backend.get('message:5151'))
+
+
+class SQLiteBackendTestCase(TestCase):
+    """Test the shared SQLite fragment store."""
+
+    def test_roundtrip_and_expiry(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            backend = SQLiteBackend(os.path.join(tmp, 'fragments.sqlite3'),
+                                    ttl=60)
+            backend.set('message:1', 'stamp\n<p>Hi</p>')
+            self.assertEqual(backend.get('message:1'), 'stamp\n<p>Hi</p>')
+            self.assertEqual(len(backend), 1)
+
+            backend.delete('message:1')
+            self.assertIsNone(backend.get('message:1'))
+
+            expired = SQLiteBackend(backend.path, ttl=-1)
+            expired.set('message:2', 'stamp\n<p>Old</p>')
+            self.assertIsNone(backend.get('message:2'))
@@ -0,0 +1,101 @@
+"""Synthetic data generator tests.
+    to run these tests, copy and paste into your terminal:
+    python -m unittest test_generator.py
+"""
+
+import csv
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+USERS = 120
+MESSAGES = 300
+
+
+def generate(out, workers, seed=0, shard_size=50):
+    subprocess.run(
+        [sys.executable, os.path.join('generator', 'create_csvs.py'),
+         '--users', str(USERS), '--messages', str(MESSAGES),
+         '--follows-per-user', '5', '--likes-per-user', '3',
+         '--seed', str(seed), '--shard-size', str(shard_size),
+         '--workers', str(workers), '--out', out],
+        cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+
+def read_shards(out, table):
+    """Return {shard file name: rows} for a table, without headers."""
+
+    shards = {}
+    for path in sorted(glob.glob(os.path.join(out, f"{table}-*.csv"))):
+        with open(path, newline='', encoding='utf-8') as f:
+            shards[os.path.basename(path)] = list(csv.reader(f))[1:]
+    return shards
+
+
+class GeneratorTestCase(TestCase):
+    """Test that sharded output is reproducible and shards don't overlap."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.out = os.path.join(cls.tmp.name, 'a')
+        generate(cls.out, workers=3)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmp.cleanup()
+
+    def test_same_output_for_any_worker_count(self):
+        other = os.path.join(self.tmp.name, 'b')
+        generate(other, workers=1)
+
+        for table in ('users', 'messages', 'follows', 'likes'):
+            self.assertEqual(read_shards(self.out, table),
+                             read_shards(other, table), table)
+
+    def test_seed_changes_output(self):
+        other = os.path.join(self.tmp.name, 'c')
+        generate(other, workers=1, seed=1)
+
+        self.assertNotEqual(read_shards(self.out, 'follows'),
+                            read_shards(other, 'follows'))
+
+    def test_id_shards_are_disjoint_and_complete(self):
+        for table, total in (('users', USERS), ('messages', MESSAGES)):
+            shards = read_shards(self.out, table)
+            self.assertGreater(len(shards), 1)
+
+            ids = [int(row[0]) for rows in shards.values() for row in rows]
+            self.assertEqual(sorted(ids), list(range(1, total + 1)), table)
+
+    def test_relationship_shards_are_disjoint(self):
+        for table, owner in (('follows', 1), ('likes', 0)):
+            shards = read_shards(self.out, table)
+            self.assertGreater(len(shards), 1)
+
+            # Each user's rows are all written by one shard.
+            owners = [{row[owner] for row in rows}
+                      for rows in shards.values()]
+            self.assertEqual(sum(map(len, owners)),
+                             len(set().union(*owners)), table)
+
+            pairs = [(row[0], row[1])
+                     for rows in shards.values() for row in rows]
+            self.assertEqual(len(pairs), len(set(pairs)), table)
+
+    def test_no_self_follows_or_dangling_ids(self):
+        for rows in read_shards(self.out, 'follows').values():
+            for followed, follower, followed_at in rows:
+                self.assertNotEqual(followed, follower)
+                self.assertTrue(1 <= int(followed) <= USERS)
+                self.assertTrue(1 <= int(follower) <= USERS)
+
+        for rows in read_shards(self.out, 'likes').values():
+            for user_id, message_id in rows:
+                self.assertTrue(1 <= int(user_id) <= USERS)
+                self.assertTrue(1 <= int(message_id) <= MESSAGES)
@@ -0,0 +1,128 @@
+"""Load test harness tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_load_test.py
+"""
+
+import os
+from random import Random
+from unittest import TestCase
+
+from models import db, User, Message, Follows
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from benchmarks.load_test import MIX, Session, percentile, summarize
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
+
+# The request each route in MIX should issue.
+ROUTES = {
+    'home': ('GET', r'/'),
+    'profile': ('GET', r'/users/\d+'),
+    'message': ('GET', r'/messages/\d+'),
+    'likes_page': ('GET', r'/users/\d+/likes'),
+    'search_messages': ('GET', r'/messages/search'),
+    'search_users': ('GET', r'/users'),
+    'like': ('POST', r'/api/messages/\d+/like'),
+    'unlike': ('DELETE', r'/api/messages/\d+/like'),
+    'follow': ('POST', r'/users/follow/\d+'),
+    'unfollow': ('POST', r'/users/stop-following/\d+'),
+    'post': ('POST', r'/messages/new'),
+}
+
+
+class SummaryTestCase(TestCase):
+    """Test the latency and SQL statistics."""
+
+    def test_percentile(self):
+        samples = [10, 20, 30, 40]
+
+        self.assertEqual(percentile(samples, 0), 10)
+        self.assertEqual(percentile(samples, 50), 20)
+        self.assertEqual(percentile(samples, 95), 40)
+        self.assertEqual(percentile([7], 99), 7)
+
+    def test_summarize(self):
+        samples = [
+            # (route, elapsed ms, SQL statements, status, start)
+            ('home', 20, 5, 200, 0.5),
+            ('home', 10, 3, 200, 0.0),
+            ('post', 30, 7, 'exception', 1.0),
+            ('post', 40, 9, 503, 1.5),
+        ]
+
+        results = summarize(samples)
+
+        self.assertEqual(set(results['routes']), {'home', 'post'})
+        self.assertEqual(results['routes']['home'], {
+            'requests': 2, 'errors': 0, 'p50_ms': 10, 'p95_ms': 20,
+            'p99_ms': 20, 'sql_mean': 4, 'sql_max': 5})
+        self.assertEqual(results['routes']['post']['errors'], 2)
+
+        overall = results['overall']
+        self.assertEqual(overall['requests'], 4)
+        self.assertEqual(overall['p50_ms'], 20)
+        self.assertEqual(overall['p99_ms'], 40)
+        self.assertEqual(overall['sql_mean'], 6)
+        # From the first start to the end of the last request.
+        self.assertAlmostEqual(overall['rps'], 4 / 1.54)
+
+
+class SessionTestCase(TestCase):
+    """Test that each route in the mix issues its request."""
+
+    def setUp(self):
+        User.query.delete()
+
+        for user_id in (1, 2, 3):
+            User.signup(username=f"loader{user_id}",
+                        email=f"loader{user_id}@test.com",
+                        password="loader", image_url=None).id = user_id
+        db.session.commit()
+
+        # Id 1, so every message id the session picks exists.
+        message = Message(id=1, text="Load me", user_id=2)
+        db.session.add(message)
+        db.session.add(Follows(user_being_followed_id=2, user_following_id=1))
+        db.session.commit()
+
+        self.session = Session(app, db, 1, 3, message.id, Random(0))
+        self.calls = []
+
+        send = self.session.send
+
+        def record(method, path, **kwargs):
+            status = send(method, path, **kwargs)
+            self.calls.append((method, path, status))
+            return status
+
+        self.session.send = record
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_mix_routes(self):
+        self.assertEqual(set(MIX), set(ROUTES))
+
+        # In MIX order, so there is a like to undo and a follow to drop.
+        for route in MIX:
+            method, pattern = ROUTES[route]
+            del self.calls[:]
+
+            for attempt in range(20):
+                # None: picked a user it can't follow; the harness retries.
+                if self.session.request(route) is not None:
+                    break
+
+            self.assertEqual(len(self.calls), 1, route)
+            self.assertEqual(self.calls[0][0], method, route)
+            self.assertRegex(self.calls[0][1], f'^{pattern}$', route)
+            self.assertLess(self.calls[0][2], 400, route)
+
+    def test_unknown_route(self):
+        with self.assertRaises(ValueError):
+            self.session.request('nope')
@@ -5,8 +5,8 @@
 
 import os
 from unittest import TestCase
-from models import db, User, Message, Follows, Likes
-from sqlalchemy.exc import IntegrityError
+from models import db, User, Message, Likes, TimelineEntry
+from timeline import rebuild_timelines, trim_timelines
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
@@ -71,4 +71,24 @@ class MessageModelTestCase(TestCase):
         likes = Likes.query.filter(Likes.user_id == user.id).all()
         self.assertEqual(len(likes), 1)
         self.assertEqual(len(user.likes), 1)
-        self.assertEqual(likes[0].message_id, message.id)
\ No newline at end of file
+        self.assertEqual(likes[0].message_id, message.id)
+
+    def test_rebuild_and_trim_timelines(self):
+        """Test timelines can be backfilled and trimmed"""
+
+        follower = User.signup("follower", "follower@gmail.com", "password", None)
+        follower.id = 222
+        follower.following.append(self.u1)
+        db.session.add_all([
+            Message(text=f"Message {i}", user_id=self.uid1)
+            for i in range(5)
+        ])
+        db.session.commit()
+
+        self.assertEqual(rebuild_timelines(depth=3), 6)
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=follower.id).count(), 3)
+
+        self.assertEqual(trim_timelines(depth=1), 4)
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.uid1).count(), 1)
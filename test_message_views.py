@@ -6,7 +6,7 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, TimelineEntry
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,6 +16,7 @@ from models import db, connect_db, Message, User
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 from app import app, CURR_USER_KEY
+from counters import reconcile_counters
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -24,6 +25,7 @@ from app import app, CURR_USER_KEY
 db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
 
 
 class MessageViewTestCase(TestCase):
@@ -155,6 +157,26 @@ class MessageViewTestCase(TestCase):
             m = Message.query.get(78546)
             self.assertIsNone(m)
 
+    def test_delete_message_counters(self):
+        """Does deleting a message release its author's and likers' counts?"""
+        liker = User.signup(username="liker",
+                            email="liker@test.com",
+                            password="liker123",
+                            image_url=None)
+        liker.id = 135791
+        liker.likes.append(self.testmessage)
+        db.session.commit()
+        reconcile_counters()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.post('/messages/999/delete')
+            self.assertEqual(User.query.get(self.testuser_id).messages_count, 0)
+            self.assertEqual(User.query.get(135791).likes_count, 0)
+            self.assertEqual(reconcile_counters(), [])
+
     def test_delete_message_loggedout(self):
         """ Can user delete a message if user is logged out?"""
         m = Message(
@@ -198,4 +220,187 @@ class MessageViewTestCase(TestCase):
             self.assertIn("Access unauthorized.", str(resp.data))
 
             m = Message.query.get(674851)
-            self.assertIsNotNone(m)
\ No newline at end of file
+            self.assertIsNotNone(m)
+
+########### TESTS ON MESSAGE VIEWS: HOME TIMELINE ###########
+
+    def test_add_message_fans_out_to_followers(self):
+        """Does a new message show up on a follower's home timeline?"""
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.id = 246810
+        follower.following.append(self.testuser)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post('/messages/new', data={"text": "Fanned out!"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 246810
+            resp = c.get('/')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Fanned out!", str(resp.data))
+
+    def test_home_timeline_not_modified(self):
+        """Is the home timeline a 304 until someone followed posts?"""
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.id = 246810
+        follower.following.append(self.testuser)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 246810
+            etag = c.get('/').headers['ETag']
+            resp = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+            c.post('/messages/new', data={"text": "Fresh news"})
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 246810
+            resp = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Fresh news", str(resp.data))
+
+    def test_unfollow_removes_messages_from_timeline(self):
+        """Does unfollowing a user remove their messages from the timeline?"""
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.id = 246810
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 246810
+
+            c.post(f'/users/follow/{self.testuser_id}')
+            resp = c.get('/')
+            self.assertIn("Like this message", str(resp.data))
+
+            c.post(f'/users/stop-following/{self.testuser_id}')
+            resp = c.get('/')
+            self.assertNotIn("Like this message", str(resp.data))
+
+    def test_celebrity_messages_are_pulled_on_read(self):
+        """Are messages from accounts over the fan-out threshold merged in?"""
+        follower = User.signup(username="follower",
+                               email="follower@test.com",
+                               password="follower",
+                               image_url=None)
+        follower.id = 246810
+        follower.following.append(self.testuser)
+        db.session.commit()
+        reconcile_counters()
+
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 1
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser_id
+                c.post('/messages/new', data={"text": "Pulled, not pushed!"})
+
+                self.assertEqual(
+                    TimelineEntry.query.filter_by(user_id=246810).count(), 0)
+
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = 246810
+                resp = c.get('/')
+                self.assertIn("Pulled, not pushed!", str(resp.data))
+        finally:
+            app.config['TIMELINE_FANOUT_THRESHOLD'] = 10000
+
+########### TESTS ON MESSAGE VIEWS: SEARCH MESSAGES ###########
+
+    def add_search_messages(self):
+        other = User.signup(username="other",
+                            email="other@test.com",
+                            password="other123",
+                            image_url=None)
+        other.id = 975310
+        db.session.add_all([
+            Message(id=5001, text="The quick brown fox jumps",
+                    user_id=self.testuser_id),
+            Message(id=5002, text="A brown quick fox sleeps",
+                    user_id=975310),
+            Message(id=5003, text="Foxes everywhere",
+                    user_id=975310),
+        ])
+        db.session.commit()
+
+    def test_search_messages_words_and_phrases(self):
+        """Can you search messages by word, phrase and prefix?"""
+        self.add_search_messages()
+
+        with self.client as c:
+            html = c.get('/messages/search?q=fox brown').get_data(as_text=True)
+            self.assertIn("The quick brown fox", html)
+            self.assertIn("A brown quick fox", html)
+            self.assertNotIn("Like this message", html)
+
+            html = c.get('/messages/search?q="quick brown"').get_data(as_text=True)
+            self.assertIn("The quick brown fox", html)
+            self.assertNotIn("A brown quick fox", html)
+
+            html = c.get('/messages/search?q=jump*').get_data(as_text=True)
+            self.assertIn("The quick brown fox", html)
+            self.assertNotIn("A brown quick fox", html)
+
+    def test_search_messages_by_author(self):
+        """Can you limit a message search to one author?"""
+        self.add_search_messages()
+
+        with self.client as c:
+            html = (c.get('/messages/search?q=fox&author=other')
+                    .get_data(as_text=True))
+            self.assertIn("A brown quick fox", html)
+            self.assertIn("Foxes everywhere", html)
+            self.assertNotIn("The quick brown fox", html)
+
+            html = (c.get('/messages/search?author=other')
+                    .get_data(as_text=True))
+            self.assertIn("A brown quick fox", html)
+            self.assertIn("Foxes everywhere", html)
+            self.assertNotIn("The quick brown fox", html)
+
+    def test_search_messages_like_buttons(self):
+        """Do search results share the timeline's markup and like buttons?"""
+        self.add_search_messages()
+        self.testuser.likes.append(Message.query.get(5002))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            html = c.get('/messages/search?q=fox').get_data(as_text=True)
+            self.assertIn('href="/messages/5002"', html)
+            self.assertEqual(html.count('data-liked="true"'), 1)
+            self.assertEqual(html.count('class="like-form"'), 2)
+
+    def test_search_messages_following(self):
+        """Can you limit a message search to the people you follow?"""
+        self.add_search_messages()
+        self.testuser.following.append(User.query.get(975310))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            html = (c.get('/messages/search?q=fox&scope=following')
+                    .get_data(as_text=True))
+            self.assertIn("A brown quick fox", html)
+            self.assertNotIn("The quick brown fox", html)
+
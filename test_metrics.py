@@ -0,0 +1,149 @@
+"""Metrics tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_metrics.py
+"""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy.exc import DBAPIError
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, metrics
+from metrics import Histogram
+from testing import read
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
+
+TOKEN = 'test-token'
+
+
+def sample(text, line_start):
+    """Return the value of the first exported line starting with this."""
+
+    for line in text.splitlines():
+        if line.startswith(line_start):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+class HistogramTestCase(TestCase):
+    """Test the exposition format."""
+
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram('h', 'Help.', ('route',), (0.1, 1))
+        histogram.observe(('a"b',), 0.05)
+        histogram.observe(('a"b',), 0.1)
+        histogram.observe(('a"b',), 5)
+
+        self.assertEqual(list(histogram.expose()), [
+            '# HELP h Help.',
+            '# TYPE h histogram',
+            'h_bucket{route="a\\"b",le="0.1"} 2',
+            'h_bucket{route="a\\"b",le="1"} 2',
+            'h_bucket{route="a\\"b",le="+Inf"} 3',
+            'h_sum{route="a\\"b"} 5.15',
+            'h_count{route="a\\"b"} 3',
+        ])
+
+
+class MetricsViewTestCase(TestCase):
+    """Test recording and exporting request metrics."""
+
+    def setUp(self):
+        User.query.delete()
+        self.client = app.test_client()
+        app.config['METRICS_TOKEN'] = TOKEN
+
+        self.user = User.signup(username="metered", email="metered@test.com",
+                                password="metered", image_url=None)
+        self.user.id = 7070
+        db.session.add(Message(text="Counted", user_id=7070))
+        db.session.commit()
+
+    def tearDown(self):
+        app.config['METRICS_TOKEN'] = None
+        db.session.rollback()
+
+    def metrics(self):
+        resp = self.client.get(app.config['METRICS_PATH'],
+                               headers={'Authorization': f'Bearer {TOKEN}'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        return resp.get_data(as_text=True)
+
+    def test_request_sql_and_template_metrics(self):
+        count = ('warbler_request_duration_seconds_count'
+                 '{endpoint="users_show",method="GET",status="200"}')
+        statements = ('warbler_request_sql_statements_sum'
+                      '{endpoint="users_show"}')
+        template = ('warbler_template_render_seconds_count'
+                    '{template="users/show.html"}')
+
+        before = self.metrics()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 7070
+        self.assertEqual(self.client.get('/users/7070').status_code, 200)
+        after = self.metrics()
+
+        self.assertEqual(sample(after, count),
+                         (sample(before, count) or 0) + 1)
+        self.assertGreater(sample(after, statements),
+                           sample(before, statements) or 0)
+        self.assertEqual(sample(after, template),
+                         (sample(before, template) or 0) + 1)
+
+    def test_streamed_page_counted_when_sent(self):
+        count = ('warbler_request_duration_seconds_count'
+                 '{endpoint="list_users",method="GET",status="200"}')
+        statements = ('warbler_request_sql_statements_sum'
+                      '{endpoint="list_users"}')
+
+        before = self.metrics()
+        resp = self.client.get('/users')
+        self.assertTrue(resp.is_streamed)
+        # Not via /metrics: the streamed request is still in progress.
+        self.assertEqual(sample('\n'.join(metrics.collect()), count),
+                         sample(before, count))
+
+        read(resp)
+        after = self.metrics()
+        self.assertEqual(sample(after, count),
+                         (sample(before, count) or 0) + 1)
+        # The users query runs while the body streams.
+        self.assertGreaterEqual(sample(after, statements),
+                                (sample(before, statements) or 0) + 1)
+
+    def test_failed_statement_not_left_timing(self):
+        with app.app_context():
+            with db.engine.connect() as conn:
+                with self.assertRaises(DBAPIError):
+                    conn.execute("SELECT 1 / 0")
+                self.assertFalse(conn.info.get('metrics_start'))
+
+    def test_requires_token(self):
+        path = app.config['METRICS_PATH']
+
+        for headers in ({}, {'Authorization': 'Bearer wrong'},
+                        {'Authorization': TOKEN}):
+            resp = self.client.get(path, headers=headers)
+            self.assertEqual(resp.status_code, 401)
+            self.assertNotIn(b'warbler_', resp.data)
+
+        app.config['METRICS_TOKEN'] = None
+        resp = self.client.get(path,
+                               headers={'Authorization': f'Bearer {TOKEN}'})
+        self.assertEqual(resp.status_code, 404)
+
+    def test_registered_stats_exported(self):
+        text = self.metrics()
+
+        self.assertIn('# TYPE warbler_fragment_cache_hit_rate gauge', text)
+        self.assertIsNotNone(sample(text, 'warbler_current_user_cache_hits '))
+        self.assertIsNotNone(sample(text, 'warbler_password_hasher_pending '))
@@ -0,0 +1,187 @@
+"""Schema migration tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_migrations.py
+"""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import NullPool
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from migrations import MIGRATIONS, migrate, check_plans
+
+db.create_all()
+
+BASELINE_DATABASE = 'warbler-test-baseline'
+
+# The schema as the original models.py created it, before any migration.
+BASELINE_SCHEMA_SQL = """
+    CREATE TABLE users (
+        id serial PRIMARY KEY,
+        email text NOT NULL UNIQUE,
+        username text NOT NULL UNIQUE,
+        image_url text,
+        header_image_url text,
+        bio text,
+        location text,
+        password text NOT NULL
+    );
+    CREATE TABLE follows (
+        user_being_followed_id integer
+            REFERENCES users (id) ON DELETE CASCADE,
+        user_following_id integer
+            REFERENCES users (id) ON DELETE CASCADE,
+        PRIMARY KEY (user_being_followed_id, user_following_id)
+    );
+    CREATE TABLE messages (
+        id serial PRIMARY KEY,
+        text varchar(140) NOT NULL,
+        timestamp timestamp without time zone NOT NULL,
+        user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE
+    );
+    CREATE TABLE likes (
+        id serial PRIMARY KEY,
+        user_id integer REFERENCES users (id) ON DELETE CASCADE,
+        message_id integer UNIQUE REFERENCES messages (id) ON DELETE CASCADE
+    );
+"""
+
+
+def quiet(message):
+    pass
+
+
+class MigrationsTestCase(TestCase):
+    """Test applying migrations to an existing database."""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        # Concurrent index builds wait for open transactions to finish.
+        db.session.remove()
+        migrate(db.engine, echo=quiet)
+
+    def tearDown(self):
+        db.session.remove()
+        migrate(db.engine, echo=quiet)
+        self.context.pop()
+
+    def index_exists(self, name):
+        return db.engine.execute(
+            "SELECT to_regclass(%s) IS NOT NULL", (name,)).scalar()
+
+    def forget(self, version):
+        db.engine.execute(
+            "DELETE FROM schema_migrations WHERE version = %s", (version,))
+
+    def test_migrate_is_recorded_and_idempotent(self):
+        versions = {version for (version,) in db.engine.execute(
+            "SELECT version FROM schema_migrations")}
+        self.assertLessEqual({m.version for m in MIGRATIONS}, versions)
+
+        self.assertEqual(migrate(db.engine, echo=quiet), [])
+
+        self.forget('0005')
+        self.assertEqual(migrate(db.engine, echo=quiet), ['0005'])
+
+    def test_missing_index_rebuilt(self):
+        db.engine.execute("DROP INDEX ix_messages_user_timestamp")
+        self.forget('0006')
+
+        self.assertEqual(migrate(db.engine, echo=quiet), ['0006'])
+        self.assertTrue(self.index_exists('ix_messages_user_timestamp'))
+
+    def test_check_plans(self):
+        # Plans over empty tables are arbitrary; give the planner a graph.
+        with db.engine.begin() as conn:
+            conn.execute("""
+                INSERT INTO users (id, email, username, password)
+                SELECT g, 'planner' || g, 'planner' || g, 'x'
+                FROM generate_series(900001, 900300) AS g
+            """)
+            conn.execute("""
+                INSERT INTO follows
+                SELECT followed, follower
+                FROM generate_series(900001, 900020) AS followed,
+                     generate_series(900001, 900300) AS follower
+                WHERE followed <> follower
+            """)
+            conn.execute("""
+                INSERT INTO messages (id, text, timestamp, user_id)
+                SELECT g, 'planner message ' || g,
+                       timestamp '2020-01-01' - g * interval '1 minute',
+                       900001 + mod(g, 300)
+                FROM generate_series(900001, 906000) AS g
+            """)
+            conn.execute("""
+                INSERT INTO likes (user_id, message_id)
+                SELECT 900001 + mod(g, 300), 900001 + mod(g * 7, 6000)
+                FROM generate_series(1, 3000) AS g
+            """)
+            for table in ('users', 'follows', 'messages', 'likes'):
+                conn.execute(f"ANALYZE {table}")
+
+        try:
+            self.assertEqual(check_plans(db.engine), [])
+
+            db.engine.execute("DROP INDEX ix_follows_following")
+            db.engine.execute("DROP INDEX ix_follows_following_followed_at")
+            self.forget('0006')
+            self.forget('0007')
+
+            self.assertEqual(check_plans(db.engine), [
+                ('following', 'follows', 'full scan of follows_pkey')])
+        finally:
+            db.engine.execute("DELETE FROM users WHERE id > 900000")
+
+
+class BaselineMigrationsTestCase(TestCase):
+    """Test migrating a database created by the original schema."""
+
+    def setUp(self):
+        self.context = app.app_context()
+        self.context.push()
+        self.recreate_database()
+        self.engine = create_engine(f"postgresql:///{BASELINE_DATABASE}",
+                                    poolclass=NullPool)
+        self.engine.execute(BASELINE_SCHEMA_SQL)
+
+    def tearDown(self):
+        self.engine.dispose()
+        self.context.pop()
+
+    def recreate_database(self):
+        with db.engine.connect() as conn:
+            conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+            conn.execute(f'DROP DATABASE IF EXISTS "{BASELINE_DATABASE}"')
+            conn.execute(f'CREATE DATABASE "{BASELINE_DATABASE}"')
+
+    def test_migrate_baseline(self):
+        self.engine.execute("""
+            INSERT INTO users (id, email, username, password)
+            VALUES (1, 'one@test.com', 'one', 'x'),
+                   (2, 'two@test.com', 'two', 'x');
+            INSERT INTO messages (id, text, timestamp, user_id)
+            VALUES (1, 'Liked twice', now(), 1);
+            INSERT INTO likes (user_id, message_id) VALUES (1, 1);
+        """)
+
+        self.assertEqual(migrate(self.engine, echo=quiet),
+                         [migration.version for migration in MIGRATIONS])
+
+        # Both users can like the message, but each only once.
+        self.engine.execute(
+            "INSERT INTO likes (user_id, message_id) VALUES (2, 1)")
+        with self.assertRaises(exc.IntegrityError):
+            self.engine.execute(
+                "INSERT INTO likes (user_id, message_id) VALUES (2, 1)")
+
+        self.assertEqual(self.engine.execute(
+            "SELECT likes_count, messages_count FROM users WHERE id = 1"
+        ).fetchone(), (1, 1))
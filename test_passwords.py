@@ -0,0 +1,76 @@
+"""Password hasher tests.
+    to run these tests, copy and paste into your terminal:
+    python -m unittest test_passwords.py
+"""
+
+from unittest import TestCase
+
+from flask import Flask
+
+from passwords import PasswordHasher, PasswordHasherBusy, hash_rounds
+
+
+def make_hasher(**config):
+    app = Flask(__name__)
+    app.config['BCRYPT_LOG_ROUNDS'] = 4
+    app.config.update(config)
+    hasher = PasswordHasher()
+    hasher.init_app(app)
+    return hasher
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing passwords on the worker pool."""
+
+    def test_hash_and_check_on_pool(self):
+        hasher = make_hasher(PASSWORD_HASH_WORKERS=1)
+        try:
+            pw_hash = hasher.hash("secret")
+            self.assertEqual(hash_rounds(pw_hash), 4)
+            self.assertTrue(hasher.check(pw_hash, "secret"))
+            self.assertFalse(hasher.check(pw_hash, "wrong"))
+        finally:
+            hasher.shutdown()
+
+        stats = hasher.stats()
+        self.assertEqual(stats['submitted'], 3)
+        self.assertEqual(stats['completed'], 3)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_rejects_when_queue_is_full(self):
+        hasher = make_hasher(PASSWORD_HASH_WORKERS=0,
+                             PASSWORD_HASH_MAX_PENDING=0)
+
+        with self.assertRaises(PasswordHasherBusy):
+            hasher.hash("secret")
+        self.assertEqual(hasher.stats()['rejected'], 1)
+
+    def test_failed_submit_frees_slot(self):
+        hasher = make_hasher(PASSWORD_HASH_WORKERS=1,
+                             PASSWORD_HASH_MAX_PENDING=1)
+        # A pool that has been shut down refuses new jobs.
+        hasher._get_pool().shutdown()
+
+        with self.assertRaises(RuntimeError):
+            hasher.hash("secret")
+        self.assertEqual(hasher.stats()['pending'], 0)
+
+        hasher.shutdown()
+        self.assertTrue(hasher.check(hasher.hash("secret"), "secret"))
+        hasher.shutdown()
+
+    def test_empty_password(self):
+        hasher = make_hasher(PASSWORD_HASH_WORKERS=0)
+
+        with self.assertRaises(ValueError):
+            hasher.hash("")
+        self.assertFalse(hasher.check(hasher.hash("secret"), ""))
+
+    def test_needs_rehash(self):
+        hasher = make_hasher(PASSWORD_HASH_WORKERS=0)
+        pw_hash = hasher.hash("secret")
+
+        self.assertFalse(hasher.needs_rehash(pw_hash))
+        hasher.app.config['BCRYPT_LOG_ROUNDS'] = 5
+        self.assertTrue(hasher.needs_rehash(pw_hash))
+        self.assertTrue(hasher.needs_rehash("not a hash"))
@@ -0,0 +1,98 @@
+"""Connection pool tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_pools.py
+"""
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import NullPool
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import pools
+
+db.create_all()
+
+
+class PoolInstrumentationTestCase(TestCase):
+    """Test the pool counters."""
+
+    def setUp(self):
+        pools.STATS.pop('pool_test', None)
+        self.engine = create_engine(
+            "postgresql:///warbler-test", pool_size=1, max_overflow=1,
+            pool_timeout=0.1,
+            poolclass=pools.for_bind(pools.InstrumentedQueuePool,
+                                     'pool_test'))
+
+    def tearDown(self):
+        self.engine.dispose()
+        pools.STATS.pop('pool_test', None)
+
+    def test_overflow_and_timeout(self):
+        first = self.engine.connect()
+        second = self.engine.connect()
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+
+        stats = pools.STATS['pool_test'].as_dict()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['checked_out'], 2)
+        self.assertEqual(stats['overflow_opened'], 1)
+        self.assertEqual(stats['checkout_timeouts'], 1)
+        self.assertEqual(stats['checkouts'], 3)
+        self.assertGreaterEqual(stats['checkout_wait_max_seconds'], 0.1)
+
+        first.close()
+        second.close()
+        self.engine.dispose()
+        self.engine.connect().close()
+
+        stats = pools.STATS['pool_test'].as_dict()
+        self.assertEqual(stats['checked_out'], 0)
+        self.assertEqual(stats['connections_opened'], 3)
+        self.assertEqual(stats['connections_closed'], 2)
+        self.assertGreater(stats['connection_lifetime_seconds'], 0)
+
+
+class ConfigurePoolTestCase(TestCase):
+    """Test the pool settings given to each engine."""
+
+    def tearDown(self):
+        app.config['DATABASE_POOL_MODE'] = 'queue'
+
+    def test_queue_mode(self):
+        options = {'pool_size': 5}
+        pools.configure_pool(app, db.engine.url, options)
+
+        self.assertTrue(issubclass(options['poolclass'],
+                                   pools.InstrumentedQueuePool))
+        self.assertEqual(options['poolclass'].bind, 'primary')
+        self.assertEqual(options['pool_size'], 5)
+        self.assertTrue(options['pool_pre_ping'])
+
+    def test_transaction_mode(self):
+        app.config['DATABASE_POOL_MODE'] = 'transaction'
+        options = {'pool_size': 5, 'max_overflow': 10}
+        pools.configure_pool(app, db.engine.url, options)
+
+        self.assertTrue(issubclass(options['poolclass'], NullPool))
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('max_overflow', options)
+
+    def test_app_engine_is_instrumented(self):
+        self.assertIsInstance(db.engine.pool, pools.InstrumentedQueuePool)
+
+        app.config['METRICS_TOKEN'] = 'test-token'
+        try:
+            resp = app.test_client().get(
+                app.config['METRICS_PATH'],
+                headers={'Authorization': 'Bearer test-token'})
+        finally:
+            app.config['METRICS_TOKEN'] = None
+        self.assertIn(b'warbler_db_pool_primary_checked_out', resp.data)
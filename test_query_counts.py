@@ -0,0 +1,145 @@
+"""SQL statement budget tests.
+    Feeds must render in a constant number of queries, however many
+    messages and authors they show.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_query_counts.py
+"""
+
+import os
+from unittest import TestCase
+
+from models import db, Message, User
+from testing import QueryCountAssertions, read
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+from timeline import rebuild_timelines
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
+
+NUM_AUTHORS = 10
+
+
+class QueryCountTestCase(QueryCountAssertions, TestCase):
+    """Test the number of SQL statements issued per route."""
+
+    def setUp(self):
+        """Create a viewer following several authors with messages."""
+
+        User.query.delete()
+        self.client = app.test_client()
+
+        self.viewer = User(id=1000, username="viewer",
+                           email="viewer@test.com", password="HASHED")
+        authors = [
+            User(id=2000 + i, username=f"author{i}",
+                 email=f"author{i}@test.com", password="HASHED")
+            for i in range(NUM_AUTHORS)
+        ]
+        self.viewer.following.extend(authors)
+        db.session.add(self.viewer)
+        db.session.add_all(authors)
+
+        messages = [
+            Message(id=3000 + i, text=f"Message {i}",
+                    user_id=authors[i % NUM_AUTHORS].id)
+            for i in range(NUM_AUTHORS * 3)
+        ]
+        db.session.add_all(messages)
+        db.session.flush()
+        self.viewer.likes.extend(messages[:NUM_AUTHORS])
+        db.session.commit()
+
+        rebuild_timelines()
+
+    def tearDown(self):
+        res = super().tearDown()
+        db.session.rollback()
+        return res
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.viewer.id
+
+    def test_home_feed_query_count(self):
+        """Does the home feed render in a constant number of queries?"""
+        with self.client as c:
+            self.login(c)
+            # viewer, ETag version, celebrities, timeline, like state
+            with self.assertMaxQueries(5):
+                resp = read(c.get('/'))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@author9", str(resp.data))
+
+    def test_celebrity_home_feed_query_count(self):
+        """Are messages pulled from celebrities loaded with their authors?"""
+        reconcile_counters()
+        threshold = app.config['TIMELINE_FANOUT_THRESHOLD']
+        # Every author has one follower, so all of them are pulled on read.
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 1
+        rebuild_timelines(fanout_threshold=1)
+        try:
+            with self.client as c:
+                self.login(c)
+                # viewer, ETag version, timeline, celebrities, pulled
+                # messages + authors, like state
+                with self.assertMaxQueries(6):
+                    resp = read(c.get('/'))
+                self.assertEqual(resp.status_code, 200)
+                for i in range(NUM_AUTHORS):
+                    self.assertIn(f"@author{i}<", str(resp.data))
+        finally:
+            app.config['TIMELINE_FANOUT_THRESHOLD'] = threshold
+
+    def test_users_show_query_count(self):
+        """Does a profile page render in a constant number of queries?"""
+        with self.client as c:
+            self.login(c)
+            # viewer, ETag version, user, messages, follow state, like state
+            with self.assertMaxQueries(6):
+                resp = read(c.get('/users/2000'))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Message 0", str(resp.data))
+
+    def test_user_likes_query_count(self):
+        """Does the likes page render in a constant number of queries?"""
+        with self.client as c:
+            with self.assertMaxQueries(4):
+                resp = read(c.get(f'/users/{self.viewer.id}/likes'))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@author9", str(resp.data))
+
+    def test_logged_in_likes_query_count(self):
+        """Is the viewer's like state resolved with one query per page?"""
+        with self.client as c:
+            self.login(c)
+            with self.assertMaxQueries(5):
+                resp = read(c.get(f'/users/{self.viewer.id}/likes'))
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(str(resp.data).count('data-liked="true"'),
+                             NUM_AUTHORS)
+
+    def test_not_modified_query_count(self):
+        """Does a 304 skip the page's own queries?"""
+        with self.client as c:
+            self.login(c)
+            etag = c.get('/').headers['ETag']
+            # viewer, ETag version
+            with self.assertMaxQueries(2):
+                resp = read(c.get('/', headers={'If-None-Match': etag}))
+            self.assertEqual(resp.status_code, 304)
+
+    def test_message_show_query_count(self):
+        """Does a message page render in a constant number of queries?"""
+        with self.client as c:
+            self.login(c)
+            # viewer, ETag version, message + author, follow state, like state
+            with self.assertMaxQueries(5):
+                resp = read(c.get('/messages/3000'))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('data-liked="true"', str(resp.data))
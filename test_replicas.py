@@ -0,0 +1,88 @@
+"""Read replica routing tests.
+    to run these tests, copy and paste into your terminal:
+    createdb warbler-test-replica
+    FLASK_ENV=production python -m unittest test_replicas.py
+"""
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, replica_router
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
+
+REPLICA_URL = "postgresql:///warbler-test-replica"
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test sending reads to a replica, standing in for one with a
+    second database that doesn't replicate anything."""
+
+    def setUp(self):
+        self.config = {key: app.config[key] for key in
+                       ('SQLALCHEMY_BINDS', 'REPLICA_PIN_SECONDS',
+                        'REPLICA_MAX_LAG_SECONDS')}
+        app.config['SQLALCHEMY_BINDS'] = {'replica_0': REPLICA_URL}
+        replica_router.checked_at.clear()
+
+        with app.app_context():
+            self.replica = db.get_engine(app, bind='replica_0')
+        db.Model.metadata.create_all(self.replica)
+
+        self.replica.execute("DELETE FROM users")
+        self.replica.execute("""
+            INSERT INTO users (id, email, username, password)
+            VALUES (9090, 'writer@test.com', 'writer', 'x'),
+                   (9191, 'replica@test.com', 'replica-only', 'x')
+        """)
+
+        User.query.delete()
+        User.signup(username="writer", email="writer@test.com",
+                    password="writer", image_url=None).id = 9090
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config.update(self.config)
+
+    def test_get_reads_from_replica(self):
+        resp = self.client.get('/users/9191')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@replica-only", str(resp.data))
+
+    def test_write_pins_client_to_primary(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 9090
+
+        resp = self.client.post('/messages/new', data={"text": "Fresh"},
+                                follow_redirects=True)
+
+        self.assertIn("Fresh", str(resp.data))
+        self.assertEqual(Message.query.filter_by(user_id=9090).count(), 1)
+
+    def test_unpinned_reads_are_stale(self):
+        app.config['REPLICA_PIN_SECONDS'] = 0
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 9090
+
+        resp = self.client.post('/messages/new', data={"text": "Fresh"},
+                                follow_redirects=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("Fresh", str(resp.data))
+
+    def test_lagging_replica_skipped(self):
+        app.config['REPLICA_MAX_LAG_SECONDS'] = -1
+
+        self.assertEqual(self.client.get('/users/9191').status_code, 404)
+        self.assertEqual(replica_router.stats()['replica_0_lag_seconds'], 0)
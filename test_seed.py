@@ -0,0 +1,108 @@
+"""Seed loader tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_seed.py
+"""
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from seed import copy_file, shards
+
+db.create_all()
+
+# Values the generator's csv.writer has to quote or escape.
+TRICKY_BIOS = [
+    'Plain',
+    'Comma, then more',
+    'Say "hi"',
+    'Two\nlines',
+    'Back\\slash and \\N',
+    'Ünïcødé 🐦',
+    'NULL',
+]
+
+
+class CopyFileTestCase(TestCase):
+    """Test loading CSV rows with COPY."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        with app.app_context():
+            self.conn = db.engine.raw_connection()
+        self.cursor = self.conn.cursor()
+        self.cursor.execute("DELETE FROM users")
+
+    def tearDown(self):
+        self.conn.rollback()
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def write_csv(self, name, headers, rows):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(headers)
+            writer.writerows(rows)
+        return path
+
+    def test_values_round_trip(self):
+        path = self.write_csv(
+            'users-0000.csv', ['id', 'email', 'username', 'password', 'bio'],
+            [(i, f'u{i}@test.com', f'u{i}', 'x', bio)
+             for i, bio in enumerate(TRICKY_BIOS, 1)])
+
+        self.assertEqual(copy_file(self.cursor, 'users', path),
+                         len(TRICKY_BIOS))
+
+        # As UTF-8 bytes, so the check doesn't depend on the test
+        # database's encoding.
+        self.cursor.execute(
+            "SELECT convert_to(bio, 'UTF8') FROM users ORDER BY id")
+        self.assertEqual([bytes(bio).decode('utf-8')
+                          for (bio,) in self.cursor.fetchall()],
+                         TRICKY_BIOS)
+
+    def test_empty_field_is_null(self):
+        path = self.write_csv(
+            'users.csv', ['id', 'email', 'username', 'password', 'location'],
+            [(1, 'u1@test.com', 'u1', 'x', None),
+             (2, 'u2@test.com', 'u2', 'x', '')])
+
+        copy_file(self.cursor, 'users', path)
+
+        # csv.writer writes None and '' alike, and COPY reads both as NULL.
+        self.cursor.execute("SELECT location FROM users ORDER BY id")
+        self.assertEqual(self.cursor.fetchall(), [(None,), (None,)])
+
+    def test_columns_come_from_header(self):
+        path = self.write_csv(
+            'users.csv', ['username', 'password', 'id', 'email'],
+            [('u1', 'x', 41, 'u1@test.com')])
+
+        copy_file(self.cursor, 'users', path)
+
+        self.cursor.execute("SELECT id, username, email FROM users")
+        self.assertEqual(self.cursor.fetchall(),
+                         [(41, 'u1', 'u1@test.com')])
+
+
+class ShardsTestCase(TestCase):
+    """Test finding a table's CSV files."""
+
+    def test_single_file_then_shards_in_order(self):
+        with tempfile.TemporaryDirectory() as data_dir:
+            for name in ('users-0001.csv', 'users.csv', 'users-0000.csv',
+                         'userstats-0000.csv', 'messages-0000.csv'):
+                open(os.path.join(data_dir, name), 'w').close()
+
+            self.assertEqual(
+                [os.path.basename(path) for path in shards(data_dir, 'users')],
+                ['users.csv', 'users-0000.csv', 'users-0001.csv'])
+            self.assertEqual(shards(data_dir, 'likes'), [])
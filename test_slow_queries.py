@@ -0,0 +1,93 @@
+"""Slow query log tests.
+    to run these tests, copy and paste into your terminal:
+    FLASK_ENV=production python -m unittest test_slow_queries.py
+"""
+
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy.exc import DBAPIError
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from slow_queries import SlowQueryLog, parameters_shape
+
+db.create_all()
+
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
+
+
+class ParametersShapeTestCase(TestCase):
+    """Test that parameter values are not logged."""
+
+    def test_shapes(self):
+        self.assertEqual(
+            parameters_shape({'id': 5, 'ids': [1, 2], 'q': 'secret'}, False),
+            {'id': 'int', 'ids': 'list[2]', 'q': 'str'})
+        self.assertEqual(parameters_shape([{'id': 1}, {'id': 2}], True),
+                         {'rows': 2, 'row': {'id': 'int'}})
+
+
+class SlowQueryLogTestCase(TestCase):
+    """Test logging statements over the threshold."""
+
+    def setUp(self):
+        User.query.delete()
+        User.signup(username="slowpoke", email="slow@test.com",
+                    password="slowpoke", image_url=None).id = 8080
+        db.session.commit()
+
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'slow.log')
+        self.config = {key: app.config[key] for key in
+                       ('SLOW_QUERY_LOG', 'SLOW_QUERY_THRESHOLD_MS',
+                        'SLOW_QUERY_EXPLAIN_RATE')}
+        app.config.update(SLOW_QUERY_LOG=self.path,
+                          SLOW_QUERY_THRESHOLD_MS=0,
+                          SLOW_QUERY_EXPLAIN_RATE=1)
+        self.slow_query_log = SlowQueryLog()
+        self.slow_query_log.init_app(app)
+
+    def tearDown(self):
+        self.slow_query_log.close()
+        app.config.update(self.config)
+        self.tmp.cleanup()
+        db.session.rollback()
+
+    def entries(self):
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_logs_route_stack_and_plan(self):
+        resp = app.test_client().get('/users/8080')
+        self.assertEqual(resp.status_code, 200)
+
+        entries = [entry for entry in self.entries()
+                   if entry['endpoint'] == 'users_show'
+                   and 'FROM messages' in entry['statement']]
+        self.assertTrue(entries)
+
+        entry = entries[0]
+        self.assertEqual(entry['path'], '/users/8080')
+        self.assertTrue(any(frame.startswith('app.py:')
+                            for frame in entry['stack']))
+        self.assertNotIn('8080', json.dumps(entry['parameters']))
+        self.assertIn('Plan', entry['plan'][0])
+
+    def test_explain_failure_keeps_transaction(self):
+        plan = self.slow_query_log.explain(
+            db.session.connection(), "SELECT no_such_column FROM users", {})
+
+        self.assertIn('no_such_column', plan['error'])
+        self.assertEqual(User.query.filter_by(id=8080).count(), 1)
+
+    def test_failed_statement_not_left_timing(self):
+        with db.engine.connect() as conn:
+            with self.assertRaises(DBAPIError):
+                conn.execute("SELECT 1 / 0")
+            self.assertFalse(conn.info.get('slow_query_start'))
@@ -5,8 +5,10 @@
 
 import os
 from unittest import TestCase
-from models import db, User, Message, Follows
+from models import db, User, Message
 from sqlalchemy.exc import IntegrityError
+from counters import reconcile_counters
+from passwords import hash_rounds
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
@@ -100,6 +102,49 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.u2.is_followed_by(self.u1))
         self.assertFalse(self.u1.is_followed_by(self.u2))
 
+    def test_user_following_ids_among(self):
+        """Test follow state is resolved for a batch of users"""
+
+        u3 = User.signup("testuser3", "test3@gmail.com", "password", None)
+        u3.id = 333
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(
+            self.u1.following_ids_among([self.uid2, 333, 999]), {self.uid2})
+        self.assertEqual(self.u2.following_ids_among([self.uid1]), set())
+        self.assertEqual(self.u1.following_ids_among([]), set())
+
+    def test_user_liked_ids_among(self):
+        """Test like state is resolved for a batch of messages"""
+
+        m1 = Message(id=1001, text="first", user_id=self.uid2)
+        m2 = Message(id=1002, text="second", user_id=self.uid2)
+        db.session.add_all([m1, m2])
+        self.u1.likes.append(m1)
+        db.session.commit()
+
+        self.assertEqual(self.u1.liked_ids_among([1001, 1002, 9999]), {1001})
+        self.assertEqual(self.u2.liked_ids_among([1001]), set())
+        self.assertEqual(self.u1.liked_ids_among([]), set())
+
+    def test_reconcile_counters(self):
+        """Test drifted counters are reported and corrected"""
+
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        self.assertEqual(reconcile_counters(fix=False), [
+            (self.uid1, 'following_count', 0, 1),
+            (self.uid2, 'followers_count', 0, 1),
+        ])
+        self.assertEqual(User.query.get(self.uid1).following_count, 0)
+
+        self.assertEqual(len(reconcile_counters()), 2)
+        self.assertEqual(User.query.get(self.uid1).following_count, 1)
+        self.assertEqual(User.query.get(self.uid2).followers_count, 1)
+        self.assertEqual(reconcile_counters(), [])
+
 ########### TESTS ON USER MODEL: SIGN UP ###########
 
     def test_user_signup(self):
@@ -155,4 +200,20 @@ class UserModelTestCase(TestCase):
         self.assertFalse(user)
 
         user = User.authenticate("testuser1", "badpassword")
-        self.assertFalse(user)
\ No newline at end of file
+        self.assertFalse(user)
+
+    def test_login_rehashes_outdated_cost(self):
+        """ Tests a login upgrades a hash made with an old bcrypt cost"""
+
+        old_hash = self.u1.password
+        rounds = app.config['BCRYPT_LOG_ROUNDS']
+        app.config['BCRYPT_LOG_ROUNDS'] = 5
+        try:
+            user = User.authenticate("testuser1", "password")
+            db.session.commit()
+        finally:
+            app.config['BCRYPT_LOG_ROUNDS'] = rounds
+
+        self.assertNotEqual(user.password, old_hash)
+        self.assertEqual(hash_rounds(user.password), 5)
+        self.assertTrue(User.authenticate("testuser1", "password"))
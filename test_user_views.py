@@ -4,9 +4,12 @@
 """
 
 import os
+import re
+from datetime import datetime
+from html import unescape as html_unescape
 from unittest import TestCase
 
-from models import db, connect_db, Message, User, Likes
+from models import db, connect_db, Message, User, Likes, Follows
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -16,6 +19,8 @@ from models import db, connect_db, Message, User, Likes
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 
 from app import app, CURR_USER_KEY
+from pagination import OLDER, encode_cursor
+from testing import read
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -24,6 +29,7 @@ from app import app, CURR_USER_KEY
 db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
+app.config['CURRENT_USER_CACHE_ENABLED'] = False
 
 class UserViewTestCase(TestCase):
     """Test views for users."""
@@ -134,6 +140,34 @@ class UserViewTestCase(TestCase):
             self.assertIn("@qwerty", str(resp.data))
             self.assertIn("@warbler", str(resp.data))
 
+    def test_show_users_streamed(self):
+        """Is the full listing streamed, with the viewer's follows marked?"""
+        self.testuser1.following.append(self.testuser3)
+        db.session.commit()
+        followed_id, other_id = self.testuser3.id, self.testuser4.id
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            resp = c.get('/users')
+            self.assertTrue(resp.is_streamed)
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'/users/stop-following/{followed_id}', html)
+            self.assertIn(f'/users/follow/{other_id}', html)
+
+    def test_show_users_streamed_flashes_once(self):
+        """Are flashes shown on a streamed page cleared from the session?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', 'Hello from the past')]
+
+            resp = c.get('/users')
+            self.assertIn("Hello from the past", resp.get_data(as_text=True))
+
+            resp = c.get('/users')
+            self.assertNotIn("Hello from the past", resp.get_data(as_text=True))
+
     def test_show_users_search(self):
         """ Can user see list of users with query from search bar?"""
         with self.client as c:
@@ -146,6 +180,62 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@qwerty", str(resp.data))
             self.assertNotIn("@warbler", str(resp.data))
 
+    def test_show_users_search_bio_and_location(self):
+        """Does search match bios and locations, ranking usernames first?"""
+        self.testuser3.bio = "Warbling all day"
+        self.testuser2.location = "Warbleton"
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get('/users?q=warbl')
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@qwerty", html)
+            self.assertIn("@testuser2", html)
+            self.assertNotIn("@testuser1", html)
+            self.assertLess(html.index("@warbler"), html.index("@qwerty"))
+
+    def test_show_users_search_pagination_with_tied_ranks(self):
+        """Are users with equal ranks neither skipped nor repeated?"""
+        for i in range(5):
+            User.signup(username=f"tied{i}", email=f"tied{i}@test.com",
+                        password="tied", image_url=None).bio = "Birdwatcher"
+        db.session.commit()
+
+        app.config['USER_LIST_PAGE_SIZE'] = 2
+        try:
+            with self.client as c:
+                seen = []
+                url = '/users?q=birdwatcher'
+                while url:
+                    html = read(c.get(url)).get_data(as_text=True)
+                    seen += re.findall(r'<p>@(tied\d)</p>', html)
+                    older = re.search(r'href="([^"]+)">Older', html)
+                    url = older and html_unescape(older.group(1))
+        finally:
+            app.config['USER_LIST_PAGE_SIZE'] = 60
+
+        self.assertEqual(sorted(seen), [f"tied{i}" for i in range(5)])
+
+    def test_show_users_search_no_words(self):
+        """Does a search without any words show no users?"""
+        with self.client as c:
+            resp = c.get('/users?q=%25%26')
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Sorry, no users found", str(resp.data))
+
+    def test_autocomplete_users(self):
+        """Does autocomplete return users by username prefix?"""
+        with self.client as c:
+            resp = c.get('/api/users/autocomplete?q=TestU')
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(
+                [user['username'] for user in resp.json['users']],
+                ["testuser1", "testuser2"])
+
+            resp = c.get('/api/users/autocomplete?q=test%25')
+            self.assertEqual(resp.json['users'], [])
+
 ########### TESTS ON USER VIEWS: SHOW USER PROFILE ###########
 
     def test_show_other_user_profile(self):
@@ -162,6 +252,92 @@ class UserViewTestCase(TestCase):
             resp = c.get('/users/9845456')
             self.assertEqual(resp.status_code, 404)
 
+    def test_show_user_profile_pagination(self):
+        """Can user page through a profile feed with equal timestamps?"""
+        timestamp = datetime(2021, 1, 1)
+        db.session.add_all([
+            Message(id=9001 + i, text=f"Paged message {i}",
+                    timestamp=timestamp, user_id=self.testuser2_id)
+            for i in range(3)
+        ])
+        db.session.commit()
+
+        app.config['FEED_PAGE_SIZE'] = 2
+        try:
+            with self.client as c:
+                resp = c.get(f'/users/{self.testuser2_id}')
+                html = resp.get_data(as_text=True)
+                self.assertIn("Paged message 2", html)
+                self.assertIn("Paged message 1", html)
+                self.assertNotIn("Paged message 0", html)
+                self.assertNotIn("Newer", html)
+
+                older = re.search(r'href="([^"]+)">Older', html).group(1)
+                resp = c.get(html_unescape(older))
+                html = resp.get_data(as_text=True)
+                self.assertIn("Paged message 0", html)
+                self.assertNotIn("Paged message 1", html)
+                self.assertNotIn("Older", html)
+
+                newer = re.search(r'href="([^"]+)">&larr; Newer', html).group(1)
+                resp = c.get(html_unescape(newer))
+                html = resp.get_data(as_text=True)
+                self.assertIn("Paged message 2", html)
+                self.assertIn("Paged message 1", html)
+                self.assertNotIn("Paged message 0", html)
+        finally:
+            app.config['FEED_PAGE_SIZE'] = 100
+
+    def test_show_user_profile_tampered_cursor(self):
+        """Is a forged pagination cursor rejected?"""
+        with self.client as c:
+            resp = c.get(f'/users/{self.testuser2_id}?cursor=not-a-cursor')
+            self.assertEqual(resp.status_code, 400)
+
+    def test_cursor_replayed_on_other_page(self):
+        """Is a cursor from one listing rejected by the others?"""
+        for i in range(3):
+            User.signup(username=f"replay{i}", email=f"replay{i}@test.com",
+                        password="replay", image_url=None).bio = "Replayed"
+        db.session.commit()
+
+        app.config['USER_LIST_PAGE_SIZE'] = 2
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                html = read(c.get('/users?q=replayed')).get_data(as_text=True)
+                older = re.search(r'href="([^"]+)">Older', html).group(1)
+                cursor = re.search(r'cursor=([^&"]+)',
+                                   html_unescape(older)).group(1)
+
+                for url in (f'/users/{self.testuser2_id}',
+                            f'/users/{self.testuser2_id}/likes',
+                            f'/users/{self.testuser2_id}/following',
+                            '/messages/search?q=replayed',
+                            '/'):
+                    resp = read(c.get(f'{url}{"&" if "?" in url else "?"}'
+                                      f'cursor={cursor}'))
+                    self.assertEqual(resp.status_code, 400, url)
+        finally:
+            app.config['USER_LIST_PAGE_SIZE'] = 60
+
+    def test_cursor_with_wrong_key_shape(self):
+        """Is a validly signed cursor with the wrong key types rejected?"""
+        url = f'/users/{self.testuser2_id}'
+        for key in ([1.5, 7], ['2021-01-01', 7], [datetime(2021, 1, 1)]):
+            with app.test_request_context(url):
+                cursor = encode_cursor(OLDER, key)
+
+            resp = self.client.get(url, query_string={'cursor': cursor})
+            self.assertEqual(resp.status_code, 400, key)
+
+        with app.test_request_context(url):
+            cursor = encode_cursor(OLDER, [datetime(2021, 1, 1), 7])
+        resp = self.client.get(url, query_string={'cursor': cursor})
+        self.assertEqual(resp.status_code, 200)
+
 ########### TESTS ON USER VIEWS: USER FOLLOWING/FOLLOWERS ###########
 
     def test_user_following_valid(self):
@@ -203,6 +379,42 @@ class UserViewTestCase(TestCase):
             self.assertIn("@warbler", str(resp.data))
             self.assertNotIn("@testuser1", str(resp.data))
 
+    def test_user_followers_pagination(self):
+        """Are followers paged newest follow first, with the viewer's follows?"""
+        db.session.add_all([
+            Follows(user_being_followed_id=self.testuser2_id,
+                    user_following_id=self.testuser3.id,
+                    followed_at=datetime(2021, 1, 1)),
+            Follows(user_being_followed_id=self.testuser2_id,
+                    user_following_id=self.testuser4.id,
+                    followed_at=datetime(2021, 1, 2)),
+            Follows(user_being_followed_id=self.testuser4.id,
+                    user_following_id=self.testuser1_id),
+        ])
+        db.session.commit()
+        followed_id = self.testuser4.id
+
+        app.config['USER_LIST_PAGE_SIZE'] = 1
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.testuser1_id
+
+                resp = c.get(f'/users/{self.testuser2_id}/followers')
+                html = resp.get_data(as_text=True)
+                self.assertIn("@warbler", html)
+                self.assertNotIn("@qwerty", html)
+                self.assertIn(f'/users/stop-following/{followed_id}', html)
+
+                older = re.search(r'href="([^"]+)">Older', html).group(1)
+                resp = c.get(html_unescape(older))
+                html = resp.get_data(as_text=True)
+                self.assertIn("@qwerty", html)
+                self.assertNotIn("@warbler", html)
+                self.assertNotIn("Older", html)
+        finally:
+            app.config['USER_LIST_PAGE_SIZE'] = 60
+
     def test_user_followers_unauthorized(self):
         """Can user view other user following list while logged out? """
         with self.client as c:
@@ -227,6 +439,20 @@ class UserViewTestCase(TestCase):
             self.assertNotIn("@warbler", str(resp.data))
             self.assertIn("@testuser2", str(resp.data))
 
+    def test_user_follow_counters(self):
+        """Do follow and unfollow keep both users' counters in step?"""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            c.post(f'/users/follow/{self.testuser2_id}')
+            self.assertEqual(User.query.get(self.testuser1_id).following_count, 1)
+            self.assertEqual(User.query.get(self.testuser2_id).followers_count, 1)
+
+            c.post(f'/users/stop-following/{self.testuser2_id}')
+            self.assertEqual(User.query.get(self.testuser1_id).following_count, 0)
+            self.assertEqual(User.query.get(self.testuser2_id).followers_count, 0)
+
     def test_user_follow_unauthorized(self):
         """Can user follow other user while logged out? """
         with self.client as c:
@@ -392,4 +618,165 @@ class UserViewTestCase(TestCase):
         with self.client as c:
             resp = c.post('/users/add_like/341579', follow_redirects=True)
             self.assertEqual(resp.status_code, 200)
-            self.assertIn("Access unauthorized.", str(resp.data))
\ No newline at end of file
+            self.assertIn("Access unauthorized.", str(resp.data))
+
+    def test_unlike_message(self):
+        """Does posting the like form again unlike the message?"""
+        msg = Message(id=341580, text="Like me twice", user_id=self.testuser1_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser2_id
+
+            c.post('/users/add_like/341580')
+            self.assertEqual(User.query.get(self.testuser2_id).likes_count, 1)
+
+            c.post('/users/add_like/341580')
+            self.assertEqual(Likes.query.filter_by(message_id=341580).count(), 0)
+            self.assertEqual(User.query.get(self.testuser2_id).likes_count, 0)
+
+    def test_like_message_api(self):
+        """Can a message be liked and unliked through the JSON API?"""
+        msg = Message(id=341581, text="API like", user_id=self.testuser1_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser2_id
+
+            for _ in range(2):
+                resp = c.post('/api/messages/341581/like', json={})
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp.get_json(),
+                                 {'message_id': 341581, 'liked': True})
+            self.assertEqual(Likes.query.filter_by(message_id=341581).count(), 1)
+            self.assertEqual(User.query.get(self.testuser2_id).likes_count, 1)
+
+            resp = c.delete('/api/messages/341581/like', json={})
+            self.assertEqual(resp.get_json(),
+                             {'message_id': 341581, 'liked': False})
+            self.assertEqual(Likes.query.filter_by(message_id=341581).count(), 0)
+            self.assertEqual(User.query.get(self.testuser2_id).likes_count, 0)
+
+            resp = c.post('/api/messages/341581/like')
+            self.assertEqual(resp.status_code, 415)
+
+            resp = c.post('/api/messages/99999999/like', json={})
+            self.assertEqual(resp.status_code, 404)
+
+    def test_like_message_api_errors(self):
+        """Does the like API refuse anonymous users and own messages?"""
+        msg = Message(id=341582, text="Mine", user_id=self.testuser1_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.post('/api/messages/341582/like', json={})
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser1_id
+
+            resp = c.post('/api/messages/341582/like', json={})
+            self.assertEqual(resp.status_code, 403)
+
+    def test_profile_not_modified(self):
+        """Does a profile answer a matching ETag with 304 until it changes?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser2_id
+
+            resp = c.get(f'/users/{self.testuser1_id}')
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+            resp = c.get(f'/users/{self.testuser1_id}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b'')
+
+            # The viewer follows the user, so the follow button changes.
+            c.post(f'/users/follow/{self.testuser1_id}')
+            resp = c.get(f'/users/{self.testuser1_id}',
+                         headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_likes_page_changes_with_liked_authors(self):
+        """Does a likes page's ETag change when a liked author is edited?"""
+
+        author_id = self.testuser3.id
+        db.session.add(Message(id=5150, text="Liked", user_id=author_id))
+        db.session.flush()
+        db.session.add(Likes(user_id=self.testuser1_id, message_id=5150))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser2_id
+
+            url = f'/users/{self.testuser1_id}/likes'
+            etag = read(c.get(url)).headers['ETag']
+            resp = read(c.get(url, headers={'If-None-Match': etag}))
+            self.assertEqual(resp.status_code, 304)
+
+            # As the profile view does, without touching the liker's row.
+            db.session.execute(
+                "UPDATE users SET username = 'renamed', "
+                "profile_version = profile_version + 1 WHERE id = :id",
+                {'id': author_id})
+            db.session.commit()
+
+            resp = read(c.get(url, headers={'If-None-Match': etag}))
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@renamed", resp.get_data(as_text=True))
+
+    def test_not_modified_renders_pending_flashes(self):
+        """Are pages with pending flash messages always rendered?"""
+
+        with self.client as c:
+            resp = c.get('/')
+            etag = resp.headers['ETag']
+
+            with c.session_transaction() as sess:
+                sess['_flashes'] = [('success', 'Flash!')]
+
+            resp = c.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Flash!', str(resp.data))
+
+    def test_static_assets_are_immutable(self):
+        """Are versioned static URLs cached for good?"""
+
+        with self.client as c:
+            resp = c.get('/')
+            match = re.search(r'href="(/static/stylesheets/style.css\?v=\w+)"',
+                              str(resp.data))
+            self.assertIsNotNone(match)
+
+            resp = c.get(match.group(1))
+            self.assertEqual(resp.headers['Cache-Control'],
+                             'public, max-age=31536000, immutable')
+            resp.close()
+
+    def test_wrong_static_version_not_immutable(self):
+        """Is a static file asked for with a bad version cached briefly?"""
+
+        resp = self.client.get('/static/stylesheets/style.css?v=garbage')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         f"public, max-age={app.config['STATIC_MAX_AGE']}")
+        resp.close()
+
+    def test_missing_static_file_not_cached(self):
+        """Is a missing versioned static file left uncached?"""
+
+        resp = self.client.get('/static/stylesheets/nope.css?v=abc')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.headers['Cache-Control'],
+                         'no-cache, no-store, must-revalidate')
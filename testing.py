@@ -0,0 +1,64 @@
+"""Helpers shared by the Warbler test suites."""
+
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from models import db
+
+
+class QueryCounter:
+    """Record the SQL statements issued while it is active.
+
+        with QueryCounter() as counter:
+            client.get('/')
+        print(counter.count, counter.statements)
+    """
+
+    def __init__(self, engine=None):
+        self.engine = engine
+        self.statements = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        self.engine = self.engine or db.engine
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+
+def read(response):
+    """Read a test client response to the end and close it, like a server.
+
+    Streamed pages (see streaming.py) only render, and run their queries, as
+    the body is read.
+    """
+
+    response.get_data()
+    response.close()
+    return response
+
+
+class QueryCountAssertions:
+    """TestCase mixin for asserting how many SQL statements code issues."""
+
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fail if the block issues more than `limit` SQL statements."""
+
+        with QueryCounter() as counter:
+            yield counter
+
+        if counter.count > limit:
+            self.fail(
+                f"{counter.count} SQL statements issued, expected at most "
+                f"{limit}:\n" + "\n\n".join(counter.statements))
@@ -0,0 +1,309 @@
+"""Materialized home timelines for Warbler.
+
+Every user's home feed is stored in the ``timeline_entries`` table, one row
+per message that belongs in it. New messages are fanned out to the author
+and their followers when they are posted, so reading a feed is a single
+range scan over ``(user_id, timestamp)``.
+
+Fanning out is only cheap for ordinary accounts. Messages from "celebrity"
+accounts (at least ``fanout_threshold`` followers) are written to the
+author's own timeline only, and are pulled in when a follower reads their
+feed, merged with the materialized entries on timestamp.
+"""
+
+from heapq import merge
+from itertools import groupby
+
+from sqlalchemy import bindparam, literal, select, text
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import contains_eager, joinedload
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import is_ascending, paginate, seek
+
+DEFAULT_TIMELINE_DEPTH = 800
+DEFAULT_FANOUT_THRESHOLD = 10000
+
+TIMELINE_COLUMNS = ['user_id', 'message_id', 'timestamp']
+
+
+def is_celebrity(follower_count, fanout_threshold=DEFAULT_FANOUT_THRESHOLD):
+    """Are messages from an account with this many followers pulled on read?"""
+
+    return follower_count >= fanout_threshold
+
+
+def follower_count(user_id):
+    """Return the number of followers of a user, from its counter column."""
+
+    return (db.session
+            .query(User.followers_count)
+            .filter(User.id == user_id)
+            .scalar())
+
+
+def fan_out(message, fanout_threshold=DEFAULT_FANOUT_THRESHOLD):
+    """Push a newly-posted message into its author's and followers' timelines.
+
+    Messages from celebrity accounts only go into the author's timeline.
+    The message must already be flushed so that it has an id.
+    """
+
+    rows = select([
+        literal(message.user_id),
+        literal(message.id),
+        literal(message.timestamp, db.DateTime),
+    ])
+
+    if not is_celebrity(follower_count(message.user_id), fanout_threshold):
+        followers = (select([
+            Follows.user_following_id,
+            literal(message.id),
+            literal(message.timestamp, db.DateTime),
+        ])
+            .where(Follows.user_being_followed_id == message.user_id))
+        rows = rows.union_all(followers)
+
+    db.session.execute(
+        insert(TimelineEntry.__table__)
+        .from_select(TIMELINE_COLUMNS, rows)
+        .on_conflict_do_nothing())
+
+
+def add_followed_messages(follower_id, followed_id,
+                          depth=DEFAULT_TIMELINE_DEPTH,
+                          fanout_threshold=DEFAULT_FANOUT_THRESHOLD):
+    """Copy the most recent messages of a newly-followed user into a timeline.
+
+    Nothing is copied for celebrity accounts, whose messages are pulled.
+    """
+
+    if is_celebrity(follower_count(followed_id), fanout_threshold):
+        return
+
+    recent = (select([
+        literal(follower_id),
+        Message.id,
+        Message.timestamp,
+    ])
+        .where(Message.user_id == followed_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(depth))
+
+    db.session.execute(
+        insert(TimelineEntry.__table__)
+        .from_select(TIMELINE_COLUMNS, recent)
+        .on_conflict_do_nothing())
+
+
+def remove_followed_messages(follower_id, followed_id):
+    """Drop an unfollowed user's messages from a timeline."""
+
+    followed_messages = (db.session
+                         .query(Message.id)
+                         .filter(Message.user_id == followed_id))
+
+    (TimelineEntry
+     .query
+     .filter(TimelineEntry.user_id == follower_id,
+             TimelineEntry.message_id.in_(followed_messages.subquery()))
+     .delete(synchronize_session=False))
+
+
+def followed_celebrity_ids(user_id, fanout_threshold=DEFAULT_FANOUT_THRESHOLD):
+    """Return ids of the celebrity accounts a user follows."""
+
+    celebrities = (db.session
+                   .query(Follows.user_being_followed_id)
+                   .join(User, User.id == Follows.user_being_followed_id)
+                   .filter(Follows.user_following_id == user_id,
+                           User.followers_count >= fanout_threshold))
+
+    return [user_id for (user_id,) in celebrities]
+
+
+# Selects every messages column, then every users column, in table order;
+# `recent_messages_by_author` maps them to the models by position.
+RECENT_BY_AUTHOR_SQL = """
+    SELECT {columns}
+    FROM unnest(:author_ids) AS a(id)
+    CROSS JOIN LATERAL (
+        SELECT messages.*
+        FROM messages
+        WHERE messages.user_id = a.id {seek}
+        ORDER BY messages.timestamp {order}, messages.id {order}
+        LIMIT :limit
+    ) AS m
+    JOIN users ON users.id = m.user_id
+    ORDER BY m.user_id, m.timestamp {order}, m.id {order}
+"""
+
+
+def recent_messages_by_author(author_ids, limit, cursor=None):
+    """Return each author's `limit` newest messages past `cursor`.
+
+    There is one list per author, in scan order for the cursor (see
+    `pagination.is_ascending`).
+    """
+
+    if not author_ids:
+        return []
+
+    ascending = is_ascending(cursor)
+    params = {'author_ids': list(author_ids), 'limit': limit}
+    seek = ''
+
+    if cursor is not None:
+        seek = ('AND (messages.timestamp, messages.id) {} (:ts, :id)'
+                .format('>' if ascending else '<'))
+        params['ts'], params['id'] = cursor.key
+
+    # Each author is loaded with their messages, so rendering `msg.user`
+    # doesn't lazy load one author at a time.
+    columns = list(Message.__table__.c) + list(User.__table__.c)
+    sql = (text(RECENT_BY_AUTHOR_SQL.format(
+        columns=', '.join(
+            [f'm.{column.name}' for column in Message.__table__.c] +
+            [f'users.{column.name}' for column in User.__table__.c]),
+        seek=seek, order='ASC' if ascending else 'DESC'))
+        .bindparams(bindparam('author_ids', type_=ARRAY(db.Integer)))
+        .columns(*columns))
+
+    messages = (Message
+                .query
+                .from_statement(sql)
+                .options(contains_eager(Message.user))
+                .params(**params)
+                .all())
+
+    return [list(group) for _, group in
+            groupby(messages, key=lambda msg: msg.user_id)]
+
+
+def timeline_key(message):
+    """Sort and pagination key for timelines: timestamp, ties broken by id."""
+
+    return (message.timestamp, message.id)
+
+
+def merge_timelines(timelines, limit, ascending=False):
+    """K-way merge of sorted message lists into one timeline.
+
+    Lists are newest first unless `ascending`. Messages appearing in more
+    than one list are only kept once.
+    """
+
+    merged = []
+    seen = set()
+
+    for msg in merge(*timelines, key=timeline_key, reverse=not ascending):
+        if len(merged) == limit:
+            break
+        if msg.id not in seen:
+            seen.add(msg.id)
+            merged.append(msg)
+
+    return merged
+
+
+def user_messages_page(user_id, per_page, cursor=None):
+    """Return a Page of a user's own messages, newest first."""
+
+    return paginate(Message.query.filter(Message.user_id == user_id),
+                    [Message.timestamp, Message.id], timeline_key,
+                    per_page=per_page, cursor=cursor)
+
+
+def home_timeline(user_id, limit=100,
+                  fanout_threshold=DEFAULT_FANOUT_THRESHOLD, cursor=None):
+    """Return up to `limit` messages of a user's timeline past `cursor`.
+
+    Materialized entries are merged with the newest messages of any
+    celebrity accounts the user follows. Messages come back in scan order
+    for the cursor, ready for `pagination.make_page`.
+    """
+
+    pushed = seek(
+        (Message
+         .query
+         .options(joinedload(Message.user))
+         .join(TimelineEntry, TimelineEntry.message_id == Message.id)
+         .filter(TimelineEntry.user_id == user_id)),
+        [TimelineEntry.timestamp, TimelineEntry.message_id],
+        cursor).limit(limit).all()
+
+    celebrity_ids = followed_celebrity_ids(user_id, fanout_threshold)
+    if not celebrity_ids:
+        return pushed
+
+    pulled = recent_messages_by_author(celebrity_ids, limit, cursor)
+    return merge_timelines([pushed] + pulled, limit, is_ascending(cursor))
+
+
+REBUILD_SQL = text("""
+    WITH celebrities AS (
+        SELECT user_being_followed_id AS id
+        FROM follows
+        GROUP BY user_being_followed_id
+        HAVING count(*) >= :fanout_threshold
+    )
+    INSERT INTO timeline_entries (user_id, message_id, timestamp)
+    SELECT user_id, message_id, timestamp
+    FROM (
+        SELECT f.user_id,
+               m.id AS message_id,
+               m.timestamp,
+               row_number() OVER (PARTITION BY f.user_id
+                                  ORDER BY m.timestamp DESC, m.id DESC) AS rn
+        FROM messages AS m
+        JOIN (SELECT user_following_id AS user_id,
+                     user_being_followed_id AS author_id
+              FROM follows
+              WHERE user_being_followed_id NOT IN (SELECT id FROM celebrities)
+              UNION ALL
+              SELECT id, id FROM users) AS f
+          ON m.user_id = f.author_id
+    ) AS ranked
+    WHERE rn <= :depth
+""")
+
+TRIM_SQL = text("""
+    DELETE FROM timeline_entries AS t
+    USING (
+        SELECT user_id,
+               message_id,
+               row_number() OVER (PARTITION BY user_id
+                                  ORDER BY timestamp DESC, message_id DESC) AS rn
+        FROM timeline_entries
+    ) AS ranked
+    WHERE t.user_id = ranked.user_id
+      AND t.message_id = ranked.message_id
+      AND ranked.rn > :depth
+""")
+
+
+def rebuild_timelines(depth=DEFAULT_TIMELINE_DEPTH,
+                      fanout_threshold=DEFAULT_FANOUT_THRESHOLD):
+    """Rebuild every timeline from the follows and messages tables.
+
+    Used to backfill existing data; returns the number of entries written.
+    """
+
+    db.session.execute(TimelineEntry.__table__.delete())
+    result = db.session.execute(REBUILD_SQL, {
+        'depth': depth,
+        'fanout_threshold': fanout_threshold,
+    })
+    db.session.commit()
+    return result.rowcount
+
+
+def trim_timelines(depth=DEFAULT_TIMELINE_DEPTH):
+    """Keep only the `depth` newest entries of each timeline.
+
+    Returns the number of entries removed.
+    """
+
+    result = db.session.execute(TRIM_SQL, {'depth': depth})
+    db.session.commit()
+    return result.rowcount